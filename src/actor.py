@@ -0,0 +1,51 @@
+"""Apify Actor, with a minimal stand-in for local runs outside the Apify environment."""
+
+from __future__ import annotations
+
+
+# Apify SDK imports - only available in Apify environment
+try:
+    from apify import Actor  # type: ignore
+except ImportError:
+    # Fallback for local development
+    class Actor:  # type: ignore
+        class log:
+            @staticmethod
+            def debug(msg: str) -> None:
+                pass
+
+            @staticmethod
+            def info(msg: str) -> None:
+                print(f"[INFO] {msg}")
+
+            @staticmethod
+            def warning(msg: str) -> None:
+                print(f"[WARNING] {msg}")
+
+            @staticmethod
+            def error(msg: str) -> None:
+                print(f"[ERROR] {msg}")
+
+        @staticmethod
+        async def get_input():
+            return {}
+
+        @staticmethod
+        async def push_data(data):
+            print(f"[DATA] {data}")
+
+        @staticmethod
+        async def set_value(key, value, **kwargs):
+            print(f"[STORE] Set {key}")
+
+        @staticmethod
+        async def open_key_value_store():
+            return None
+
+        @staticmethod
+        async def create_proxy_configuration(**kwargs):
+            return None
+
+        @staticmethod
+        async def set_status_message(message, **kwargs):
+            print(f"[STATUS] {message}")
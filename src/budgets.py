@@ -0,0 +1,329 @@
+"""Memory admission control for downloads and the scratch space they are written to."""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from actor import Actor
+
+
+# ============================================================ #
+#                   MEMORY ADMISSION CONTROL                   #
+# ============================================================ #
+
+# yt-dlp download buffer held per active download (matches 'buffersize' in the base options)
+YDL_BUFFER_SIZE = 1024 * 1024 * 16
+
+# Used to estimate the file size from 'duration' when yt-dlp reports no size (bytes/second, ~4 Mbit/s)
+ESTIMATED_BYTES_PER_SECOND = 512 * 1024
+
+# Assumed size when neither size nor duration is known
+DEFAULT_DOWNLOAD_ESTIMATE = 64 * 1024 * 1024
+
+# Share of the container memory given to downloads when no explicit budget is configured
+DEFAULT_MEMORY_BUDGET_SHARE = 0.5
+DEFAULT_MEMORY_BUDGET_MB = 1024
+
+
+def _estimate_download_footprint(info: Dict[str, Any]) -> int:
+    """
+    Estimate the peak memory a download needs from the extracted info dict.
+
+    The whole media file is read into memory before it is stored, on top of yt-dlp's
+    download buffer, so the estimate is the expected file size plus the buffer.
+    """
+    size = info.get('filesize') or info.get('filesize_approx')
+
+    if not size and info.get('requested_formats'):
+        parts = [f.get('filesize') or f.get('filesize_approx') for f in info['requested_formats']]
+        if all(parts):
+            size = sum(parts)
+
+    if not size and info.get('duration'):
+        try:
+            size = float(info['duration']) * ESTIMATED_BYTES_PER_SECOND
+        except (TypeError, ValueError):
+            size = None
+
+    return int(size or DEFAULT_DOWNLOAD_ESTIMATE) + YDL_BUFFER_SIZE
+
+
+def _default_memory_budget_bytes() -> int:
+    """Derive the download memory budget from the container memory limit, if known."""
+    memory_mb = os.environ.get('ACTOR_MEMORY_MBYTES') or os.environ.get('APIFY_MEMORY_MBYTES')
+    try:
+        if memory_mb:
+            return int(int(memory_mb) * DEFAULT_MEMORY_BUDGET_SHARE) * 1024 * 1024
+    except ValueError:
+        pass
+    return DEFAULT_MEMORY_BUDGET_MB * 1024 * 1024
+
+
+class ByteBudget:
+    """
+    Admission controller that only starts jobs whose estimated footprint fits a byte budget.
+
+    A job larger than the whole budget is still admitted, but only when nothing else is
+    running, so oversized videos cannot deadlock the run.
+    """
+
+    def __init__(self, budget_bytes: int) -> None:
+        self.budget_bytes = max(int(budget_bytes), 1)
+        self._used = 0
+        self._active = 0
+        self._condition: asyncio.Condition | None = None
+        # Waiting jobs: ticket -> (nbytes, priority)
+        self._waiting: Dict[object, tuple[int, float | None]] = {}
+        self._stats = {
+            'admitted': 0,
+            'waited': 0,
+            'wait_seconds': 0.0,
+            'oversized': 0,
+            'peak_bytes': 0,
+            'peak_active': 0,
+            'estimated_bytes_total': 0,
+        }
+
+    def configure(self, budget_bytes: int) -> None:
+        """Change the budget (only before downloads start)."""
+        self.budget_bytes = max(int(budget_bytes), 1)
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Created lazily so it binds to the running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _fits(self, nbytes: int) -> bool:
+        return self._active == 0 or self._used + nbytes <= self.budget_bytes
+
+    def _admissible(self, ticket: object, nbytes: int, priority: float | None) -> bool:
+        # Among waiting jobs that fit, lower priority values go first
+        if not self._fits(nbytes):
+            return False
+        if priority is None:
+            return True
+        return not any(
+            other_priority is not None and other_priority < priority and self._fits(other_bytes)
+            for other, (other_bytes, other_priority) in self._waiting.items() if other is not ticket
+        )
+
+    async def acquire(self, nbytes: int, priority: float | None = None) -> None:
+        """
+        Wait until a job of nbytes fits in the remaining budget, then reserve it.
+
+        Args:
+            nbytes: Estimated footprint of the job
+            priority: Optional ordering key; when several waiting jobs fit, the one with
+                the lowest value is admitted first (None keeps wake-up order)
+        """
+        condition = self._get_condition()
+        async with condition:
+            if self._waiting or not self._fits(nbytes):
+                ticket = object()
+                self._waiting[ticket] = (nbytes, priority)
+                wait_started = time.monotonic()
+                try:
+                    await condition.wait_for(lambda: self._admissible(ticket, nbytes, priority))
+                finally:
+                    del self._waiting[ticket]
+                    # Others may have been held back by this job's priority
+                    condition.notify_all()
+                waited = time.monotonic() - wait_started
+                if waited > 0.001:
+                    self._stats['waited'] += 1
+                    self._stats['wait_seconds'] += waited
+
+            if nbytes > self.budget_bytes:
+                self._stats['oversized'] += 1
+            self._used += nbytes
+            self._active += 1
+            self._stats['admitted'] += 1
+            self._stats['estimated_bytes_total'] += nbytes
+            self._stats['peak_bytes'] = max(self._stats['peak_bytes'], self._used)
+            self._stats['peak_active'] = max(self._stats['peak_active'], self._active)
+
+    async def release(self, nbytes: int) -> None:
+        """Return a reservation to the budget and wake up waiting jobs."""
+        condition = self._get_condition()
+        async with condition:
+            self._used = max(self._used - nbytes, 0)
+            self._active = max(self._active - 1, 0)
+            condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, nbytes: int, priority: float | None = None):
+        """Hold a budget reservation for the enclosed block."""
+        await self.acquire(nbytes, priority)
+        try:
+            yield
+        finally:
+            await self.release(nbytes)
+
+    def stats(self) -> Dict[str, Any]:
+        """Budget usage for the run metrics."""
+        return {
+            'budget_bytes': self.budget_bytes,
+            'in_use_bytes': self._used,
+            'active_jobs': self._active,
+            'peak_utilization': round(self._stats['peak_bytes'] / self.budget_bytes, 3),
+            **{k: (round(v, 3) if isinstance(v, float) else v) for k, v in self._stats.items()},
+        }
+
+
+# Memory held by in-flight downloads
+_memory_budget = ByteBudget(_default_memory_budget_bytes())
+
+
+# ============================================================ #
+#                        SCRATCH SPACE                         #
+# ============================================================ #
+
+SCRATCH_DIR_PREFIX = 'igdl-scratch-'
+
+# Memory-backed filesystem used when scratchStorage is 'tmpfs'
+TMPFS_PATH = '/dev/shm'
+
+# Share of the free disk space used as the scratch quota when none is configured
+DEFAULT_SCRATCH_QUOTA_SHARE = 0.8
+
+
+def _clear_directory(directory: str) -> None:
+    """Remove files created by previous download attempts in a temp directory."""
+    for entry in Path(directory).iterdir():
+        try:
+            if entry.is_dir():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+        except Exception:
+            continue
+
+
+def _pid_alive(pid: int) -> bool:
+    """Check whether a process with this pid is still running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ScratchSpace:
+    """
+    Reusable per-worker scratch directories for downloads.
+
+    Directories are created once and recycled between downloads (cleared on release),
+    reservations are checked against a disk quota, and the whole scratch root is
+    removed at exit. Roots left behind by crashed runs are removed on startup.
+    """
+
+    def __init__(self) -> None:
+        self.storage = 'disk'
+        self.quota_bytes: int | None = None
+        self.root: Path | None = None
+        self._free_dirs: List[Path] = []
+        self._dir_count = 0
+        self._quota: ByteBudget | None = None
+        self._root_lock: asyncio.Lock | None = None
+        self._stats = {'acquired': 0, 'reused': 0, 'stale_roots_removed': 0}
+
+    def configure(self, storage: str = 'disk', quota_bytes: int | None = None) -> None:
+        """Choose tmpfs or disk and the quota (only before the first download)."""
+        self.storage = 'tmpfs' if (storage or '').lower() == 'tmpfs' else 'disk'
+        self.quota_bytes = quota_bytes
+
+    def _base_dir(self) -> str:
+        if self.storage == 'tmpfs':
+            if os.path.isdir(TMPFS_PATH) and os.access(TMPFS_PATH, os.W_OK):
+                return TMPFS_PATH
+            Actor.log.warning(f"tmpfs scratch requested but {TMPFS_PATH} is not writable, using disk")  # type: ignore
+            self.storage = 'disk'
+        return tempfile.gettempdir()
+
+    def _remove_stale_roots(self, base_dir: str) -> None:
+        for entry in Path(base_dir).glob(f'{SCRATCH_DIR_PREFIX}*'):
+            try:
+                pid = int(entry.name[len(SCRATCH_DIR_PREFIX):].split('-', 1)[0])
+            except ValueError:
+                continue
+            if pid != os.getpid() and not _pid_alive(pid):
+                shutil.rmtree(entry, ignore_errors=True)
+                self._stats['stale_roots_removed'] += 1
+
+    def _ensure_root(self) -> Path:
+        if self.root is None:
+            base_dir = self._base_dir()
+            self._remove_stale_roots(base_dir)
+            self.root = Path(tempfile.mkdtemp(prefix=f'{SCRATCH_DIR_PREFIX}{os.getpid()}-', dir=base_dir))
+            atexit.register(self.cleanup)
+
+            quota = self.quota_bytes
+            if not quota:
+                quota = int(shutil.disk_usage(self.root).free * DEFAULT_SCRATCH_QUOTA_SHARE)
+            self._quota = ByteBudget(quota)
+            Actor.log.info(f"Scratch space: {self.root} ({self.storage}, quota {quota // (1024 * 1024)}MB)")  # type: ignore
+        return self.root
+
+    async def _get_root(self) -> Path:
+        # Created lazily so it binds to the running event loop
+        if self._root_lock is None:
+            self._root_lock = asyncio.Lock()
+        # Serialized so concurrent first downloads share one root and one quota
+        async with self._root_lock:
+            if self.root is None:
+                # Filesystem work runs in a thread, so removing stale roots does not stall the loop
+                await asyncio.to_thread(self._ensure_root)
+            return self.root
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, expected_bytes: int):
+        """Reserve quota and lend a worker directory for the enclosed download."""
+        root = self.root or await self._get_root()
+        # Released into the same budget it was taken from
+        quota = self._quota
+        await quota.acquire(expected_bytes)
+        if self._free_dirs:
+            work_dir = self._free_dirs.pop()
+            self._stats['reused'] += 1
+        else:
+            self._dir_count += 1
+            work_dir = root / f'worker-{self._dir_count}'
+            await asyncio.to_thread(work_dir.mkdir, parents=True, exist_ok=True)
+        self._stats['acquired'] += 1
+        try:
+            yield work_dir
+        finally:
+            await asyncio.to_thread(_clear_directory, str(work_dir))
+            self._free_dirs.append(work_dir)
+            await quota.release(expected_bytes)
+
+    def cleanup(self) -> None:
+        """Remove the scratch root (registered with atexit, also called at the end of a run)."""
+        if self.root is not None:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+            self._free_dirs = []
+            self._dir_count = 0
+            self._root_lock = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Scratch usage for the run metrics."""
+        stats = {'storage': self.storage, 'worker_dirs': self._dir_count, **self._stats}
+        if self._quota is not None:
+            quota = self._quota.stats()
+            stats.update({'quota_bytes': quota['budget_bytes'], 'peak_reserved_bytes': quota['peak_bytes']})
+        return stats
+
+
+_scratch_space = ScratchSpace()
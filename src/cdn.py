@@ -0,0 +1,225 @@
+"""Pooled HTTP client for media downloads from the CDN, with a DNS cache."""
+
+from __future__ import annotations
+
+import collections
+import contextlib
+import importlib
+import importlib.util
+import socket
+import threading
+import time
+from typing import Any, Dict
+
+from sinks import IntegrityError
+from fixtures import _fixtures
+
+
+# ============================================================ #
+#                       CDN HTTP CLIENT                        #
+# ============================================================ #
+
+HTTPX_AVAILABLE = importlib.util.find_spec('httpx') is not None
+H2_AVAILABLE = importlib.util.find_spec('h2') is not None
+CDN_MAX_CONNECTIONS = 32
+CDN_KEEPALIVE_EXPIRY = 90.0
+CDN_CHUNK_SIZE = 1024 * 1024
+DNS_CACHE_TTL = 300.0
+
+
+class DnsCache:
+    """
+    TTL cache in front of socket.getaddrinfo.
+
+    Installed process-wide, so the CDN client and yt-dlp's own connections both skip
+    repeated lookups of the same few CDN hosts.
+    """
+
+    def __init__(self, ttl: float = DNS_CACHE_TTL) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[tuple, tuple[float, Any]] = {}
+        self._original: Any = None
+        self._stats = {'hits': 0, 'misses': 0, 'lookup_seconds': 0.0}
+
+    def install(self) -> None:
+        if self._original is None:
+            self._original = socket.getaddrinfo
+            socket.getaddrinfo = self._getaddrinfo
+
+    def uninstall(self) -> None:
+        if self._original is not None:
+            socket.getaddrinfo = self._original
+            self._original = None
+
+    def _getaddrinfo(self, host: Any, port: Any, *args: Any, **kwargs: Any) -> Any:
+        key = (host, port, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._stats['hits'] += 1
+                return list(entry[1])
+        started = time.perf_counter()
+        result = self._original(host, port, *args, **kwargs)
+        with self._lock:
+            self._stats['misses'] += 1
+            self._stats['lookup_seconds'] += time.perf_counter() - started
+            self._entries[key] = (now + self.ttl, result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['lookup_seconds'] = round(stats['lookup_seconds'], 3)
+        return stats
+
+
+class CdnHttpClient:
+    """
+    Shared per-run HTTP client for CDN media fetches.
+
+    One pooled httpx client (HTTP/2 when the h2 package is installed) keeps connections
+    to the CDN hosts alive across videos, so later fetches skip TCP and TLS setup, and
+    HTTP/2 multiplexes concurrent fetches from the same host over one connection.
+    Connection setup is traced per request for the reuse ratio and handshake time.
+    Without httpx, callers fall back to yt-dlp's own networking.
+    """
+
+    def __init__(self) -> None:
+        self._client: Any = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            'requests': 0,
+            'new_connections': 0,
+            'bytes': 0,
+            'http_versions': collections.Counter(),
+        }
+        self._handshake_seconds = 0.0
+        self._ttfb_seconds = 0.0
+
+    @property
+    def available(self) -> bool:
+        return HTTPX_AVAILABLE
+
+    def _get_client(self) -> Any:
+        with self._lock:
+            if self._client is None:
+                httpx = importlib.import_module('httpx')
+                self._client = httpx.Client(
+                    http2=H2_AVAILABLE,
+                    limits=httpx.Limits(
+                        max_connections=CDN_MAX_CONNECTIONS,
+                        max_keepalive_connections=CDN_MAX_CONNECTIONS,
+                        keepalive_expiry=CDN_KEEPALIVE_EXPIRY,
+                    ),
+                    timeout=httpx.Timeout(30.0, read=60.0),
+                    follow_redirects=True,
+                )
+            return self._client
+
+    @contextlib.contextmanager
+    def stream(self, url: str, headers: Dict[str, str] | None = None) -> Any:
+        """Open a streamed GET (blocking; call from a worker thread) and yield the response."""
+        setup: Dict[str, float] = {}
+
+        def trace(event_name: str, info: Dict[str, Any]) -> None:
+            phase, _, stage = event_name.rpartition('.')
+            if phase in ('connection.connect_tcp', 'connection.start_tls'):
+                if stage == 'started':
+                    setup[phase] = time.perf_counter()
+                elif stage == 'complete':
+                    setup[phase] = time.perf_counter() - setup.get(phase, time.perf_counter())
+
+        started = time.perf_counter()
+        _fixtures.count_request()
+        with self._get_client().stream('GET', url, headers=headers or {}, extensions={'trace': trace}) as response:
+            response.raise_for_status()
+            with self._lock:
+                self._stats['requests'] += 1
+                self._stats['http_versions'][response.http_version] += 1
+                self._ttfb_seconds += time.perf_counter() - started
+                if setup:
+                    self._stats['new_connections'] += 1
+                    self._handshake_seconds += sum(setup.values())
+            yield response
+
+    def add_bytes(self, count: int) -> None:
+        with self._lock:
+            self._stats['bytes'] += count
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['http_versions'] = dict(self._stats['http_versions'])
+            requests, new_connections = stats['requests'], stats['new_connections']
+            stats['reuse_ratio'] = round(1 - new_connections / requests, 3) if requests else None
+            stats['mean_handshake_ms'] = round(self._handshake_seconds / new_connections * 1000, 1) if new_connections else None
+            stats['mean_ttfb_ms'] = round(self._ttfb_seconds / requests * 1000, 1) if requests else None
+        return stats
+
+
+_dns_cache = DnsCache()
+_cdn_client = CdnHttpClient()
+
+
+@contextlib.contextmanager
+def _open_media_stream(ydl: Any, fmt: Dict[str, Any]) -> Any:
+    """
+    Open a format's URL for streaming (blocking; call from a worker thread).
+
+    Uses the shared CDN client when httpx is installed, otherwise yt-dlp's networking.
+    Yields (chunk iterator, Content-Length or None); a body cut short by the server
+    raises IntegrityError.
+    """
+    headers = fmt.get('http_headers') or {}
+    if _cdn_client.available:
+        httpx = importlib.import_module('httpx')
+        with _cdn_client.stream(fmt['url'], headers) as response:
+
+            def chunks() -> Any:
+                try:
+                    # Raw bytes: media is not content-encoded and must match Content-Length
+                    for chunk in response.iter_raw(CDN_CHUNK_SIZE):
+                        _cdn_client.add_bytes(len(chunk))
+                        yield chunk
+                except httpx.RemoteProtocolError as read_error:
+                    raise IntegrityError(f"format {fmt.get('format_id')}: {read_error}") from read_error
+
+            yield chunks(), response.headers.get('Content-Length')
+        return
+
+    from yt_dlp.networking import Request
+    from yt_dlp.networking.exceptions import IncompleteRead
+
+    response = ydl.urlopen(Request(fmt['url'], headers=headers))
+    try:
+
+        def chunks() -> Any:
+            while True:
+                try:
+                    chunk = response.read(CDN_CHUNK_SIZE)
+                except IncompleteRead as read_error:
+                    raise IntegrityError(f"format {fmt.get('format_id')}: {read_error}") from read_error
+                if not chunk:
+                    return
+                yield chunk
+
+        yield chunks(), response.headers.get('Content-Length')
+    finally:
+        response.close()
+
+
+def _check_content_length(fmt: Dict[str, Any], received: int, content_length: str | None) -> bool:
+    """Raise IntegrityError when a complete body does not match its Content-Length."""
+    if content_length is None or not content_length.isdigit():
+        return False
+    if received != int(content_length):
+        raise IntegrityError(f"format {fmt.get('format_id')}: received {received} of {content_length} bytes")
+    return True
@@ -0,0 +1,250 @@
+"""Per-stage and per-URL deadlines and the wall-clock budget of the whole run."""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextvars
+import os
+import time
+from datetime import UTC, datetime
+from typing import Any, Dict, List
+
+from actor import Actor
+from metrics import _m_stage_in_flight, _m_stage_seconds
+
+
+# ============================================================ #
+#                          DEADLINES                           #
+# ============================================================ #
+
+# Per-stage limits (seconds); a stage also ends at the URL deadline or the run budget
+STAGE_TIMEOUTS: Dict[str, float] = {'extract': 180.0, 'download': 900.0, 'postprocess': 600.0, 'store': 300.0}
+DEFAULT_URL_TIMEOUT = 1800.0
+
+# Kept free at the end of the run budget to flush results and record unfinished URLs
+RUN_BUDGET_GRACE_SECONDS = 60.0
+
+# A URL's task is cancelled this long after its deadline if it did not stop by itself
+DEADLINE_HARD_STOP_SLACK = 15.0
+
+# Socket read timeout for yt-dlp, so a stalled connection fails instead of hanging a thread
+YDL_SOCKET_TIMEOUT = 30.0
+
+UNFINISHED_URLS_KEY = 'UNFINISHED_URLS'
+
+# Absolute (monotonic) deadlines of the current URL and stage; copied into worker threads
+_url_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar('url_deadline', default=None)
+_stage_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar('stage_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """A stage, a URL or the whole run ran out of time."""
+
+    def __init__(self, scope: str, seconds: float) -> None:
+        super().__init__(f"Deadline exceeded: {scope} ({round(seconds, 1):g}s)")
+        self.scope = scope
+        self.seconds = seconds
+
+
+class RunBudget:
+    """
+    Wall-clock budget for the whole run.
+
+    Work stops RUN_BUDGET_GRACE_SECONDS before the budget ends: running stages time out,
+    listings stop after the current item and queued URLs are not started. URLs that did
+    not finish are collected so a later run can pick them up.
+    """
+
+    def __init__(self) -> None:
+        self.budget_seconds: float | None = None
+        self.grace_seconds = RUN_BUDGET_GRACE_SECONDS
+        self._stop_at: float | None = None
+        self.url_timeout = DEFAULT_URL_TIMEOUT
+        self.stage_timeouts = dict(STAGE_TIMEOUTS)
+        self.unfinished: List[str] = []
+        # CLI: unfinished URLs go to this file instead of the key-value store
+        self.unfinished_path: str | None = None
+        self._timeouts: collections.Counter = collections.Counter()
+
+    def configure(
+        self,
+        budget_seconds: float | None = None,
+        url_timeout: float | None = None,
+        stage_timeouts: Dict[str, float] | None = None,
+        grace_seconds: float | None = None,
+    ) -> None:
+        if budget_seconds:
+            self.budget_seconds = float(budget_seconds)
+            # Short budgets keep a proportionally smaller grace period
+            if grace_seconds is None:
+                grace_seconds = min(RUN_BUDGET_GRACE_SECONDS, self.budget_seconds * 0.1)
+            self.grace_seconds = grace_seconds
+            self._stop_at = time.monotonic() + self.budget_seconds - self.grace_seconds
+        if url_timeout:
+            self.url_timeout = float(url_timeout)
+        for stage, seconds in (stage_timeouts or {}).items():
+            if stage in self.stage_timeouts and seconds:
+                self.stage_timeouts[stage] = float(seconds)
+
+    def remaining(self) -> float | None:
+        """Seconds until work has to stop, or None without a budget."""
+        if self._stop_at is None:
+            return None
+        return self._stop_at - time.monotonic()
+
+    @property
+    def exhausted(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def record_timeout(self, scope: str, count: int = 1) -> None:
+        self._timeouts[scope] += count
+
+    def add_unfinished(self, url: str) -> None:
+        self.unfinished.append(url)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'budget_seconds': self.budget_seconds,
+            'exhausted': self.exhausted,
+            'url_timeout_seconds': self.url_timeout,
+            'stage_timeout_seconds': dict(self.stage_timeouts),
+            'timeouts': dict(self._timeouts),
+            'unfinished_urls': len(self.unfinished),
+        }
+
+
+_run_budget = RunBudget()
+
+
+def _time_left(stage: str) -> tuple[float | None, str]:
+    """
+    Seconds left for a stage: the earliest of its own limit, the URL deadline and the run budget.
+
+    Returns:
+        Tuple of (seconds or None when unlimited, scope of the binding deadline)
+    """
+    limits: List[tuple[float, str]] = []
+    if stage in _run_budget.stage_timeouts:
+        limits.append((_run_budget.stage_timeouts[stage], stage))
+    url_deadline = _url_deadline.get()
+    if url_deadline is not None:
+        limits.append((url_deadline - time.monotonic(), 'url'))
+    remaining = _run_budget.remaining()
+    if remaining is not None:
+        limits.append((remaining, 'run'))
+    if not limits:
+        return None, stage
+    return min(limits)
+
+
+async def _run_stage(stage: str, awaitable: Any) -> Any:
+    """
+    Await one stage of a URL's processing under its deadline.
+
+    Blocking work in worker threads cannot be interrupted from here; threads call
+    _check_deadline() between chunks and stop on their own once the deadline passed.
+
+    Raises:
+        DeadlineExceeded: The stage, URL or run deadline passed first
+    """
+    seconds, scope = _time_left(stage)
+    if seconds is not None and seconds <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        _run_budget.record_timeout(scope)
+        raise DeadlineExceeded(scope, 0)
+    deadline = time.monotonic() + seconds if seconds is not None else None
+    token = _stage_deadline.set(deadline)
+    started = time.perf_counter()
+    outcome = 'error'
+    _m_stage_in_flight.inc(stage=stage)
+    try:
+        result = await asyncio.wait_for(awaitable, seconds)
+        outcome = 'success'
+        return result
+    except asyncio.TimeoutError as timeout_error:
+        outcome = 'timeout'
+        _run_budget.record_timeout(scope)
+        raise DeadlineExceeded(scope, seconds or 0) from timeout_error
+    except DeadlineExceeded:
+        outcome = 'timeout'
+        raise
+    except Exception as stage_error:
+        # A thread that noticed the deadline may surface it wrapped in a yt-dlp error
+        if deadline is not None and time.monotonic() >= deadline:
+            outcome = 'timeout'
+            _run_budget.record_timeout(scope)
+            raise DeadlineExceeded(scope, seconds or 0) from stage_error
+        raise
+    finally:
+        _m_stage_in_flight.dec(stage=stage)
+        _m_stage_seconds.observe(time.perf_counter() - started, stage=stage, outcome=outcome)
+        _stage_deadline.reset(token)
+
+
+def _is_run_budget_error(error: Any) -> bool:
+    """Whether an error (exception or record message) means the run budget ran out."""
+    if isinstance(error, DeadlineExceeded):
+        return error.scope == 'run'
+    return isinstance(error, str) and error.startswith('Deadline exceeded: run')
+
+
+def _check_deadline() -> None:
+    """Raise DeadlineExceeded in a worker thread once its stage deadline has passed."""
+    deadline = _stage_deadline.get()
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded('stage', 0)
+
+
+def _platform_seconds_left() -> float | None:
+    """Seconds until the platform times the run out (ACTOR_TIMEOUT_AT), if the run has a timeout."""
+    timeout_at = os.environ.get('ACTOR_TIMEOUT_AT')
+    if not timeout_at:
+        return None
+    try:
+        return (datetime.fromisoformat(timeout_at.replace('Z', '+00:00')) - datetime.now(UTC)).total_seconds()
+    except ValueError:
+        return None
+
+
+def _parse_stage_timeouts(value: Any) -> Dict[str, float]:
+    """Stage timeouts from an input object ({"download": 600}) or CLI items ("download=600")."""
+    if isinstance(value, dict):
+        items = value.items()
+    else:
+        items = (item.split('=', 1) for item in value or [] if '=' in item)
+    timeouts = {}
+    for stage, seconds in items:
+        stage = str(stage).strip()
+        if stage not in STAGE_TIMEOUTS:
+            raise ValueError(f"Unknown stage '{stage}' (expected one of: {', '.join(STAGE_TIMEOUTS)})")
+        timeouts[stage] = float(seconds)
+    return timeouts
+
+
+def _write_lines(path: str, lines: List[str]) -> None:
+    with open(path, 'w', encoding='utf-8') as output_file:
+        output_file.writelines(f"{line}\n" for line in lines)
+
+
+async def _save_unfinished_urls() -> None:
+    """Record URLs the run did not finish, in a form that can be fed to a later run."""
+    if not _run_budget.unfinished:
+        return
+    urls = list(dict.fromkeys(_run_budget.unfinished))
+    Actor.log.warning(f"Run budget exhausted: {len(urls)} URLs left unfinished")
+    if _run_budget.unfinished_path:
+        await asyncio.to_thread(_write_lines, _run_budget.unfinished_path, urls)
+        Actor.log.info(f"Unfinished URLs written to {_run_budget.unfinished_path}")
+        return
+    try:
+        await Actor.set_value(UNFINISHED_URLS_KEY, {  # type: ignore
+            # Same shape as the 'urls' input, so it can be passed to the next run as is
+            'urls': urls,
+            'recorded_at': datetime.now(UTC).isoformat(),
+        })
+        Actor.log.info(f"Unfinished URLs stored under '{UNFINISHED_URLS_KEY}' in the key-value store")
+    except Exception as store_error:
+        Actor.log.error(f"Could not store unfinished URLs: {store_error}")
@@ -0,0 +1,44 @@
+"""Classification of extraction and download errors."""
+
+from __future__ import annotations
+
+
+# ============================================================ #
+#                     ERROR CLASSIFICATION                     #
+# ============================================================ #
+
+# Errors that mean Instagram is pushing back on this client: hedge right away
+BOT_CHECK_PATTERNS = (
+    "sign in to confirm",
+    "bot",
+    "suspicious activity",
+    "unusual activity",
+    "too many requests",
+    "rate limit",
+    "429",
+    "checkpoint",
+)
+
+
+def _is_bot_check_error(error_msg: str) -> bool:
+    """Check if an extraction error is a bot check or rate limit rather than a plain failure."""
+    error_lower = error_msg.lower()
+    return any(pattern in error_lower for pattern in BOT_CHECK_PATTERNS)
+
+
+def _classify_error(error_msg: str) -> str:
+    """Coarse error class used as a metrics label."""
+    error_lower = error_msg.lower()
+    if 'deadline exceeded' in error_lower:
+        return 'deadline'
+    if _is_bot_check_error(error_msg):
+        return 'bot_check'
+    if any(pattern in error_lower for pattern in ('login required', 'authentication', 'session expired')):
+        return 'auth'
+    if any(pattern in error_lower for pattern in ('timeout', 'timed out', 'connection', 'network', 'temporary failure')):
+        return 'network'
+    if any(pattern in error_lower for pattern in ('500', '502', '503', '504', 'server error', 'bad gateway', 'service unavailable')):
+        return 'server'
+    if any(pattern in error_lower for pattern in ('received', 'incomplete', 'truncated')):
+        return 'integrity'
+    return 'other'
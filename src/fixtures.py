@@ -0,0 +1,399 @@
+"""Recording of live exchanges into fixture files and their offline replay."""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextvars
+import copy
+import functools
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from actor import Actor
+from startup import yt_dlp
+from progress import _progress_reporter
+from profiling import LOOP_STALL_BASELINE_SLACK, _loop_monitor
+from deadlines import DeadlineExceeded, _check_deadline
+from sinks import (
+    SINK_CHUNK_SIZE,
+    _HashingWriter,
+    _LocalFileWriter,
+    OutputSink,
+    _generate_safe_key,
+    _guess_content_type,
+)
+
+
+# ============================================================ #
+#                       REPLAY FIXTURES                        #
+# ============================================================ #
+
+FIXTURE_MODES = ('record', 'replay')
+FIXTURE_MEDIA_MODES = ('placeholder', 'bytes')
+FIXTURE_EXCHANGES_GLOB = 'exchanges*.jsonl'
+FIXTURE_MEDIA_DIR = 'media'
+
+# Replayed waits are sliced so a deadline can stop them
+FIXTURE_WAIT_SLICE = 0.5
+
+# Relative slack for throughput and peak memory before a replay counts as a regression
+BASELINE_TOLERANCE = 0.1
+REGRESSION_EXIT_CODE = 3
+
+# Input URL the current task (and its worker threads) works on
+_fixture_url: contextvars.ContextVar[str | None] = contextvars.ContextVar('fixture_url', default=None)
+# HTTP request counter of the exchange being recorded
+_fixture_requests: contextvars.ContextVar[List[int] | None] = contextvars.ContextVar('fixture_requests', default=None)
+
+
+class FixtureMissing(Exception):
+    """Replay needed an exchange that was not recorded."""
+
+
+class ReplayedError(Exception):
+    """An error recorded for an exchange, raised again on replay."""
+
+
+class FixtureStore:
+    """
+    Records live exchanges into fixture files and replays them offline.
+
+    Exchanges are page fetches, extractions (the yt-dlp info dict) and media fetches
+    (format, size and the bytes or a sized placeholder). Each keeps its duration and
+    the HTTP requests it made. Replay serves the recorded outcomes of a key in order,
+    with the recorded timing scaled by time_scale, so retries and hedged extractions
+    cost what they cost live; it never touches the network, and an exchange that was
+    not recorded raises FixtureMissing.
+    """
+
+    def __init__(self) -> None:
+        self.mode: str | None = None
+        self.directory: Path | None = None
+        self.media_mode = 'placeholder'
+        self.time_scale = 1.0
+        self._lock = threading.Lock()
+        self._file: Any = None
+        self._recorded: Dict[tuple[str, str], List[Dict[str, Any]]] = {}
+        self._served: collections.Counter = collections.Counter()
+        # HTTP requests per input URL, made live (record) or stood for by replayed exchanges
+        self._requests: collections.Counter = collections.Counter()
+        self._stats: collections.Counter = collections.Counter()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == 'replay'
+
+    def configure(self, mode: str, directory: str, media_mode: str = 'placeholder', time_scale: float = 1.0) -> None:
+        if mode not in FIXTURE_MODES:
+            raise ValueError(f"Unknown fixture mode '{mode}' (expected one of: {', '.join(FIXTURE_MODES)})")
+        if media_mode not in FIXTURE_MEDIA_MODES:
+            raise ValueError(f"Unknown fixture media mode '{media_mode}' (expected one of: {', '.join(FIXTURE_MEDIA_MODES)})")
+        self.mode = mode
+        self.directory = Path(directory).expanduser()
+        self.media_mode = media_mode
+        self.time_scale = max(0.0, float(time_scale))
+        if mode == 'record':
+            (self.directory / FIXTURE_MEDIA_DIR).mkdir(parents=True, exist_ok=True)
+            # One file per process, so shards can record side by side
+            self._file = (self.directory / f'exchanges.{os.getpid()}.jsonl').open('a', encoding='utf-8')
+            self._count_ydl_requests()
+        else:
+            self._load()
+
+    def describe(self) -> Dict[str, Any] | None:
+        """Settings for shard processes."""
+        if self.mode is None:
+            return None
+        return {
+            'mode': self.mode,
+            'directory': str(self.directory),
+            'media_mode': self.media_mode,
+            'time_scale': self.time_scale,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load(self) -> None:
+        paths = sorted(self.directory.glob(FIXTURE_EXCHANGES_GLOB))
+        if not paths:
+            raise FileNotFoundError(f"No recorded exchanges in {self.directory}")
+        for path in paths:
+            with path.open(encoding='utf-8') as exchanges_file:
+                for line in exchanges_file:
+                    if line.strip():
+                        exchange = json.loads(line)
+                        self._recorded.setdefault((exchange['kind'], exchange['key']), []).append(exchange)
+        Actor.log.info(f"Replaying {sum(len(outcomes) for outcomes in self._recorded.values())} recorded exchanges from {self.directory}")
+
+    def _count_ydl_requests(self) -> None:
+        """Count yt-dlp's HTTP requests towards the exchange being recorded."""
+        ydl_class = yt_dlp.YoutubeDL
+        if getattr(ydl_class.urlopen, 'counts_fixture_requests', False):
+            return
+        urlopen = ydl_class.urlopen
+
+        def counting_urlopen(ydl: Any, request: Any) -> Any:
+            self.count_request()
+            return urlopen(ydl, request)
+
+        counting_urlopen.counts_fixture_requests = True  # type: ignore
+        ydl_class.urlopen = counting_urlopen
+
+    def count_request(self) -> None:
+        requests = _fixture_requests.get()
+        if requests is not None:
+            requests[0] += 1
+
+    def _record(self, exchange: Dict[str, Any]) -> None:
+        exchange['url'] = _fixture_url.get()
+        line = json.dumps(exchange, default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._requests[exchange['url'] or exchange['key']] += exchange['http_requests']
+            self._stats[f"recorded_{exchange['kind']}"] += 1
+
+    def _next(self, kind: str, key: str) -> Dict[str, Any]:
+        with self._lock:
+            outcomes = self._recorded.get((kind, key))
+            if not outcomes:
+                self._stats['missing'] += 1
+                raise FixtureMissing(f"No recorded {kind} exchange for {key}")
+            index = self._served[(kind, key)]
+            self._served[(kind, key)] += 1
+            # Once the recorded outcomes run out, the last one repeats
+            exchange = outcomes[min(index, len(outcomes) - 1)]
+            self._requests[_fixture_url.get() or key] += exchange['http_requests']
+            self._stats[f"replayed_{kind}"] += 1
+        return exchange
+
+    def _wait(self, seconds: float) -> None:
+        """Sleep for a recorded duration (blocking; in a worker thread)."""
+        wait_until = time.monotonic() + seconds * self.time_scale
+        while (remaining := wait_until - time.monotonic()) > 0:
+            time.sleep(min(remaining, FIXTURE_WAIT_SLICE))
+            _check_deadline()
+
+    def exchange(self, kind: str, key: str, function: Any) -> Any:
+        """
+        Run a blocking exchange live, recording it in record mode, or replay it.
+
+        Call from a worker thread. Results must be JSON serializable; info dicts are
+        sanitized the way yt-dlp writes them to .info.json files.
+        """
+        if self.mode is None:
+            return function()
+        if self.replaying:
+            exchange = self._next(kind, key)
+            self._wait(exchange['seconds'])
+            if 'error' in exchange:
+                raise ReplayedError(exchange['error'])
+            return copy.deepcopy(exchange['result'])
+
+        requests = [0]
+        token = _fixture_requests.set(requests)
+        started = time.perf_counter()
+        try:
+            result = function()
+        except DeadlineExceeded:
+            raise
+        except Exception as error:
+            self._record({'kind': kind, 'key': key, 'seconds': time.perf_counter() - started,
+                          'http_requests': requests[0], 'error': str(error)})
+            raise
+        finally:
+            _fixture_requests.reset(token)
+        recorded = yt_dlp.YoutubeDL.sanitize_info(result) if isinstance(result, dict) else result
+        self._record({'kind': kind, 'key': key, 'seconds': time.perf_counter() - started,
+                      'http_requests': requests[0], 'result': recorded})
+        return result
+
+    def page(self, function: Any) -> Any:
+        """Decorator for blocking page fetches taking the page URL."""
+        @functools.wraps(function)
+        def wrapper(url: str) -> Any:
+            return self.exchange('page', url, lambda: function(url))
+        return wrapper
+
+    def media(self, function: Any) -> Any:
+        """Decorator for _fetch_media(): records the fetch, or writes the recorded media instead."""
+        @functools.wraps(function)
+        async def wrapper(info: Dict[str, Any], quality: str, cookies: str | None, work_dir: str,
+                          sink: OutputSink | None, key_base: str, format_spec: str | None = None) -> Dict[str, Any]:
+            if self.mode is None:
+                return await function(info, quality, cookies, work_dir, sink, key_base, format_spec)
+            key = f"{info.get('id') or info.get('webpage_url')}:{format_spec or quality}"
+            if self.replaying:
+                return await self._replay_media(key, info, work_dir, sink, key_base)
+
+            requests = [0]
+            token = _fixture_requests.set(requests)
+            started = time.perf_counter()
+            try:
+                fetched = await function(info, quality, cookies, work_dir, sink, key_base, format_spec)
+            except DeadlineExceeded:
+                raise
+            except Exception as error:
+                self._record({'kind': 'media', 'key': key, 'seconds': time.perf_counter() - started,
+                              'http_requests': requests[0], 'error': str(error)})
+                raise
+            finally:
+                _fixture_requests.reset(token)
+            await asyncio.to_thread(self._record_media, key, fetched, time.perf_counter() - started, requests[0])
+            return fetched
+        return wrapper
+
+    def _record_media(self, key: str, fetched: Dict[str, Any], seconds: float, http_requests: int) -> None:
+        path = fetched.get('path')
+        size = fetched['stored'][1] if fetched.get('stored') else path.stat().st_size
+        media_file = None
+        if self.media_mode == 'bytes' and path is not None and path.is_file():
+            media_file = f"{fetched['integrity']['sha256']}.{fetched['extension']}"
+            target = self.directory / FIXTURE_MEDIA_DIR / media_file
+            if not target.exists():
+                shutil.copyfile(path, target)
+        self._record({
+            'kind': 'media',
+            'key': key,
+            'seconds': seconds,
+            'http_requests': http_requests,
+            'result': {
+                'format': fetched['format'],
+                'extension': fetched['extension'],
+                'size': size,
+                'file': media_file,
+            },
+        })
+
+    async def _replay_media(self, key: str, info: Dict[str, Any], work_dir: str, sink: OutputSink | None, key_base: str) -> Dict[str, Any]:
+        exchange = self._next('media', key)
+        if 'error' in exchange:
+            await asyncio.sleep(exchange['seconds'] * self.time_scale)
+            raise ReplayedError(exchange['error'])
+        recorded = exchange['result']
+        size = recorded['size']
+        storage_key = _generate_safe_key(key_base, recorded['extension'])
+        content_type = _guess_content_type(recorded['extension'])
+        if sink is not None:
+            inner = await sink.open_writer(storage_key, content_type)
+        else:
+            inner = _LocalFileWriter(Path(work_dir) / storage_key, storage_key, content_type)
+        writer = _HashingWriter(inner, storage_key, content_type)
+        # Recorded bytes when they were kept, otherwise zeros of the recorded size
+        source = None
+        if recorded.get('file'):
+            source = await asyncio.to_thread((self.directory / FIXTURE_MEDIA_DIR / recorded['file']).open, 'rb')
+        placeholder = bytes(min(SINK_CHUNK_SIZE, size))
+        seconds_per_byte = exchange['seconds'] * self.time_scale / size if size else 0.0
+        transfer_id = _progress_reporter.start_transfer(f"{info.get('id') or key} [{recorded['format']}, replay]")
+        try:
+            while writer.size < size:
+                if source is not None:
+                    chunk = await asyncio.to_thread(source.read, SINK_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                else:
+                    chunk = placeholder[:size - writer.size]
+                await writer.write(chunk)
+                _progress_reporter.update(transfer_id, storage_key, writer.size, size)
+                if seconds_per_byte:
+                    await asyncio.sleep(len(chunk) * seconds_per_byte)
+            download_url = await writer.close()
+        except BaseException:
+            _progress_reporter.finish_transfer(transfer_id, success=False)
+            await writer.abort()
+            raise
+        finally:
+            if source is not None:
+                source.close()
+        _progress_reporter.finish_transfer(transfer_id)
+        fetched = {
+            'format': recorded['format'],
+            'extension': recorded['extension'],
+            'integrity': {**writer.digest.result(), 'size_verified': writer.size == size},
+        }
+        if not recorded.get('file'):
+            fetched['placeholder'] = True
+        if sink is not None:
+            fetched['stored'] = (storage_key, writer.size, download_url)
+        else:
+            fetched['path'] = Path(work_dir) / storage_key
+        return fetched
+
+    def counts(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'requests': dict(self._requests), 'exchanges': dict(self._stats)}
+
+    def merge(self, counts: Dict[str, Any]) -> None:
+        """Add a shard process's counts."""
+        with self._lock:
+            self._requests.update(counts.get('requests') or {})
+            self._stats.update(counts.get('exchanges') or {})
+
+    def summary(self, urls: int, duration: float) -> Dict[str, Any]:
+        """Throughput, HTTP requests per URL and peak memory of the run, for baseline checks."""
+        with self._lock:
+            requests = sum(self._requests.values())
+            exchanges = dict(self._stats)
+        return {
+            'mode': self.mode,
+            'time_scale': self.time_scale,
+            'urls': urls,
+            'duration_seconds': round(duration, 3),
+            'urls_per_second': round(urls / duration, 4) if duration > 0 else None,
+            'requests_per_url': round(requests / urls, 3) if urls else None,
+            'peak_memory_bytes': _peak_memory_bytes(),
+            'loop_stalled_seconds': round(_loop_monitor.stalled_seconds, 3) if _loop_monitor.threshold > 0 else None,
+            'exchanges': exchanges,
+        }
+
+
+_fixtures = FixtureStore()
+
+
+def _peak_memory_bytes() -> int | None:
+    """Peak resident memory of this process or any child (shards, ffmpeg), where the OS reports it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _compare_with_baseline(summary: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = BASELINE_TOLERANCE) -> List[str]:
+    """
+    Regressions of a run against a stored baseline summary.
+
+    Throughput, peak memory and the time the event loop was blocked may move by the
+    tolerance; HTTP requests per URL are deterministic under replay and may not grow at all.
+
+    Returns:
+        One message per regressed measure (empty when the run is as good as the baseline)
+    """
+    regressions = []
+    current, expected = summary.get('urls_per_second'), baseline.get('urls_per_second')
+    if current is not None and expected and current < expected * (1 - tolerance):
+        regressions.append(f"throughput {current:.3f} URLs/s is below the baseline {expected:.3f} URLs/s")
+    current, expected = summary.get('requests_per_url'), baseline.get('requests_per_url')
+    if current is not None and expected is not None and current > expected:
+        regressions.append(f"{current:g} HTTP requests per URL, baseline {expected:g}")
+    current, expected = summary.get('peak_memory_bytes'), baseline.get('peak_memory_bytes')
+    if current and expected and current > expected * (1 + tolerance):
+        regressions.append(f"peak memory {current // (1024 * 1024)}MB exceeds the baseline {expected // (1024 * 1024)}MB")
+    current, expected = summary.get('loop_stalled_seconds'), baseline.get('loop_stalled_seconds')
+    if current is not None and expected is not None and current > expected * (1 + tolerance) + LOOP_STALL_BASELINE_SLACK:
+        regressions.append(f"event loop stalled for {current:.2f}s, baseline {expected:.2f}s")
+    return regressions
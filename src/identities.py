@@ -0,0 +1,334 @@
+"""Cookie handling and the pool of cookie identities authenticated extractions are spread across."""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import json
+import time
+from typing import Any, Dict, List
+
+from actor import Actor
+from errors import _classify_error
+
+
+# ============================================================ #
+#                      COOKIE IDENTITIES                       #
+# ============================================================ #
+
+# Extractions one identity may start per minute (0 for no limit)
+IDENTITY_REQUESTS_PER_MINUTE = 30.0
+
+# First rest after a rate limit or challenge; doubles with every further one in a row
+IDENTITY_REST_SECONDS = 300.0
+IDENTITY_MAX_REST_SECONDS = 3600.0
+
+# Authentication failures in a row after which an identity is retired for the run
+IDENTITY_MAX_AUTH_FAILURES = 3
+
+# Waits for a free identity are sliced so a deadline can stop them
+IDENTITY_WAIT_SLICE = 1.0
+
+IDENTITY_STATES = ('healthy', 'resting', 'expired')
+
+
+def _convert_json_cookies_to_netscape(json_cookies: str) -> str:
+    """
+    Convert JSON cookies to Netscape format for yt-dlp.
+    
+    Args:
+        json_cookies: Cookies in JSON format
+        
+    Returns:
+        Cookies in Netscape format
+    """
+    if not json_cookies:
+        return ''
+
+    if "# Netscape HTTP Cookie File" in json_cookies:
+        return json_cookies
+
+    try:
+        import json
+        cookies_data = json.loads(json_cookies)
+        
+        # Netscape format header
+        netscape_cookies = [
+            "# Netscape HTTP Cookie File",
+            "# https://curl.se/docs/http-cookies.html",
+            "# This file was generated by Instagram Video Downloader Actor",
+            ""
+        ]
+        
+        # Handle different JSON formats
+        if isinstance(cookies_data, list):
+            # Array of cookie objects
+            for cookie in cookies_data:
+                if isinstance(cookie, dict):
+                    netscape_line = _format_cookie_as_netscape(cookie)
+                    if netscape_line:
+                        netscape_cookies.append(netscape_line)
+        elif isinstance(cookies_data, dict):
+            # Single cookie object or object with domain keys
+            if 'name' in cookies_data:
+                # Single cookie
+                netscape_line = _format_cookie_as_netscape(cookies_data)
+                if netscape_line:
+                    netscape_cookies.append(netscape_line)
+            else:
+                # Domain-keyed object
+                for domain, domain_cookies in cookies_data.items():
+                    if isinstance(domain_cookies, list):
+                        for cookie in domain_cookies:
+                            if isinstance(cookie, dict):
+                                cookie['domain'] = domain
+                                netscape_line = _format_cookie_as_netscape(cookie)
+                                if netscape_line:
+                                    netscape_cookies.append(netscape_line)
+        
+        return '\n'.join(netscape_cookies)
+        
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        Actor.log.warning(f"Failed to parse JSON cookies: {e}. Assuming already Netscape format.")  # type: ignore
+        return json_cookies
+
+
+def _format_cookie_as_netscape(cookie: Dict[str, Any]) -> str:
+    """
+    Format a single cookie dict as Netscape format line.
+    
+    Args:
+        cookie: Cookie dictionary
+        
+    Returns:
+        Netscape format line or None if invalid
+    """
+    try:
+        domain = cookie.get('domain') or '.instagram.com'
+        host_only = cookie.get('hostOnly') or cookie.get('host_only')
+        include_subdomains = 'FALSE' if host_only else 'TRUE'
+
+        if include_subdomains == 'TRUE' and not domain.startswith('.'):
+            domain = f'.{domain}'
+        if include_subdomains == 'FALSE' and domain.startswith('.'):
+            domain = domain.lstrip('.')
+
+        path = cookie.get('path') or '/'
+        secure_flag = 'TRUE' if cookie.get('secure', False) else 'FALSE'
+
+        # Determine expiration: use far-future fallback if absent (session cookie)
+        expires = cookie.get('expirationDate') or cookie.get('expires')
+        if expires is None:
+            expires = 2147483647
+        else:
+            try:
+                expires = int(float(expires))
+            except (ValueError, TypeError):
+                expires = 2147483647
+
+        http_only = cookie.get('httpOnly') or cookie.get('http_only')
+        prefix = '#HttpOnly_' if http_only else ''
+
+        name = cookie.get('name')
+        value = cookie.get('value')
+        if not name or value is None:
+            return None
+
+        return f"{prefix}{domain}\t{include_subdomains}\t{path}\t{secure_flag}\t{expires}\t{name}\t{value}"
+        
+    except Exception:
+        return None
+
+
+def _cookie_set_text(cookie_set: Any) -> str:
+    """One cookie set from the input (Netscape or JSON text, or a JSON cookie export) as Netscape text."""
+    if not isinstance(cookie_set, str):
+        cookie_set = json.dumps(cookie_set)
+    return _convert_json_cookies_to_netscape(cookie_set.strip())
+
+
+class CookieIdentity:
+    """One account's session: its cookie jar, extraction budget and health."""
+
+    def __init__(self, name: str, cookies: str, requests_per_minute: float) -> None:
+        self.name = name
+        self.cookies = cookies
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.state = 'healthy'
+        self.next_allowed = 0.0
+        self.rest_until = 0.0
+        self.strikes = 0
+        self.auth_strikes = 0
+        self.stats: collections.Counter = collections.Counter()
+
+    def ready_at(self) -> float:
+        """Monotonic time from which the identity can take the next extraction."""
+        return max(self.next_allowed, self.rest_until)
+
+    def take(self, now: float) -> None:
+        self.next_allowed = max(now, self.next_allowed) + self.interval
+        if self.state == 'resting' and now >= self.rest_until:
+            self.state = 'healthy'
+        self.stats['extractions'] += 1
+
+    def report(self) -> Dict[str, Any]:
+        resting_for = self.rest_until - time.monotonic()
+        return {
+            'state': 'healthy' if self.state == 'resting' and resting_for <= 0 else self.state,
+            **self.stats,
+            'resting_seconds_left': round(resting_for, 1) if self.state == 'resting' and resting_for > 0 else 0,
+        }
+
+
+class IdentityPool:
+    """
+    Spreads authenticated extractions across several cookie identities.
+
+    Identities are handed out round-robin among those that are healthy and within
+    their extractions-per-minute budget; when none is ready, acquire() waits for the
+    first that will be. A rate limit or challenge rests the identity (exponentially
+    longer when it happens again in a row), and repeated authentication failures
+    retire it for the run. Cookies yt-dlp writes back after a successful extraction (refreshed
+    tokens) replace the identity's jar, so later requests use the fresh session.
+    """
+
+    def __init__(self) -> None:
+        self.identities: List[CookieIdentity] = []
+        self.requests_per_minute = IDENTITY_REQUESTS_PER_MINUTE
+        self._cursor = 0
+        self._stats = {'acquired': 0, 'waited': 0, 'wait_seconds': 0.0, 'rotations': 0, 'unavailable': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.identities)
+
+    def configure(self, cookie_sets: List[str], requests_per_minute: float | None = None) -> None:
+        """Create one identity per cookie set (duplicates are dropped)."""
+        if requests_per_minute is not None:
+            self.requests_per_minute = max(0.0, requests_per_minute)
+        self.identities = []
+        for cookies in dict.fromkeys(cookie_set for cookie_set in cookie_sets if cookie_set and cookie_set.strip()):
+            name = f"identity-{len(self.identities) + 1}"
+            self.identities.append(CookieIdentity(name, cookies, self.requests_per_minute))
+
+    def describe(self) -> Dict[str, Any] | None:
+        """Settings that recreate the pool in a shard process (None when disabled)."""
+        if not self.enabled:
+            return None
+        return {
+            'cookie_sets': [identity.cookies for identity in self.identities],
+            'requests_per_minute': self.requests_per_minute,
+        }
+
+    def _pick(self, now: float, exclude: List[CookieIdentity]) -> CookieIdentity | None:
+        count = len(self.identities)
+        for offset in range(count):
+            identity = self.identities[(self._cursor + offset) % count]
+            if identity in exclude or identity.state == 'expired' or identity.ready_at() > now:
+                continue
+            self._cursor = (self._cursor + offset + 1) % count
+            return identity
+        return None
+
+    async def acquire(self, exclude: List[CookieIdentity] | None = None, wait: bool = True) -> CookieIdentity | None:
+        """
+        The next identity to extract with.
+
+        Returns:
+            An identity that has taken one extraction from its budget, or None when
+            every identity (not excluded) has expired, or none is ready and wait is False
+        """
+        exclude = exclude or []
+        waited = None
+        while True:
+            now = time.monotonic()
+            identity = self._pick(now, exclude)
+            if identity is not None:
+                identity.take(now)
+                self._stats['acquired'] += 1
+                if waited is not None:
+                    self._stats['waited'] += 1
+                    self._stats['wait_seconds'] += now - waited
+                    identity.stats['waited'] += 1
+                return identity
+            candidates = [identity for identity in self.identities if identity not in exclude and identity.state != 'expired']
+            if not candidates or not wait:
+                self._stats['unavailable'] += 1
+                return None
+            if waited is None:
+                waited = now
+            await asyncio.sleep(min(IDENTITY_WAIT_SLICE, max(0.01, min(c.ready_at() for c in candidates) - now)))
+
+    def record(self, identity: CookieIdentity, error: str | None = None, cookie_jar: str | None = None) -> bool:
+        """
+        Record an extraction outcome for an identity.
+
+        cookie_jar is the cookie file as yt-dlp left it after a successful extraction
+        (read by the caller, off the event loop); it replaces the identity's jar.
+
+        Returns:
+            Whether the failure was caused by the identity (rate limit, challenge,
+            expired session), so the extraction should move to another identity
+        """
+        if error is None:
+            identity.strikes = identity.auth_strikes = 0
+            identity.stats['succeeded'] += 1
+            if cookie_jar:
+                self._refresh_jar(identity, cookie_jar)
+            return False
+        error_class = _classify_error(error)
+        if error_class == 'bot_check':
+            rest = min(IDENTITY_MAX_REST_SECONDS, IDENTITY_REST_SECONDS * 2 ** identity.strikes)
+            identity.strikes += 1
+            identity.state = 'resting'
+            identity.rest_until = time.monotonic() + rest
+            identity.stats['rate_limited'] += 1
+            Actor.log.warning(f"Cookie {identity.name} was rate limited or challenged, resting it for {rest:.0f}s")  # type: ignore
+            return True
+        if error_class == 'auth':
+            # Also reported for content this account cannot see, so only a streak retires it
+            identity.auth_strikes += 1
+            identity.stats['auth_failed'] += 1
+            if identity.auth_strikes >= IDENTITY_MAX_AUTH_FAILURES:
+                identity.state = 'expired'
+                Actor.log.warning(f"Cookie {identity.name} is no longer logged in, not using it for the rest of the run")  # type: ignore
+            return True
+        identity.stats['failed'] += 1
+        return False
+
+    def _refresh_jar(self, identity: CookieIdentity, refreshed: str) -> None:
+        # yt-dlp rewrites the file on close; keep the old jar if it left nothing usable
+        if refreshed != identity.cookies and any(line and not line.startswith('#') for line in refreshed.splitlines()):
+            identity.cookies = refreshed
+            identity.stats['jar_refreshed'] += 1
+
+    def rotated(self) -> None:
+        self._stats['rotations'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool and per-identity counters for the run metrics."""
+        return {
+            **self._stats,
+            'wait_seconds': round(self._stats['wait_seconds'], 3),
+            'requests_per_minute': self.requests_per_minute,
+            'identities': {identity.name: identity.report() for identity in self.identities},
+        }
+
+    def merge(self, stats: Dict[str, Any]) -> None:
+        """Add a shard's counters (each shard works with its own copy of the identities)."""
+        for name, value in stats.items():
+            if name in self._stats:
+                self._stats[name] += value
+        by_name = {identity.name: identity for identity in self.identities}
+        for name, report in (stats.get('identities') or {}).items():
+            identity = by_name.get(name)
+            if identity is None:
+                continue
+            for counter, value in report.items():
+                if isinstance(value, int) and counter != 'resting_seconds_left':
+                    identity.stats[counter] += value
+            if report.get('state') == 'expired':
+                identity.state = 'expired'
+
+
+_identity_pool = IdentityPool()
@@ -4,55 +4,155 @@ Stack: Python 3.10+ + Apify SDK + yt-dlp
 """
 
 from __future__ import annotations
+import time
+
+# Taken before any third-party import so the startup report covers the whole module load
+_MODULE_IMPORT_STARTED = time.perf_counter()
+
+import argparse
 import asyncio
+import collections
+import contextlib
+import contextvars
+import copy
+import functools
+import glob
+import html
+import itertools
+import json
+import logging
+import multiprocessing
 import os
+import queue
+import re
 import shutil
+import statistics
+import subprocess
+import sys
 import tempfile
+import threading
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List
 from datetime import datetime, UTC
 
 import random
-import yt_dlp
-
-# Apify SDK imports - only available in Apify environment
-try:
-    from apify import Actor  # type: ignore
-except ImportError:
-    # Fallback for local development
-    class Actor:  # type: ignore
-        class log:
-            @staticmethod
-            def info(msg: str) -> None:
-                print(f"[INFO] {msg}")
-
-            @staticmethod
-            def warning(msg: str) -> None:
-                print(f"[WARNING] {msg}")
-
-            @staticmethod
-            def error(msg: str) -> None:
-                print(f"[ERROR] {msg}")
-
-        @staticmethod
-        async def get_input():
-            return {}
-
-        @staticmethod
-        async def push_data(data):
-            print(f"[DATA] {data}")
-
-        @staticmethod
-        async def set_value(key, value, **kwargs):
-            print(f"[STORE] Set {key}")
-
-        @staticmethod
-        async def open_key_value_store():
-            return None
 
-        @staticmethod
-        async def create_proxy_configuration(**kwargs):
-            return None
+from actor import Actor
+from startup import (
+    FFMPEG_AVAILABLE,
+    FFMPEG_BINARY,
+    IMPORT_TIME_BUDGET_SECONDS,
+    SCRAPLING_AVAILABLE,
+    scrapling,
+    _start_background_imports,
+    _startup_timer,
+    yt_dlp,
+)
+from errors import _classify_error, _is_bot_check_error
+from metrics import (
+    METRICS_PATH,
+    _m_breaker_open,
+    _m_breaker_outcomes,
+    _m_downloaded_bytes,
+    _m_memory_budget,
+    _m_proxy_extractions,
+    _m_proxy_sessions,
+    _m_queue_depth,
+    _m_results,
+    _m_retries,
+    _m_stage_slots,
+    _m_transfers,
+    _m_urls_in_flight,
+    _metrics,
+    _metrics_server,
+    _web_server_port,
+)
+from progress import _progress_reporter
+from profiling import DEFAULT_LOOP_LAG_THRESHOLD, _loop_monitor, _profiler, _save_profile
+from deadlines import (
+    DEADLINE_HARD_STOP_SLACK,
+    DEFAULT_URL_TIMEOUT,
+    STAGE_TIMEOUTS,
+    YDL_SOCKET_TIMEOUT,
+    DeadlineExceeded,
+    _check_deadline,
+    _is_run_budget_error,
+    _parse_stage_timeouts,
+    _platform_seconds_left,
+    _run_budget,
+    _run_stage,
+    _save_unfinished_urls,
+    _url_deadline,
+)
+from budgets import (
+    DEFAULT_SCRATCH_QUOTA_SHARE,
+    SCRATCH_DIR_PREFIX,
+    YDL_BUFFER_SIZE,
+    _estimate_download_footprint,
+    _memory_budget,
+    _scratch_space,
+)
+from sinks import (
+    DOWNLOAD_INTEGRITY_RETRIES,
+    _GrowingFileUploader,
+    _HashingWriter,
+    IntegrityError,
+    KeyValueStoreSink,
+    LocalDirectorySink,
+    _LocalFileWriter,
+    OutputSink,
+    S3Sink,
+    SinkWriter,
+    _create_sink,
+    _digest_file,
+    _generate_safe_key,
+    _guess_content_type,
+    _sink_config_from_input,
+)
+from fixtures import (
+    BASELINE_TOLERANCE,
+    FIXTURE_MEDIA_MODES,
+    REGRESSION_EXIT_CODE,
+    _compare_with_baseline,
+    _fixture_url,
+    _fixtures,
+)
+from cdn import _cdn_client, _check_content_length, _dns_cache, _open_media_stream
+from watermarks import _extract_new_entries, _watermarks
+from identities import (
+    IDENTITY_REQUESTS_PER_MINUTE,
+    CookieIdentity,
+    _convert_json_cookies_to_netscape,
+    _cookie_set_text,
+    _identity_pool,
+)
+from scheduling import (
+    DEFAULT_SCHEDULING_POLICY,
+    QUEUE_IDLE_POLL_INTERVAL,
+    QUEUE_MAX_RETRIES,
+    SCHEDULING_POLICIES,
+    SHORT_JOB_SECONDS,
+    LocalRequest,
+    LocalRequestQueue,
+    _estimate_job_seconds,
+    _estimate_url_cost,
+    _queue_retry_delay,
+    _schedule_metrics,
+)
+from sharding import (
+    FANOUT_MAX_RETRIES,
+    FANOUT_POLL_INTERVAL,
+    SHARD_EVENT_POLL_INTERVAL,
+    _EventQueueResultWriter,
+    LocalShardRunner,
+    PlatformShardRunner,
+    _available_cpus,
+    _iter_work_queue,
+    _on_apify_platform,
+    _shard_run_budget_settings,
+    _split_into_shards,
+)
+
 
 # Realistic user agents for Instagram (mobile and desktop)
 USER_AGENTS = [
@@ -113,110 +213,123 @@ def _get_stealth_headers(url: str = None) -> Dict[str, str]:
         })
 
     return base_headers
-try:
-    import scrapling
-    SCRAPLING_AVAILABLE = True
-except Exception:
-    scrapling = None
-    SCRAPLING_AVAILABLE = False
-    Actor.log.info("scrapling not available — proceeding without scrapling utilities.")  # type: ignore
-
-try:
-    import ffmpeg
-    FFMPEG_AVAILABLE = True
-except Exception:
-    ffmpeg = None
-    FFMPEG_AVAILABLE = False
-    Actor.log.info("ffmpeg-python not available — post-processing disabled.")  # type: ignore
-
-
-# Common extension lookups
-VIDEO_FILE_EXTENSIONS = {'.mp4', '.mkv', '.webm', '.mov', '.m4v'}
-AUDIO_FILE_EXTENSIONS = {'.mp3', '.m4a', '.aac', '.opus', '.ogg', '.wav', '.flac'}
-MEDIA_FILE_EXTENSIONS = VIDEO_FILE_EXTENSIONS | AUDIO_FILE_EXTENSIONS
-
-CONTENT_TYPE_BY_EXTENSION = {
-    '.mp4': 'video/mp4',
-    '.mkv': 'video/x-matroska',
-    '.webm': 'video/webm',
-    '.mov': 'video/quicktime',
-    '.m4v': 'video/x-m4v',
-    '.m4a': 'audio/mp4',
-    '.aac': 'audio/aac',
-    '.opus': 'audio/ogg',
-    '.ogg': 'audio/ogg',
-    '.wav': 'audio/wav',
-    '.flac': 'audio/flac',
-    '.mp3': 'audio/mpeg',
-}
+
+
+# ============================================================ #
+#                   LAZY IMPORTS & STARTUP                     #
+# ============================================================ #
+
+
+# Run-wide metrics, logged in the summary and stored as RUN_METRICS in the key-value store
+_run_metrics: Dict[str, Any] = {}
+
+
+def _benchmark_import_time(runs: int = 5) -> int:
+    """
+    Measure the cold import time of this module in fresh interpreters against the budget.
+
+    Returns:
+        Process exit code (0 when the median import time is within budget)
+    """
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    probe = (
+        "import sys, time; sys.path.insert(0, %r); t = time.perf_counter(); import main; "
+        "print(time.perf_counter() - t); print(','.join(m for m in ('yt_dlp', 'scrapling') if m in sys.modules))"
+    ) % module_dir
+
+    timings = []
+    eager = set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True).stdout.splitlines()
+        timings.append(float(out[0]))
+        eager.update(name for name in (out[1] if len(out) > 1 else '').split(',') if name)
+
+    median = statistics.median(timings)
+    print(f"Import time over {runs} runs: median {median:.3f}s, min {min(timings):.3f}s, max {max(timings):.3f}s (budget {IMPORT_TIME_BUDGET_SECONDS:.2f}s)")
+    if eager:
+        print(f"FAIL: heavy modules imported eagerly: {', '.join(sorted(eager))}")
+        return 1
+    if median > IMPORT_TIME_BUDGET_SECONDS:
+        print("FAIL: import time over budget")
+        return 1
+    print("OK")
+    return 0
 
 
 # ============================================================ #
 #                        CONFIGURATION                         #
 # ============================================================ #
 
-# Base yt-dlp options optimized for Instagram with SPEED OPTIMIZATION
-# Base yt-dlp options - will be modified based on ffmpeg availability
-BASE_YDL_OPTS = {
-    'quiet': True,
-    'no_warnings': True,
-    'extract_flat': False,
-    'nocheckcertificate': True,
-    'ignoreerrors': False,
-    'no_color': True,
-    'retries': 3,  # Reduced for faster failure detection
-    'fragment_retries': 5,  # Balanced retry count
-    'http_headers': _get_stealth_headers(),  # Use stealth headers by default
-    # SPEED OPTIMIZATIONS
-    'concurrent_fragment_downloads': 5,  # Download multiple fragments in parallel
-    'buffersize': 1024 * 1024 * 16,  # 16MB buffer for faster downloads
-    'http_chunk_size': 1024 * 1024 * 10,  # 10MB chunks
-    'noprogress': False,  # Enable progress for monitoring
-    'no_check_certificate': True,  # Skip SSL verification for speed
-    # Disable unnecessary checks
-    'no_check_formats': True,  # Skip format checks
-    'skip_unavailable_fragments': True,  # Don't retry unavailable fragments
-    # Instagram extractor specific options
-    'extractor_args': {
-        'instagram': {
-            'api_dump': False,
-            'sleep_interval': 0,  # No sleep for faster extraction
-            'graphql': True,  # Use GraphQL API when possible
-        }
-    },
-    # General options for better Instagram compatibility
-    'sleep_interval': 0,  # No sleep between requests for speed
-    'max_sleep_interval': 2,  # Minimal sleep interval
-    'sleep_interval_requests': 0,  # No sleep after requests
-}
+def _build_base_ydl_opts() -> Dict[str, Any]:
+    """Build the base yt-dlp options (deferred until the first extraction needs them)."""
+    # Base yt-dlp options optimized for Instagram with SPEED OPTIMIZATION
+    # Base yt-dlp options - will be modified based on ffmpeg availability
+    base_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': False,
+        'nocheckcertificate': True,
+        'ignoreerrors': False,
+        'no_color': True,
+        'retries': 3,  # Reduced for faster failure detection
+        'socket_timeout': YDL_SOCKET_TIMEOUT,  # A stalled connection fails instead of hanging
+        'fragment_retries': 5,  # Balanced retry count
+        'http_headers': _get_stealth_headers(),  # Use stealth headers by default
+        # SPEED OPTIMIZATIONS
+        'concurrent_fragment_downloads': 5,  # Download multiple fragments in parallel
+        'buffersize': YDL_BUFFER_SIZE,  # 16MB buffer for faster downloads
+        'http_chunk_size': 1024 * 1024 * 10,  # 10MB chunks
+        'noprogress': False,  # Enable progress for monitoring
+        'no_check_certificate': True,  # Skip SSL verification for speed
+        # Disable unnecessary checks
+        'no_check_formats': True,  # Skip format checks
+        'skip_unavailable_fragments': True,  # Don't retry unavailable fragments
+        # Instagram extractor specific options
+        'extractor_args': {
+            'instagram': {
+                'api_dump': False,
+                'sleep_interval': 0,  # No sleep for faster extraction
+                'graphql': True,  # Use GraphQL API when possible
+            }
+        },
+        # General options for better Instagram compatibility
+        'sleep_interval': 0,  # No sleep between requests for speed
+        'max_sleep_interval': 2,  # Minimal sleep interval
+        'sleep_interval_requests': 0,  # No sleep after requests
+    }
 
-# Add ffmpeg-dependent options only if ffmpeg is available
-if FFMPEG_AVAILABLE:
-    BASE_YDL_OPTS.update({
-        'merge_output_format': 'mp4',
-        'format_sort': ['res', 'fps', 'vcodec:h264', 'acodec:m4a', 'ext:mp4:m4a'],
-    })
-else:
-    BASE_YDL_OPTS.update({
-        'noplaylist': True,  # Don't download playlists, only single videos
-        'extract_flat': False,  # Don't extract playlist info
-        'playlist_items': None,  # Don't limit playlist items
-        'format_sort': ['res', 'fps', 'ext:mp4:m4a'],
-        'allow_multiple_audio_streams': False,
-        'allow_multiple_video_streams': False,
-        'prefer_ffmpeg': False,  # Don't prefer ffmpeg for merging
-        'keepvideo': False,  # Don't keep video when extracting audio
-        'extract_audio': False,  # Don't extract audio by default
-        'format': 'bestvideo/best',  # Explicitly prefer video-only formats
-    })
-
-# Quality labels retained for reference (fallback helper uses these)
-QUALITY_FORMATS = {
-    'best': 'best',
-    '720p': 'best[height<=720]',
-    '1080p': 'best[height<=1080]',
-    'audio_only': 'bestaudio/best',
-}
+    # Add ffmpeg-dependent options only if ffmpeg is available
+    if FFMPEG_AVAILABLE:
+        base_opts.update({
+            'merge_output_format': 'mp4',
+            'format_sort': ['res', 'fps', 'vcodec:h264', 'acodec:m4a', 'ext:mp4:m4a'],
+        })
+    else:
+        base_opts.update({
+            'noplaylist': True,  # Don't download playlists, only single videos
+            'extract_flat': False,  # Don't extract playlist info
+            'playlist_items': None,  # Don't limit playlist items
+            'format_sort': ['res', 'fps', 'ext:mp4:m4a'],
+            'allow_multiple_audio_streams': False,
+            'allow_multiple_video_streams': False,
+            'prefer_ffmpeg': False,  # Don't prefer ffmpeg for merging
+            'keepvideo': False,  # Don't keep video when extracting audio
+            'extract_audio': False,  # Don't extract audio by default
+            'format': 'bestvideo/best',  # Explicitly prefer video-only formats
+        })
+
+    return base_opts
+
+
+_base_ydl_opts: Dict[str, Any] | None = None
+
+
+def _get_base_ydl_opts() -> Dict[str, Any]:
+    """Return the (lazily built) base yt-dlp options."""
+    global _base_ydl_opts
+    if _base_ydl_opts is None:
+        _base_ydl_opts = _build_base_ydl_opts()
+    return _base_ydl_opts
 
 
 def _build_format_candidates(quality: str | None) -> List[str]:
@@ -286,11 +399,28 @@ def _build_format_candidates(quality: str | None) -> List[str]:
 _failure_count = 0
 _success_count = 0
 _circuit_breaker_open = False
+_circuit_opened_at = 0.0
+# Seconds an open breaker skips URLs before letting attempts through again (half-open)
+CIRCUIT_BREAKER_COOLDOWN = 60.0
+# Set in shard processes: an Event shared with the parent (breaker state across shards)
+# and a callback forwarding each success/failure to the parent
+_shared_breaker_flag: Any = None
+_breaker_listener: Any = None
 
 def _check_circuit_breaker() -> bool:
     """Check if circuit breaker should be open (too many failures)"""
-    global _failure_count, _success_count, _circuit_breaker_open
-    
+    global _failure_count, _success_count, _circuit_breaker_open, _circuit_opened_at
+
+    if _shared_breaker_flag is not None and _shared_breaker_flag.is_set():
+        return True
+
+    if _circuit_breaker_open and time.monotonic() - _circuit_opened_at >= CIRCUIT_BREAKER_COOLDOWN:
+        # Half-open: count afresh, the next attempts decide whether it trips again
+        Actor.log.info("Circuit breaker HALF-OPEN - cooldown elapsed, letting URLs through")
+        _failure_count = 0
+        _success_count = 0
+        _circuit_breaker_open = False
+
     total = _failure_count + _success_count
     if total < 5:  # Need at least 5 attempts before checking
         return False
@@ -300,6 +430,7 @@ def _check_circuit_breaker() -> bool:
         if not _circuit_breaker_open:
             Actor.log.warning(f"Circuit breaker OPEN - failure rate: {failure_rate:.1%}")
             _circuit_breaker_open = True
+            _circuit_opened_at = time.monotonic()
         return True
     
     if _circuit_breaker_open and failure_rate < 0.3:
@@ -312,11 +443,15 @@ def _record_success():
     """Record a successful operation"""
     global _success_count
     _success_count += 1
+    if _breaker_listener is not None:
+        _breaker_listener(True)
 
 def _record_failure():
     """Record a failed operation"""
     global _failure_count
     _failure_count += 1
+    if _breaker_listener is not None:
+        _breaker_listener(False)
 
 def _is_retryable_error(error_msg: str) -> bool:
     """Check if an error is retryable based on Instagram-specific error patterns."""
@@ -332,6 +467,8 @@ def _is_retryable_error(error_msg: str) -> bool:
         "deleted",
         "removed",
         "copyright",
+        # Retrying after a deadline would only exceed it again
+        "deadline exceeded",
     ]
     
     for pattern in permanent_errors:
@@ -401,25 +538,43 @@ async def _retry_with_backoff(func, max_retries: int = 3, base_delay: float = 1.
             total_delay = delay + jitter
 
             Actor.log.warning(f"Attempt {attempt + 1} failed: {error_msg[:100]}... Retrying in {total_delay:.1f}s")  # type: ignore
+            _m_retries.inc(error_class=_classify_error(error_msg))
             await asyncio.sleep(total_delay)
 
     return None
 
 
-def _clear_directory(directory: str) -> None:
-    """Remove files created by previous download attempts in a temp directory."""
-    for entry in Path(directory).iterdir():
-        try:
-            if entry.is_dir():
-                shutil.rmtree(entry)
-            else:
-                entry.unlink()
-        except Exception:
-            continue
+def _remove_matching(directory: Path, pattern: str) -> None:
+    """Remove the files in a directory that match a glob pattern."""
+    for entry in directory.glob(pattern):
+        entry.unlink(missing_ok=True)
+
+
+def _downloaded_file_path(result: Dict[str, Any] | None) -> Path | None:
+    """Return the final output path reported by yt-dlp for a download (after post-processing)."""
+    if not result:
+        return None
+    for download in reversed(result.get('requested_downloads') or []):
+        path = download.get('filepath') or download.get('_filename')
+        if path:
+            return Path(path)
+    path = result.get('filepath') or result.get('_filename')
+    return Path(path) if path else None
+
+
+# Account and listing URLs: a profile, its reels/tagged/IGTV tabs, or a hashtag page
+_INSTAGRAM_LISTING_RE = re.compile(
+    r'instagram\.com/(?:explore/tags/[^/?#]+|([a-z0-9._]+)(?:/(?:reels|tagged|channel))?)/?(?:[?#]|$)'
+)
+# First path segments that are site pages, not account names
+_INSTAGRAM_RESERVED_PATHS = frozenset({
+    'accounts', 'explore', 'direct', 'about', 'developer', 'legal', 'privacy',
+    'challenge', 'emails', 'session', 'web', 'api', 'graphql', 'static',
+})
 
 
 def _validate_instagram_url(url: str) -> bool:
-    """Validate if URL is a valid Instagram URL that can be processed."""
+    """Validate if URL is a valid Instagram URL that can be processed (content or listing)."""
     if not url or not isinstance(url, str):
         return False
 
@@ -438,7 +593,12 @@ def _validate_instagram_url(url: str) -> bool:
     ]
 
     # Check if URL contains any valid pattern
-    return any(pattern in url for pattern in valid_patterns)
+    if any(pattern in url for pattern in valid_patterns):
+        return True
+
+    # Profiles and other listings expand into their items
+    listing = _INSTAGRAM_LISTING_RE.search(url)
+    return bool(listing) and listing.group(1) not in _INSTAGRAM_RESERVED_PATHS
 
 
 def _normalize_instagram_url(url: str) -> str:
@@ -458,54 +618,6 @@ def _normalize_instagram_url(url: str) -> str:
     return url
 
 
-def _find_downloaded_media(directory: str) -> Path | None:
-    """Locate the most recent media file produced by yt-dlp."""
-    candidates = []
-    for entry in Path(directory).iterdir():
-        if entry.is_file() and entry.suffix.lower() in MEDIA_FILE_EXTENSIONS:
-            candidates.append(entry)
-
-    if not candidates:
-        return None
-
-    candidates.sort(key=lambda item: item.stat().st_mtime, reverse=True)
-    return candidates[0]
-
-
-def _generate_safe_key(video_id: str, extension: str) -> str:
-    """
-    Generate a safe key for the key-value store.
-    
-    Args:
-        video_id: The video ID
-        extension: File extension
-        
-    Returns:
-        Safe key string (max 256 chars, only allowed characters)
-    """
-    # Use video ID and extension for the key
-    key = f"{video_id}.{extension}"
-    
-    # Ensure it's within length limits (Apify allows up to 256 chars)
-    if len(key) > 256:
-        # Truncate if necessary (unlikely for video IDs)
-        key = key[:256]
-        # Make sure we don't cut off in the middle of extension
-        if not key.endswith(f".{extension}"):
-            key = f"{video_id[:256-len(extension)-1]}.{extension}"
-    
-    return key
-
-
-def _guess_content_type(extension: str | None) -> str:
-    """Infer content type for storing files in the key-value store."""
-    if not extension:
-        return 'application/octet-stream'
-    ext = extension.lower()
-    if not ext.startswith('.'):
-        ext = f'.{ext}'
-    return CONTENT_TYPE_BY_EXTENSION.get(ext, 'application/octet-stream')
-
 def get_ydl_opts(download_mode: str, quality: str, proxy_url: str = None, max_items: int = 0, cookies: str = None, url: str = None) -> Dict[str, Any]:
     """
     Build yt-dlp options based on input parameters.
@@ -521,7 +633,8 @@ def get_ydl_opts(download_mode: str, quality: str, proxy_url: str = None, max_it
     Returns:
         yt-dlp options dictionary
     """
-    opts = BASE_YDL_OPTS.copy()
+    # Deep copy: callers (and the fallback options) modify nested dicts like extractor_args
+    opts = copy.deepcopy(_get_base_ydl_opts())
 
         # Add referer header for Instagram URLs
     if url and 'instagram.com' in url:
@@ -560,7 +673,8 @@ def _get_fallback_opts(original_opts: Dict[str, Any], cookies: str = None, temp_
     Returns:
         Modified yt-dlp options for fallback attempt
     """
-    fallback_opts = original_opts.copy()
+    # Deep copy so the nested extractor_args of the original options stay untouched
+    fallback_opts = copy.deepcopy(original_opts)
 
     # Increase sleep intervals for fallback
     fallback_opts['sleep_interval'] = 5
@@ -584,331 +698,1428 @@ def _get_fallback_opts(original_opts: Dict[str, Any], cookies: str = None, temp_
     return fallback_opts
 
 
-def _get_format_fallback_opts(original_opts: Dict[str, Any], cookies: str = None, temp_dir: str = None) -> Dict[str, Any]:
+# ============================================================ #
+#                         LIVE METRICS                         #
+# ============================================================ #
+
+
+# Queue whose depth is exported (set while process_url_stream runs)
+_metrics_queue: Any = None
+
+
+@_metrics.collector
+def _collect_runtime_metrics() -> None:
+    _m_breaker_open.set(1 if _circuit_breaker_open or (_shared_breaker_flag is not None and _shared_breaker_flag.is_set()) else 0)
+    _m_breaker_outcomes.set(_success_count, outcome='success')
+    _m_breaker_outcomes.set(_failure_count, outcome='failure')
+    totals = _progress_reporter.totals()
+    _m_downloaded_bytes.set(totals['bytes_downloaded'])
+    _m_transfers.set(totals['active_transfers'], state='active')
+    _m_transfers.set(totals['finished_files'], state='finished')
+    _m_transfers.set(totals['failed_files'], state='failed')
+    _m_memory_budget.set(_memory_budget.budget_bytes, state='limit')
+    _m_memory_budget.set(_memory_budget.stats()['in_use_bytes'], state='in_use')
+    for gate in (_download_slots, _postprocess_pool.slots):
+        in_use, waiting = gate.depths()
+        _m_stage_slots.set(in_use, stage=gate.stage, state='in_use')
+        _m_stage_slots.set(waiting, stage=gate.stage, state='waiting')
+    if isinstance(_metrics_queue, LocalRequestQueue):
+        pending, in_progress = _metrics_queue.depths()
+        _m_queue_depth.set(pending, state='pending')
+        _m_queue_depth.set(in_progress, state='in_progress')
+
+
+# ============================================================ #
+#                        STREAMING MUX                         #
+# ============================================================ #
+
+# Read size used when pumping CDN responses into ffmpeg and ffmpeg output back out
+MUX_CHUNK_SIZE = 1024 * 1024
+
+# Protocols whose formats can be fed to ffmpeg as a single continuous byte stream
+STREAMABLE_PROTOCOLS = {'http', 'https'}
+
+
+def _resolve_format_selection(info: Dict[str, Any], opts: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply the 'format' selector in opts to an extracted info dict (no network access)."""
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        return ydl.process_ie_result(copy.deepcopy(info), download=False) or {}
+
+
+def _resolve_requested_formats(info: Dict[str, Any], opts: Dict[str, Any]) -> List[Dict[str, Any]] | None:
     """
-    Generate fallback yt-dlp options with best quality format (ignores requested quality).
-    
+    Run yt-dlp format selection on an already extracted info dict without downloading.
+
     Args:
-        original_opts: Original yt-dlp options
-        cookies: Optional cookies string
-        temp_dir: Temp directory for cookie file
-        
+        info: yt-dlp extracted info for the video
+        opts: yt-dlp options containing the 'format' selector to apply
+
     Returns:
-        Modified yt-dlp options with best quality format
+        The [video, audio] format dicts when the selector resolves to a two-stream
+        merge that can be streamed, otherwise None
     """
-    fallback_opts = original_opts.copy()
-    # Force best quality regardless of requested quality
-    fallback_opts['format'] = 'best'
-    # Only modify cookies if provided
-    if cookies and temp_dir:
-        cookie_path = os.path.join(temp_dir, 'cookies.txt')
-        if os.path.exists(cookie_path):
-            fallback_opts['cookiefile'] = cookie_path
-    return fallback_opts
+    resolved = _resolve_format_selection(info, opts)
+    requested = (resolved or {}).get('requested_formats') or []
+    if len(requested) != 2:
+        return None
+
+    video_fmt, audio_fmt = requested
+    if video_fmt.get('vcodec') == 'none' and audio_fmt.get('vcodec') != 'none':
+        video_fmt, audio_fmt = audio_fmt, video_fmt
+
+    for fmt in (video_fmt, audio_fmt):
+        if not fmt.get('url') or fmt.get('protocol', 'https') not in STREAMABLE_PROTOCOLS:
+            return None
+
+    return [video_fmt, audio_fmt]
 
 
-def _convert_json_cookies_to_netscape(json_cookies: str) -> str:
+def _pump_format_to_fifo(ydl: Any, fmt: Dict[str, Any], fifo_path: str, transfer_id: int | None = None) -> tuple[int, bool]:
     """
-    Convert JSON cookies to Netscape format for yt-dlp.
-    
-    Args:
-        json_cookies: Cookies in JSON format
-        
+    Stream one format from the CDN into a FIFO read by ffmpeg.
+
+    Raises IntegrityError when the body is shorter or longer than its Content-Length.
+
     Returns:
-        Cookies in Netscape format
+        (bytes written, whether the size was checked against Content-Length)
     """
-    if not json_cookies:
-        return ''
+    part = str(fmt.get('format_id') or fifo_path)
+    if transfer_id is not None:
+        _progress_reporter.update(transfer_id, part, 0, fmt.get('filesize') or fmt.get('filesize_approx') or 0)
+
+    written = 0
+    # Opening the FIFO blocks until ffmpeg opens the read end
+    with open(fifo_path, 'wb') as fifo:
+        with _open_media_stream(ydl, fmt) as (chunks, content_length):
+            for chunk in chunks:
+                _check_deadline()
+                try:
+                    fifo.write(chunk)
+                except BrokenPipeError:
+                    # ffmpeg stopped reading (finished early or failed) - its exit code tells the story
+                    return written, False
+                written += len(chunk)
+                if transfer_id is not None:
+                    _progress_reporter.add_bytes(transfer_id, part, len(chunk))
 
-    if "# Netscape HTTP Cookie File" in json_cookies:
-        return json_cookies
+    return written, _check_content_length(fmt, written, content_length)
 
+
+def _release_fifo_writer(fifo_path: str) -> None:
+    """Unblock a feeder stuck in open() when ffmpeg exited before opening its input."""
     try:
-        import json
-        cookies_data = json.loads(json_cookies)
-        
-        # Netscape format header
-        netscape_cookies = [
-            "# Netscape HTTP Cookie File",
-            "# https://curl.se/docs/http-cookies.html",
-            "# This file was generated by Instagram Video Downloader Actor",
-            ""
-        ]
-        
-        # Handle different JSON formats
-        if isinstance(cookies_data, list):
-            # Array of cookie objects
-            for cookie in cookies_data:
-                if isinstance(cookie, dict):
-                    netscape_line = _format_cookie_as_netscape(cookie)
-                    if netscape_line:
-                        netscape_cookies.append(netscape_line)
-        elif isinstance(cookies_data, dict):
-            # Single cookie object or object with domain keys
-            if 'name' in cookies_data:
-                # Single cookie
-                netscape_line = _format_cookie_as_netscape(cookies_data)
-                if netscape_line:
-                    netscape_cookies.append(netscape_line)
-            else:
-                # Domain-keyed object
-                for domain, domain_cookies in cookies_data.items():
-                    if isinstance(domain_cookies, list):
-                        for cookie in domain_cookies:
-                            if isinstance(cookie, dict):
-                                cookie['domain'] = domain
-                                netscape_line = _format_cookie_as_netscape(cookie)
-                                if netscape_line:
-                                    netscape_cookies.append(netscape_line)
-        
-        return '\n'.join(netscape_cookies)
-        
-    except (json.JSONDecodeError, KeyError, TypeError) as e:
-        Actor.log.warning(f"Failed to parse JSON cookies: {e}. Assuming already Netscape format.")  # type: ignore
-        return json_cookies
+        fd = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        os.close(fd)
+    except OSError:
+        pass
+
+
+async def _mux_streams_to_fmp4(
+    video_fmt: Dict[str, Any],
+    audio_fmt: Dict[str, Any],
+    ydl_opts: Dict[str, Any],
+    writer: SinkWriter,
+    transfer_id: int | None = None,
+    work_dir: str | None = None,
+) -> tuple[int, bool]:
+    """
+    Mux separate DASH video and audio streams into fragmented MP4 with zero intermediate files.
 
+    Both streams are fetched from the CDN and fed to a stream-copy ffmpeg process through
+    FIFOs; the fragmented MP4 is read from ffmpeg's stdout and handed to the output sink
+    writer as it is produced.
 
-def _format_cookie_as_netscape(cookie: Dict[str, Any]) -> str:
-    """
-    Format a single cookie dict as Netscape format line.
-    
     Args:
-        cookie: Cookie dictionary
-        
+        video_fmt: Resolved yt-dlp video format dict
+        audio_fmt: Resolved yt-dlp audio format dict
+        ydl_opts: yt-dlp options used for the CDN requests (cookies, headers)
+        writer: Output sink writer receiving the muxed MP4
+        transfer_id: Optional progress reporter transfer to account fetched bytes to
+        work_dir: Directory for the FIFOs (the worker's scratch directory)
+
     Returns:
-        Netscape format line or None if invalid
+        (bytes written to the sink, whether both inputs matched their Content-Length)
     """
-    try:
-        domain = cookie.get('domain') or '.instagram.com'
-        host_only = cookie.get('hostOnly') or cookie.get('host_only')
-        include_subdomains = 'FALSE' if host_only else 'TRUE'
-
-        if include_subdomains == 'TRUE' and not domain.startswith('.'):
-            domain = f'.{domain}'
-        if include_subdomains == 'FALSE' and domain.startswith('.'):
-            domain = domain.lstrip('.')
-
-        path = cookie.get('path') or '/'
-        secure_flag = 'TRUE' if cookie.get('secure', False) else 'FALSE'
-
-        # Determine expiration: use far-future fallback if absent (session cookie)
-        expires = cookie.get('expirationDate') or cookie.get('expires')
-        if expires is None:
-            expires = 2147483647
-        else:
-            try:
-                expires = int(float(expires))
-            except (ValueError, TypeError):
-                expires = 2147483647
+    if not FFMPEG_BINARY:
+        raise RuntimeError('ffmpeg binary not available for stream muxing')
 
-        http_only = cookie.get('httpOnly') or cookie.get('http_only')
-        prefix = '#HttpOnly_' if http_only else ''
+    fifo_dir = await asyncio.to_thread(tempfile.mkdtemp, prefix='mux-', dir=work_dir)
+    video_fifo = os.path.join(fifo_dir, 'video.fifo')
+    audio_fifo = os.path.join(fifo_dir, 'audio.fifo')
+    await asyncio.to_thread(os.mkfifo, video_fifo)
+    await asyncio.to_thread(os.mkfifo, audio_fifo)
 
-        name = cookie.get('name')
-        value = cookie.get('value')
-        if not name or value is None:
-            return None
+    process = None
+    feeders: List[asyncio.Task] = []
+    try:
+        process = await asyncio.create_subprocess_exec(
+            FFMPEG_BINARY,
+            '-hide_banner', '-loglevel', 'error', '-nostdin',
+            '-i', video_fifo,
+            '-i', audio_fifo,
+            '-map', '0:v:0', '-map', '1:a:0',
+            '-c', 'copy',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4', 'pipe:1',
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
 
-        return f"{prefix}{domain}\t{include_subdomains}\t{path}\t{secure_flag}\t{expires}\t{name}\t{value}"
-        
-    except Exception:
-        return None
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            feeders = [
+                asyncio.create_task(asyncio.to_thread(_pump_format_to_fifo, ydl, video_fmt, video_fifo, transfer_id)),
+                asyncio.create_task(asyncio.to_thread(_pump_format_to_fifo, ydl, audio_fmt, audio_fifo, transfer_id)),
+            ]
 
+            written = 0
+            stderr_task = asyncio.create_task(process.stderr.read())
+            while True:
+                chunk = await process.stdout.read(MUX_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await writer.write(chunk)
+                written += len(chunk)
+
+            return_code = await process.wait()
+            stderr = (await stderr_task).decode('utf-8', errors='replace').strip()
+
+            # ffmpeg may exit before touching a FIFO; make sure no feeder stays blocked on open()
+            _release_fifo_writer(video_fifo)
+            _release_fifo_writer(audio_fifo)
+            feed_results = await asyncio.gather(*feeders, return_exceptions=True)
+
+        # A failed CDN fetch is the root cause of most ffmpeg errors, so report it first
+        for result in feed_results:
+            if isinstance(result, Exception):
+                raise result
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg stream mux exited with code {return_code}: {stderr[:300]}")
+        if not written:
+            raise RuntimeError('ffmpeg stream mux produced no output')
+
+        return written, all(checked for _, checked in feed_results)
 
-# ============================================================ #
-#                        CORE FUNCTIONS                       #
-# ============================================================ #
+    finally:
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+        _release_fifo_writer(video_fifo)
+        _release_fifo_writer(audio_fifo)
+        for feeder in feeders:
+            if not feeder.done():
+                try:
+                    await feeder
+                except Exception:
+                    pass
+        await asyncio.to_thread(shutil.rmtree, fifo_dir, ignore_errors=True)
 
-async def process_url(
-    url: str,
-    download_mode: str,
-    quality: str,
-    max_items: int,
-    proxy_url: str | None = None,
-    cookies: str | None = None,
-) -> List[Dict[str, Any]]:
+
+async def _fetch_format_to_writer(
+    fmt: Dict[str, Any],
+    writer: SinkWriter,
+    transfer_id: int | None = None,
+) -> bool:
     """
-    Process a single Instagram URL (video, reel, or post) and extract metadata/videos.
+    Stream one progressive format from the CDN straight into a sink writer.
 
-    Args:
-        url: Instagram URL (video, reel, or post)
-        download_mode: 'videos' or 'metadata_only'
-        quality: Quality preference
-        max_items: Maximum items to process
-        proxy_url: Optional proxy URL
-        cookies: Optional cookies string
+    The blocking fetch runs in a worker thread and hands each chunk to the (async)
+    writer on the event loop, waiting for it so a slow sink applies backpressure.
 
     Returns:
-        List of metadata dictionaries for each processed item
+        Whether the size was checked against Content-Length
     """
-    try:
-        Actor.log.info(f"Processing: {url}")  # type: ignore
-
-        # Use scrapling to fetch the Instagram page HTML stealthily before yt-dlp
-        page_html = None
-        if SCRAPLING_AVAILABLE:
-            try:
-                # Try different scrapling APIs based on version
-                if hasattr(scrapling, 'Browser'):
-                    try:
-                        browser = scrapling.Browser(stealth=True, headless=True)
-                        page = browser.goto(url)
-                        page_html = page.html
-                        browser.close()
-                    except Exception as e:
-                        Actor.log.warning(f"Scrapling Browser failed: {e}")  # type: ignore
-                elif hasattr(scrapling, 'Scraper'):
-                    try:
-                        scraper = scrapling.Scraper()
-                        page_html = scraper.scrape(url).html
-                    except Exception as e:
-                        Actor.log.warning(f"Scrapling Scraper failed: {e}")  # type: ignore
-                else:
-                    Actor.log.warning("Scrapling version incompatible - Browser/Scraper not available")  # type: ignore
-                if page_html:
-                    Actor.log.info("Fetched Instagram page HTML with scrapling (stealth mode)")  # type: ignore
-            except Exception as scrapling_error:
-                Actor.log.warning(f"Scrapling failed: {scrapling_error}")  # type: ignore
-
-        # Get yt-dlp options
-        opts = get_ydl_opts(download_mode, quality, proxy_url, max_items, cookies, url)
+    loop = asyncio.get_running_loop()
+    part = str(fmt.get('format_id') or 'direct')
+    if transfer_id is not None:
+        _progress_reporter.update(transfer_id, part, 0, fmt.get('filesize') or fmt.get('filesize_approx') or 0)
+
+    def fetch() -> bool:
+        received = 0
+        # Only called when the shared CDN client is available, so no yt-dlp fallback is needed
+        with _open_media_stream(None, fmt) as (chunks, content_length):
+            for chunk in chunks:
+                _check_deadline()
+                asyncio.run_coroutine_threadsafe(writer.write(chunk), loop).result()
+                received += len(chunk)
+                if transfer_id is not None:
+                    _progress_reporter.add_bytes(transfer_id, part, len(chunk))
+        return _check_content_length(fmt, received, content_length)
+
+    return await asyncio.to_thread(fetch)
+
+
+@_fixtures.page
+def _fetch_page_html(url: str) -> str | None:
+    """Fetch the Instagram page HTML stealthily with scrapling (blocking; run in a thread)."""
+    if not SCRAPLING_AVAILABLE:
+        return None
 
-        # Use temp directory for cookie file if provided
-        temp_dir = None
-        cookie_path = None
-        if cookies:
-            temp_dir = tempfile.mkdtemp()
-            cookie_path = os.path.join(temp_dir, 'cookies.txt')
+    page_html = None
+    try:
+        # Try different scrapling APIs based on version
+        if hasattr(scrapling, 'Browser'):
             try:
-                netscape_cookies = _convert_json_cookies_to_netscape(cookies)
-                with open(cookie_path, 'w', encoding='utf-8') as cf:
-                    cf.write(netscape_cookies)
-                opts['cookiefile'] = cookie_path
-                Actor.log.info('Using provided cookies for authenticated extraction')  # type: ignore
-                # Add additional headers when using cookies for better authentication
-                if 'http_headers' not in opts:
-                    opts['http_headers'] = _get_stealth_headers(url)
-                opts['http_headers'].update({
-                    'X-Requested-With': 'XMLHttpRequest',
-                    'X-Instagram-AJAX': '1',
-                    'X-IG-App-ID': '936619743392459',
-                })
+                browser = scrapling.Browser(stealth=True, headless=True)
+                page = browser.goto(url)
+                page_html = page.html
+                browser.close()
             except Exception as e:
-                Actor.log.warning(f'Could not write cookies file: {e}')  # type: ignore
-                cookie_path = None
-
-        # Extract info with retry logic
-        async def extract_info():
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                return ydl.extract_info(url, download=False)
-
-        try:
-            info = await _retry_with_backoff(extract_info, max_retries=3, base_delay=2.0)
-        except Exception as e:
-            # Try fallback options if initial extraction fails
+                Actor.log.warning(f"Scrapling Browser failed: {e}")  # type: ignore
+        elif hasattr(scrapling, 'Scraper'):
             try:
-                error_msg = str(e)
-            except Exception:
-                error_msg = "Unknown extraction error"
-            Actor.log.warning(f"Initial extraction failed, trying fallback options: {error_msg[:100]}...")  # type: ignore
-            fallback_opts = _get_fallback_opts(opts, cookies, temp_dir)
-            async def extract_info_fallback():
-                with yt_dlp.YoutubeDL(fallback_opts) as ydl:
-                    return ydl.extract_info(url, download=False)
+                scraper = scrapling.Scraper()
+                page_html = scraper.scrape(url).html
+            except Exception as e:
+                Actor.log.warning(f"Scrapling Scraper failed: {e}")  # type: ignore
+        else:
+            Actor.log.warning("Scrapling version incompatible - Browser/Scraper not available")  # type: ignore
+        if page_html:
+            Actor.log.info("Fetched Instagram page HTML with scrapling (stealth mode)")  # type: ignore
+    except Exception as scrapling_error:
+        Actor.log.warning(f"Scrapling failed: {scrapling_error}")  # type: ignore
 
-            try:
-                info = await _retry_with_backoff(extract_info_fallback, max_retries=2, base_delay=3.0)
-            except Exception as fallback_error:
-                try:
-                    fallback_error_msg = str(fallback_error)
-                except Exception:
-                    fallback_error_msg = "Unknown fallback error"
+    return page_html
 
-                # Check if this is an authentication-related error
-                if any(keyword in fallback_error_msg.lower() for keyword in ['login required', 'authentication required', 'not available', 'rate-limit']):
-                    Actor.log.error(f"All extraction attempts failed for {url} - Content may require authentication. Try providing Instagram cookies in the 'cookies' input parameter.")  # type: ignore
-                    Actor.log.error("To get cookies: 1) Log into Instagram in your browser, 2) Use browser dev tools to export cookies, 3) Provide them as JSON in the cookies field")  # type: ignore
-                else:
-                    Actor.log.error(f"All extraction attempts failed for {url}: {fallback_error_msg}")  # type: ignore
-                raise fallback_error
 
-        if not info:
-            raise ValueError(f"Could not extract info for {url}")
+# ============================================================ #
+#                       METADATA ENGINE                        #
+# ============================================================ #
 
-        results = []
+# The only info-dict fields process_single_video copies into metadata records
+METADATA_FIELDS = (
+    'id', 'title', 'uploader', 'upload_date', 'timestamp', 'duration', 'view_count',
+    'like_count', 'description', 'thumbnail', 'webpage_url', 'url',
+)
 
-        if not info:
-            raise ValueError(f"Could not extract info for {url}")
+# How many listing entries (profile/story items) are resolved concurrently
+METADATA_BATCH_SIZE = 4
 
-        # Handle different types of content
-        if 'entries' in info:
-            entries = info['entries']
-            if entries is None:
-                Actor.log.warning(f"No entries found in playlist/channel: {url}")  # type: ignore
-                entries = []
-            else:
-                entries = [e for e in entries if e is not None]
-                Actor.log.info(f"Found {len(entries)} valid items in playlist/channel")  # type: ignore
 
-            for entry in entries:
-                if entry:
-                    metadata = await process_single_video(entry, download_mode, quality, proxy_url, cookies)
-                    results.append(metadata)
-        else:
-            metadata = await process_single_video(info, download_mode, quality, proxy_url, cookies)
-            results.append(metadata)
+def _project_metadata(info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reduce a raw (unprocessed) yt-dlp info dict to the metadata fields we output.
 
-        return results
+    Fields yt-dlp normally derives during format processing (upload_date, thumbnail,
+    uploader) are derived here from the raw values instead.
+    """
+    projected = {field: info.get(field) for field in METADATA_FIELDS}
 
-    except Exception as e:
+    if not projected['uploader']:
+        projected['uploader'] = info.get('channel') or info.get('uploader_id')
+    if not projected['upload_date'] and info.get('timestamp'):
         try:
-            error_str = str(e)
-        except Exception:
-            error_str = "Unknown processing error"
-        Actor.log.error(f"Failed to process {url}: {error_str}")  # type: ignore
-        return [{
-            'url': url,
-            'error': error_str,
-            'quality_requested': quality,
-            'collected_at': datetime.now(UTC).isoformat(),
-        }]
+            projected['upload_date'] = datetime.fromtimestamp(int(info['timestamp']), UTC).strftime('%Y%m%d')
+        except (TypeError, ValueError, OverflowError):
+            pass
+    if not projected['thumbnail'] and info.get('thumbnails'):
+        thumbnails = [t for t in info['thumbnails'] if isinstance(t, dict) and t.get('url')]
+        if thumbnails:
+            projected['thumbnail'] = max(thumbnails, key=lambda t: (t.get('preference') or 0, t.get('width') or 0))['url']
 
-    finally:
-        if temp_dir and os.path.exists(temp_dir):
-            try:
-                import shutil
-                shutil.rmtree(temp_dir)
-            except Exception:
-                pass
+    return projected
 
 
-async def process_single_video(
-    info: Dict[str, Any],
-    download_mode: str,
-    quality: str,
-    proxy_url: str | None = None,
-    cookies: str | None = None,
-) -> Dict[str, Any]:
+def _extract_metadata_listing(url: str, opts: Dict[str, Any], max_items: int) -> Dict[str, Any]:
     """
-    Process a single video's metadata and optionally download it.
+    Extract metadata without format resolution (blocking; run in a thread).
 
-    Args:
-        info: yt-dlp extracted info for the video
-        download_mode: 'videos' or 'metadata_only'
-        quality: Quality preference
-        proxy_url: Optional proxy URL
+    Uses extract_info(process=False) so no format sorting/selection or extra manifest
+    requests happen, and projects every item down to METADATA_FIELDS immediately so the
+    large 'formats' lists are never held. Listing entries that are only URL references
+    are returned as '_type': 'url' stubs for batched resolution.
 
     Returns:
-        Metadata dictionary
+        A projected info dict, or a playlist dict whose entries are projected dicts or stubs
     """
-    try:
-        # Extract metadata
-        metadata = {
-            'video_id': info.get('id'),
-            'title': info.get('title'),
-            'author': info.get('uploader'),
-            'publish_date': info.get('upload_date'),
-            'duration': info.get('duration'),
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        raw = ydl.extract_info(url, download=False, process=False)
+        # Follow a single redirect-style result (e.g. a share URL resolving to a post)
+        if raw and raw.get('_type') in ('url', 'url_transparent') and raw.get('url') and raw.get('url') != url:
+            raw = ydl.extract_info(raw['url'], download=False, process=False)
+
+        if not raw:
+            return raw
+
+        if raw.get('_type') != 'playlist' and 'entries' not in raw:
+            return _project_metadata(raw)
+
+        # Entries may be a lazy generator that pages through the listing; stop at max_items
+        # (or, in incremental mode, at the first content seen by an earlier run)
+        entries = raw.get('entries') or []
+        if _watermarks.enabled:
+            entries = _watermarks.new_entries(url, entries, max_items)
+        elif max_items > 0:
+            entries = itertools.islice(entries, max_items)
+
+        listing = []
+        for entry in entries:
+            if not entry:
+                continue
+            if entry.get('_type') in ('url', 'url_transparent'):
+                listing.append({'_type': 'url', 'url': entry.get('url'), 'id': entry.get('id')})
+            else:
+                listing.append(_project_metadata(entry))
+
+    return {
+        '_type': 'playlist',
+        'id': raw.get('id'),
+        'title': raw.get('title'),
+        'webpage_url': raw.get('webpage_url') or url,
+        'entries': listing,
+    }
+
+
+async def _resolve_metadata_stubs(entries: List[Dict[str, Any]], opts: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Resolve URL-only listing entries to projected metadata, METADATA_BATCH_SIZE at a time."""
+    resolved = list(entries)
+    stub_indexes = [i for i, entry in enumerate(entries) if entry.get('_type') == 'url' and entry.get('url')]
+
+    for start in range(0, len(stub_indexes), METADATA_BATCH_SIZE):
+        batch = stub_indexes[start:start + METADATA_BATCH_SIZE]
+        results = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    _fixtures.exchange,
+                    'extract',
+                    f"metadata_only:{entries[i]['url']}",
+                    functools.partial(_extract_metadata_listing, entries[i]['url'], opts, 0),
+                )
+                for i in batch
+            ),
+            return_exceptions=True,
+        )
+        for i, result in zip(batch, results):
+            if isinstance(result, Exception) or not result:
+                Actor.log.warning(f"Could not resolve listing entry {entries[i]['url']}: {result}")  # type: ignore
+                resolved[i] = {'id': entries[i].get('id'), 'url': entries[i]['url'], 'webpage_url': entries[i]['url']}
+            else:
+                resolved[i] = result
+
+    return resolved
+
+
+def _parse_embedded_page_metadata(page_html: str, url: str) -> Dict[str, Any] | None:
+    """
+    Read metadata from the JSON/meta tags embedded in an Instagram page.
+
+    Used as a last resort for metadata-only runs when yt-dlp extraction fails.
+    """
+    if not page_html:
+        return None
+
+    def meta(prop: str) -> str | None:
+        match = re.search(
+            r'<meta[^>]+(?:property|name)=["\']%s["\'][^>]+content=["\']([^"\']*)' % re.escape(prop),
+            page_html,
+        )
+        return html.unescape(match.group(1)) if match else None
+
+    def json_value(key: str) -> str | None:
+        match = re.search(r'"%s"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?)' % re.escape(key), page_html)
+        if not match:
+            return None
+        try:
+            return json.loads(match.group(1))
+        except ValueError:
+            return None
+
+    title = meta('og:title')
+    if not title and not meta('og:video'):
+        return None
+
+    owner = re.search(r'"owner"\s*:\s*\{[^{}]*?"username"\s*:\s*"([^"]+)"', page_html)
+    info = {
+        'id': json_value('shortcode') or url.rstrip('/').rsplit('/', 1)[-1],
+        'title': title,
+        'uploader': owner.group(1) if owner else None,
+        'timestamp': json_value('taken_at_timestamp') or json_value('taken_at'),
+        'duration': json_value('video_duration'),
+        'view_count': json_value('video_view_count') or json_value('play_count'),
+        'like_count': json_value('like_count'),
+        'description': meta('og:description'),
+        'thumbnail': meta('og:image'),
+        'webpage_url': meta('og:url') or url,
+    }
+    return _project_metadata(info)
+
+
+# ============================================================ #
+#                        POST-PROCESSING                       #
+# ============================================================ #
+
+# Output of audio extraction for the 'audio_only' quality
+POSTPROCESS_AUDIO_CODEC = 'mp3'
+POSTPROCESS_AUDIO_BITRATE = '192k'
+
+
+class SlotGate:
+    """
+    Bounded slots of a processing stage with time-weighted utilization.
+
+    Utilization is slot-seconds in use over capacity times the time since the first
+    acquire; waits for a free slot are counted separately.
+    """
+
+    def __init__(self, stage: str, capacity: int = 1) -> None:
+        self.stage = stage
+        self.capacity = max(1, capacity)
+        self._semaphore: asyncio.Semaphore | None = None
+        self._in_use = 0
+        self._waiting = 0
+        self._started: float | None = None
+        self._last_change = 0.0
+        self._busy_seconds = 0.0
+        self._wait_seconds = 0.0
+        self._stats = {'acquired': 0, 'max_waiting': 0}
+
+    def configure(self, capacity: int) -> None:
+        """Set the number of slots (only before the first acquire)."""
+        self.capacity = max(1, capacity)
+        self._semaphore = None
+
+    def _account(self) -> None:
+        now = time.perf_counter()
+        if self._started is not None:
+            self._busy_seconds += (now - self._last_change) * self._in_use
+        self._last_change = now
+
+    async def _take(self) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.capacity)
+        if self._started is None:
+            self._started = self._last_change = time.perf_counter()
+        waited = time.perf_counter()
+        self._waiting += 1
+        self._stats['max_waiting'] = max(self._stats['max_waiting'], self._waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._wait_seconds += time.perf_counter() - waited
+        self._account()
+        self._in_use += 1
+        self._stats['acquired'] += 1
+
+    async def acquire(self) -> 'SlotHold':
+        """Wait for a free slot."""
+        await self._take()
+        return SlotHold(self)
+
+    def _release(self) -> None:
+        self._account()
+        self._in_use -= 1
+        self._semaphore.release()
+
+    @contextlib.asynccontextmanager
+    async def hold(self):
+        """Hold a slot for the enclosed block (unless the holder hands it back earlier)."""
+        slot = await self.acquire()
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def depths(self) -> tuple[int, int]:
+        """Slots in use and tasks waiting for one."""
+        return self._in_use, self._waiting
+
+    def stats(self) -> Dict[str, Any]:
+        """Utilization for the run metrics."""
+        self._account()
+        elapsed = time.perf_counter() - self._started if self._started is not None else 0.0
+        acquired = self._stats['acquired']
+        return {
+            'slots': self.capacity,
+            **self._stats,
+            'busy_seconds': round(self._busy_seconds, 3),
+            'utilization': round(self._busy_seconds / (self.capacity * elapsed), 3) if elapsed else 0.0,
+            'mean_wait_ms': round(self._wait_seconds / acquired * 1000, 1) if acquired else 0.0,
+        }
+
+
+class SlotHold:
+    """One acquired slot; released once, and can be handed back for a while."""
+
+    def __init__(self, gate: SlotGate) -> None:
+        self._gate = gate
+        self.held = True
+
+    def release(self) -> None:
+        if self.held:
+            self.held = False
+            self._gate._release()
+
+    @contextlib.asynccontextmanager
+    async def lent(self):
+        """Give the slot back for the enclosed block and take a new one afterwards."""
+        if not self.held:
+            yield
+            return
+        self.release()
+        try:
+            yield
+        finally:
+            await self._gate._take()
+            self.held = True
+
+
+# Download slot held by the current URL's worker (None outside the worker pool)
+_download_slot: contextvars.ContextVar[SlotHold | None] = contextvars.ContextVar('download_slot', default=None)
+
+
+class PostprocessPool:
+    """
+    CPU-sized pool for ffmpeg post-processing (audio extraction, derived renditions).
+
+    Each job is an ffmpeg process; at most one per slot runs at a time and the rest
+    queue in FIFO order. While its job waits and runs, a URL lends its download slot
+    back to the worker pool, so downloads continue at full bandwidth next to the
+    transcodes instead of waiting for the CPU-bound step.
+    """
+
+    def __init__(self) -> None:
+        self.workers = 0
+        self.slots = SlotGate('postprocess')
+        self._stats: collections.Counter = collections.Counter()
+
+    @property
+    def available(self) -> bool:
+        return bool(FFMPEG_BINARY)
+
+    def configure(self, workers: int | None = None) -> None:
+        """Set the pool size, one slot per available CPU by default."""
+        self.workers = max(1, workers or _available_cpus())
+        self.slots.configure(self.workers)
+
+    async def run(self, args: List[str], job: str) -> None:
+        """Run one ffmpeg job in the pool (raises RuntimeError when ffmpeg fails)."""
+        if not self.workers:
+            self.configure()
+        download_slot = _download_slot.get()
+        lent = download_slot.lent() if download_slot is not None else contextlib.nullcontext()
+        async with lent:
+            async with self.slots.hold():
+                try:
+                    await _run_ffmpeg(args)
+                except Exception:
+                    self._stats[f'{job}_failed'] += 1
+                    raise
+                self._stats[job] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Jobs and utilization for the run metrics."""
+        return {'workers': self.workers, 'jobs': dict(self._stats), **self.slots.stats()}
+
+
+_postprocess_pool = PostprocessPool()
+# Download slots of the worker pool (sized when a pool starts)
+_download_slots = SlotGate('download')
+
+
+def _audio_extraction_args(source: Path, target: Path) -> List[str]:
+    """ffmpeg arguments converting the audio of a media file to the audio_only output format."""
+    return ['-i', str(source), '-vn', '-c:a', 'libmp3lame', '-b:a', POSTPROCESS_AUDIO_BITRATE, str(target)]
+
+
+def _needs_audio_extraction(quality: str) -> bool:
+    """Whether downloads of this quality are converted to mp3 after fetching."""
+    return quality.lower() == 'audio_only' and FFMPEG_AVAILABLE and _postprocess_pool.available
+
+
+async def _extract_audio(fetched: Dict[str, Any], work_dir: str, key_base: str) -> Dict[str, Any]:
+    """Convert a fetched local media file to mp3 in the post-processing pool."""
+    source: Path = fetched['path']
+    if fetched.get('placeholder'):
+        # Replayed fixtures without recorded bytes have nothing to convert
+        return fetched
+    target = Path(work_dir) / _generate_safe_key(f"{key_base}_audio", POSTPROCESS_AUDIO_CODEC)
+    await _postprocess_pool.run(_audio_extraction_args(source, target), 'extract_audio')
+    await asyncio.to_thread(source.unlink, missing_ok=True)
+    digest = await asyncio.to_thread(_digest_file, target)
+    return {
+        'format': fetched['format'],
+        'extension': POSTPROCESS_AUDIO_CODEC,
+        'path': target,
+        'integrity': {**digest.result(), 'size_verified': fetched['integrity'].get('size_verified', False)},
+    }
+
+
+# ============================================================ #
+#                       MULTI-RENDITION                        #
+# ============================================================ #
+
+AUDIO_QUALITIES = {'audio_only', 'audio'}
+
+# Maximum height per quality label (None means no limit)
+QUALITY_HEIGHT_LIMITS = {'best': None, '1080p': 1080, '1080': 1080, '720p': 720, '720': 720}
+
+
+def _normalize_qualities(quality: str | List[str] | None) -> List[str]:
+    """Turn the quality input (string, comma-separated string or list) into a deduplicated list."""
+    if isinstance(quality, (list, tuple)):
+        items = quality
+    else:
+        items = str(quality or 'best').split(',')
+
+    qualities: List[str] = []
+    for item in items:
+        q = str(item).strip().lower()
+        if q and q not in qualities:
+            qualities.append(q)
+    return qualities or ['best']
+
+
+def _resolve_rendition(info: Dict[str, Any], quality: str, opts: Dict[str, Any]) -> tuple[str | None, int | None]:
+    """Concrete format ids (e.g. '1080v+aac') and height a quality resolves to, or (None, None)."""
+    plan = plan_formats(info, quality, max_candidates=1)
+    if plan:
+        return plan[0], _planned_format_height(info, plan[0])
+    try:
+        selection_opts = dict(opts)
+        selection_opts['format'] = _select_download_format(quality)
+        resolved = _resolve_format_selection(info, selection_opts)
+    except Exception:
+        return None, None
+    requested = resolved.get('requested_formats') or [resolved]
+    signature = '+'.join(str(fmt.get('format_id')) for fmt in requested)
+    return signature, resolved.get('height')
+
+
+@_profiler.hook('ffmpeg')
+async def _run_ffmpeg(args: List[str]) -> None:
+    """Run the ffmpeg binary and raise with its error output on failure."""
+    if not FFMPEG_BINARY:
+        raise RuntimeError('ffmpeg binary not available')
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {process.returncode}: {stderr.decode('utf-8', errors='replace')[:300]}")
+
+
+def _rendition_ffmpeg_args(source: Path, target: Path, quality: str) -> List[str]:
+    """ffmpeg arguments deriving a rendition (mp3 audio or a downscaled video) from a source file."""
+    if quality in AUDIO_QUALITIES:
+        return _audio_extraction_args(source, target)
+    height = QUALITY_HEIGHT_LIMITS.get(quality)
+    return [
+        '-i', str(source),
+        '-vf', f'scale=-2:{height}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23',
+        '-c:a', 'copy',
+        '-movflags', '+faststart',
+        str(target),
+    ]
+
+
+async def download_renditions(
+    info: Dict[str, Any],
+    qualities: List[str],
+    cookies: str | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Produce several renditions of one video from a single extraction and a single fetch.
+
+    Qualities that resolve to the same concrete formats share one output. The highest
+    resolution video is downloaded once; audio-only and lower resolutions are derived
+    from it with ffmpeg. Without the ffmpeg binary, renditions that cannot be shared are
+    downloaded separately (still without re-extracting).
+
+    Returns:
+        One dict per requested quality with the stored file's details
+    """
+    url = info.get('webpage_url') or info.get('url')
+    video_id = info.get('id', 'unknown')
+
+    plan_opts = get_ydl_opts('videos', qualities[0], None, 0, None, url)
+    plan = {q: _resolve_rendition(info, q, plan_opts) for q in qualities}
+
+    video_qualities = [q for q in qualities if q not in AUDIO_QUALITIES]
+    if video_qualities:
+        source_quality = max(video_qualities, key=lambda q: plan[q][1] or 0)
+    else:
+        source_quality = qualities[0]
+    source_signature, source_height = plan[source_quality]
+
+    # Source plus derived outputs live in the same scratch directory until stored
+    async with _scratch_space.acquire(_estimate_download_footprint(info) * 2) as work_path:
+        work_dir = str(work_path)
+        source = await _run_stage(
+            'download', _fetch_planned_media(info, source_quality, cookies, work_dir, None, f"{video_id}_{source_quality}"),
+        )
+        source_path = source['path']
+
+        # quality -> (local file, format label, quality it was derived from)
+        files: Dict[str, tuple[Path, str, str | None]] = {}
+        # Hashes computed while downloading; derived files are hashed after ffmpeg wrote them
+        integrities: Dict[Path, Dict[str, Any]] = {source_path: source['integrity']}
+        for q in qualities:
+            signature, _ = plan[q]
+            limit = QUALITY_HEIGHT_LIMITS.get(q)
+            if q == source_quality or (signature is not None and signature == source_signature):
+                files[q] = (source_path, source['format'], None)
+            elif q not in AUDIO_QUALITIES and (limit is None or not source_height or source_height <= limit):
+                # The source already satisfies this quality's height limit
+                files[q] = (source_path, source['format'], None)
+            elif FFMPEG_BINARY and (q in AUDIO_QUALITIES or source_height):
+                extension = POSTPROCESS_AUDIO_CODEC if q in AUDIO_QUALITIES else 'mp4'
+                target = Path(work_dir) / f"{video_id}_{q}.{extension}"
+                Actor.log.info(f"Deriving '{q}' rendition of {video_id} from the '{source_quality}' download")  # type: ignore
+                try:
+                    await _run_stage('postprocess', _postprocess_pool.run(_rendition_ffmpeg_args(source_path, target, q), 'rendition'))
+                    files[q] = (target, f"{source['format']} (derived)", source_quality)
+                    continue
+                except RuntimeError as derive_error:
+                    # e.g. a video-only source cannot yield an audio rendition
+                    Actor.log.warning(f"Could not derive '{q}' rendition, downloading it separately: {derive_error}")  # type: ignore
+                fetched = await _run_stage('download', _fetch_planned_media(info, q, cookies, work_dir, None, f"{video_id}_{q}"))
+                files[q] = (fetched['path'], fetched['format'], None)
+                integrities[fetched['path']] = fetched['integrity']
+            else:
+                fetched = await _run_stage('download', _fetch_planned_media(info, q, cookies, work_dir, None, f"{video_id}_{q}"))
+                files[q] = (fetched['path'], fetched['format'], None)
+                integrities[fetched['path']] = fetched['integrity']
+
+        # Store every distinct file once; qualities sharing a file share its key and URL
+        stored: Dict[Path, tuple[str, int, str | None]] = {}
+        renditions = []
+        for q in qualities:
+            path, used_format, derived_from = files[q]
+            extension = path.suffix.lstrip('.').lower()
+            if path not in stored:
+                key = _generate_safe_key(f"{video_id}_{q}", extension)
+                file_size = (await asyncio.to_thread(path.stat)).st_size
+                if path not in integrities:
+                    digest = await asyncio.to_thread(_digest_file, path)
+                    integrities[path] = {**digest.result(), 'size_verified': False}
+                download_url = await _run_stage('store', _output_sink.put_file(key, path, _guess_content_type(extension)))
+                stored[path] = (key, file_size, download_url)
+            key, file_size, download_url = stored[path]
+            renditions.append({
+                'quality_requested': q,
+                'file_size': file_size,
+                'file_extension': extension,
+                'file_path': key,
+                'downloaded_format': used_format,
+                'derived_from': derived_from,
+                'download_url': download_url,
+                **integrities[path],
+            })
+
+    return renditions
+
+
+# ============================================================ #
+#                        FORMAT PLANNER                        #
+# ============================================================ #
+
+# How many concrete formats a download may fall back through
+FORMAT_PLAN_MAX_CANDIDATES = 4
+
+# Preferred codecs (earlier is better); h264/aac play everywhere and stream-copy into mp4
+PREFERRED_VCODECS = ('avc1', 'h264')
+PREFERRED_ACODECS = ('mp4a', 'aac')
+
+
+def _has_video(fmt: Dict[str, Any]) -> bool:
+    return fmt.get('vcodec') != 'none'
+
+
+def _has_audio(fmt: Dict[str, Any]) -> bool:
+    # Instagram's progressive formats often leave acodec unset; only 'none' means video-only
+    return fmt.get('acodec') != 'none'
+
+
+def _expected_format_size(fmt: Dict[str, Any], duration: Any) -> int | None:
+    """Size of a format in bytes: reported, approximate, or bitrate times duration."""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    try:
+        if fmt.get('tbr') and duration:
+            return int(float(fmt['tbr']) * 1000 / 8 * float(duration))
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _codec_rank(codec: Any, preferred: tuple[str, ...]) -> int:
+    codec = str(codec or '').lower()
+    for index, prefix in enumerate(preferred):
+        if codec.startswith(prefix):
+            return len(preferred) - index
+    return 0
+
+
+def plan_formats(info: Dict[str, Any], quality: str, max_candidates: int = FORMAT_PLAN_MAX_CANDIDATES) -> List[str]:
+    """
+    Rank the concrete formats of an extracted video for a quality.
+
+    Formats are scored locally, without yt-dlp's selector: formats within the quality's
+    height limit come first, then ones with audio (a progressive format, or a video-only
+    format merged with the best audio when ffmpeg is available), then by height (highest
+    first; above the limit, the smallest excess), expected size fitting the memory
+    budget, preferred codecs and bitrate. For audio_only, audio formats rank first.
+
+    Args:
+        info: yt-dlp extracted info with 'formats'
+        quality: Quality label ('best', '720p', '1080p', 'audio_only')
+        max_candidates: Maximum number of candidates returned
+
+    Returns:
+        Format specs for yt-dlp's 'format' option ('id' or 'video_id+audio_id'), best
+        first; empty when the info lists no usable formats
+    """
+    duration = info.get('duration')
+    formats = [
+        fmt for fmt in info.get('formats') or []
+        if fmt.get('format_id') and fmt.get('url') and (_has_video(fmt) or _has_audio(fmt))
+        and fmt.get('ext') != 'mhtml'
+    ]
+    if not formats:
+        return []
+
+    audio_formats = [fmt for fmt in formats if not _has_video(fmt)]
+    best_audio = max(
+        audio_formats,
+        key=lambda fmt: (_codec_rank(fmt.get('acodec'), PREFERRED_ACODECS), fmt.get('abr') or fmt.get('tbr') or 0),
+        default=None,
+    )
+    can_merge = FFMPEG_AVAILABLE and bool(FFMPEG_BINARY)
+    budget = _memory_budget.budget_bytes if _output_sink.buffers_whole_file else None
+    q = (quality or 'best').lower()
+
+    def size_fits(size: int | None) -> bool:
+        return budget is None or size is None or size <= budget
+
+    # (score, spec); higher scores are better
+    scored: List[tuple[tuple, str]] = []
+    if q in AUDIO_QUALITIES:
+        for fmt in audio_formats:
+            size = _expected_format_size(fmt, duration)
+            score = (1, size_fits(size), _codec_rank(fmt.get('acodec'), PREFERRED_ACODECS), fmt.get('abr') or fmt.get('tbr') or 0)
+            scored.append((score, str(fmt['format_id'])))
+        # Progressive formats carry the audio too; the smallest one is the cheapest source
+        for fmt in formats:
+            if _has_video(fmt) and _has_audio(fmt):
+                size = _expected_format_size(fmt, duration)
+                score = (0, size_fits(size), 0, -(fmt.get('height') or 0))
+                scored.append((score, str(fmt['format_id'])))
+    else:
+        limit = QUALITY_HEIGHT_LIMITS.get(q)
+        for fmt in formats:
+            if not _has_video(fmt):
+                continue
+            height = fmt.get('height') or 0
+            within = limit is None or height <= limit
+            spec, size, with_audio = str(fmt['format_id']), _expected_format_size(fmt, duration), _has_audio(fmt)
+            if not with_audio and best_audio is not None and can_merge:
+                spec = f"{fmt['format_id']}+{best_audio['format_id']}"
+                audio_size = _expected_format_size(best_audio, duration)
+                size = size + audio_size if size is not None and audio_size is not None else size
+                with_audio = True
+            score = (
+                within,
+                with_audio,
+                height if within else -height,
+                size_fits(size),
+                _codec_rank(fmt.get('vcodec'), PREFERRED_VCODECS),
+                fmt.get('ext') == 'mp4',
+                fmt.get('tbr') or 0,
+            )
+            scored.append((score, spec))
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    plan: List[str] = []
+    for _, spec in scored:
+        if spec not in plan:
+            plan.append(spec)
+        if len(plan) >= max_candidates:
+            break
+    return plan
+
+
+def _planned_format_height(info: Dict[str, Any], spec: str) -> int | None:
+    """Height of the video part of a planned format spec."""
+    ids = spec.split('+')
+    for fmt in info.get('formats') or []:
+        if str(fmt.get('format_id')) in ids and _has_video(fmt):
+            return fmt.get('height')
+    return None
+
+
+# ============================================================ #
+#                         RESULT OUTPUT                        #
+# ============================================================ #
+
+class DatasetResultWriter:
+    """Pushes result records to the Actor's default dataset."""
+
+    async def push(self, record: Dict[str, Any]) -> None:
+        await Actor.push_data(record)
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlResultWriter:
+    """Writes result records to a JSON Lines file, one flushed line per finished item."""
+
+    def __init__(self, path: str, append: bool = False) -> None:
+        self.path = Path(path).expanduser()
+        if self.path.parent:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'a' if append else 'w', encoding='utf-8')
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def _write_line(self, line: str) -> None:
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    async def push(self, record: Dict[str, Any]) -> None:
+        # Written from a thread: a slow disk must not stall the event loop
+        await asyncio.to_thread(self._write_line, json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        self.count += 1
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+
+# Where downloaded media goes (configured from the input in main)
+_output_sink: OutputSink = KeyValueStoreSink()
+
+
+_result_writer: Any = DatasetResultWriter()
+
+
+async def _push_result(record: Dict[str, Any]) -> None:
+    """Emit one result record through the active result writer."""
+    await _result_writer.push(record)
+    _schedule_metrics.record_result()
+    _m_results.inc(outcome='error' if 'error' in record else 'success')
+
+
+# ============================================================ #
+#                       HEDGED EXTRACTION                      #
+# ============================================================ #
+
+# Extraction strategies: option builder, attempts and first backoff delay for each
+EXTRACTION_STRATEGIES: Dict[str, Dict[str, Any]] = {
+    'primary': {'build': lambda opts, cookies, temp_dir: opts, 'attempts': 3, 'base_delay': 2.0},
+    # Mobile user agent, no GraphQL
+    'mobile': {'build': _get_fallback_opts, 'attempts': 2, 'base_delay': 3.0},
+}
+
+# Until enough latencies are known, an alternate strategy starts after this many seconds
+HEDGE_DEFAULT_DELAY = 8.0
+HEDGE_MIN_DELAY = 1.0
+HEDGE_MAX_DELAY = 30.0
+HEDGE_LATENCY_PERCENTILE = 0.9
+HEDGE_MIN_SAMPLES = 10
+HEDGE_LATENCY_WINDOW = 200
+
+
+class ExtractionHedger:
+    """
+    Runs extraction strategies as a hedged race instead of one after the other.
+
+    The strategy with the best win rate starts first. An alternate strategy starts
+    alongside it when the running one takes longer than the learned latency percentile
+    or hits a bot-check error; the first success wins and the others are cancelled.
+    A cancelled strategy's blocking yt-dlp call cannot be interrupted, so it finishes
+    in its thread (bounded by the socket timeout) and its result is discarded.
+    """
+
+    def __init__(self, strategies: Dict[str, Dict[str, Any]]) -> None:
+        self.strategies = strategies
+        self._latencies: Dict[str, collections.deque] = {
+            name: collections.deque(maxlen=HEDGE_LATENCY_WINDOW) for name in strategies
+        }
+        self._starts: collections.Counter = collections.Counter()
+        self._wins: collections.Counter = collections.Counter()
+        self._stats = {'extractions': 0, 'hedged_on_latency': 0, 'hedged_on_error': 0, 'cancelled': 0, 'failed': 0}
+
+    def win_rate(self, name: str) -> float:
+        # Smoothed, so untried strategies are neither favoured nor written off
+        return (self._wins[name] + 1) / (self._starts[name] + 2)
+
+    def ranked(self) -> List[str]:
+        """Strategies in the order they are started: best win rate first, then registry order."""
+        names = list(self.strategies)
+        return sorted(names, key=lambda name: (-self.win_rate(name), names.index(name)))
+
+    def hedge_delay(self, name: str) -> float:
+        """Seconds to wait for a strategy before starting the next one."""
+        latencies = sorted(self._latencies[name])
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        index = min(len(latencies) - 1, int(len(latencies) * HEDGE_LATENCY_PERCENTILE))
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, latencies[index]))
+
+    async def extract(
+        self,
+        run_extraction: Any,
+        opts: Dict[str, Any],
+        cookies: str | None = None,
+        temp_dir: str | None = None,
+    ) -> Any:
+        """
+        Extract with the ranked strategies raced as needed.
+
+        Args:
+            run_extraction: Blocking function taking yt-dlp options and returning the info dict
+            opts: Options of the primary strategy; other strategies derive theirs from them
+            cookies: Optional cookies string
+            temp_dir: Directory holding the cookie file
+
+        Returns:
+            The info dict of the first strategy that succeeded
+
+        Raises:
+            The last error when every strategy failed
+        """
+        self._stats['extractions'] += 1
+        pending = self.ranked()
+        escalate = asyncio.Event()
+        running: Dict[asyncio.Task, str] = {}
+        last_error: BaseException | None = None
+
+        async def run_strategy(name: str) -> Any:
+            strategy = self.strategies[name]
+            strategy_opts = strategy['build'](opts, cookies, temp_dir)
+
+            async def attempt() -> Any:
+                started = time.perf_counter()
+                try:
+                    result = await _run_stage('extract', asyncio.to_thread(run_extraction, strategy_opts))
+                except Exception as attempt_error:
+                    if _is_bot_check_error(str(attempt_error)):
+                        escalate.set()
+                    raise
+                self._latencies[name].append(time.perf_counter() - started)
+                return result
+
+            return await _retry_with_backoff(attempt, max_retries=strategy['attempts'], base_delay=strategy['base_delay'])
+
+        def start_next() -> None:
+            name = pending.pop(0)
+            self._starts[name] += 1
+            running[asyncio.create_task(run_strategy(name))] = name
+
+        start_next()
+        try:
+            while running:
+                waiters = set(running)
+                escalation = None
+                if pending:
+                    escalation = asyncio.create_task(escalate.wait())
+                    waiters.add(escalation)
+                leader = next(iter(running.values()))
+                done, _ = await asyncio.wait(
+                    waiters,
+                    timeout=self.hedge_delay(leader) if pending else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if escalation is not None and not escalation.done():
+                    escalation.cancel()
+
+                if not done:
+                    self._stats['hedged_on_latency'] += 1
+                    Actor.log.info(f"Extraction with '{leader}' is slow, also trying '{pending[0]}'")  # type: ignore
+                    start_next()
+                    continue
+                if escalation in done:
+                    escalate.clear()
+                    self._stats['hedged_on_error'] += 1
+                    Actor.log.info(f"Bot check during extraction, also trying '{pending[0]}'")  # type: ignore
+                    start_next()
+
+                for task in done:
+                    if task is escalation:
+                        continue
+                    name = running.pop(task)
+                    if task.exception() is None:
+                        self._wins[name] += 1
+                        return task.result()
+                    last_error = task.exception()
+                    Actor.log.warning(f"Extraction strategy '{name}' failed: {str(last_error)[:100]}")  # type: ignore
+                    if pending and not running:
+                        start_next()
+        finally:
+            for task in running:
+                task.cancel()
+                self._stats['cancelled'] += 1
+
+        self._stats['failed'] += 1
+        raise last_error if last_error is not None else RuntimeError('No extraction strategy available')
+
+    def stats(self) -> Dict[str, Any]:
+        strategies = {}
+        for name in self.strategies:
+            latencies = sorted(self._latencies[name])
+            strategies[name] = {
+                'starts': self._starts[name],
+                'wins': self._wins[name],
+                'win_rate': round(self._wins[name] / self._starts[name], 3) if self._starts[name] else None,
+                'median_latency_seconds': round(statistics.median(latencies), 3) if latencies else None,
+                'hedge_delay_seconds': round(self.hedge_delay(name), 3),
+            }
+        return {**self._stats, 'order': self.ranked(), 'strategies': strategies}
+
+
+_extraction_hedger = ExtractionHedger(EXTRACTION_STRATEGIES)
+
+
+# ============================================================ #
+#                        CORE FUNCTIONS                       #
+# ============================================================ #
+
+@_profiler.hook('process_url')
+async def process_url(
+    url: str,
+    download_mode: str,
+    quality: str,
+    max_items: int,
+    proxy_url: str | None = None,
+    cookies: str | None = None,
+    raise_errors: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Process a single Instagram URL (video, reel, or post) and extract metadata/videos.
+
+    Args:
+        url: Instagram URL (video, reel, or post)
+        download_mode: 'videos' or 'metadata_only'
+        quality: Quality preference
+        max_items: Maximum items to process
+        proxy_url: Optional proxy URL
+        cookies: Optional cookies string
+        raise_errors: Re-raise retryable failures of the whole URL instead of
+            returning them as error records
+
+    Returns:
+        List of metadata dictionaries for each processed item
+    """
+    fixture_token = _fixture_url.set(url)
+    try:
+        Actor.log.info(f"Processing: {url}")  # type: ignore
+
+        temp_dir = None
+
+        # Use scrapling to fetch the Instagram page HTML stealthily before yt-dlp.
+        # Metadata-only runs skip this and only fetch the page if extraction fails.
+        page_html = None
+        if download_mode != 'metadata_only':
+            page_html = await _run_stage('extract', asyncio.to_thread(_fetch_page_html, url))
+
+        # With several cookie sets, each URL extracts with the next ready identity
+        identity = None
+        if _identity_pool.enabled:
+            identity = await _run_stage('extract', _identity_pool.acquire())
+            cookies = identity.cookies if identity is not None else None
+            if identity is None:
+                Actor.log.warning(f"No usable cookie identity left, extracting {url} without cookies")  # type: ignore
+
+        # Get yt-dlp options
+        opts = get_ydl_opts(download_mode, quality, proxy_url, max_items, cookies, url)
+
+        # Use temp directory for cookie file if provided
+        temp_dir = None
+        cookie_path = None
+        if cookies:
+            temp_dir = await asyncio.to_thread(tempfile.mkdtemp)
+            cookie_path = os.path.join(temp_dir, 'cookies.txt')
+            try:
+                netscape_cookies = _convert_json_cookies_to_netscape(cookies)
+                await asyncio.to_thread(Path(cookie_path).write_text, netscape_cookies, encoding='utf-8')
+                opts['cookiefile'] = cookie_path
+                Actor.log.info('Using provided cookies for authenticated extraction')  # type: ignore
+                # Add additional headers when using cookies for better authentication
+                if 'http_headers' not in opts:
+                    opts['http_headers'] = _get_stealth_headers(url)
+                opts['http_headers'].update({
+                    'X-Requested-With': 'XMLHttpRequest',
+                    'X-Instagram-AJAX': '1',
+                    'X-IG-App-ID': '936619743392459',
+                })
+            except Exception as e:
+                Actor.log.warning(f'Could not write cookies file: {e}')  # type: ignore
+                cookie_path = None
+
+        def run_extraction(options: Dict[str, Any]) -> Dict[str, Any] | None:
+            def extract() -> Dict[str, Any] | None:
+                # Metadata-only runs skip format resolution entirely
+                if download_mode == 'metadata_only':
+                    return _extract_metadata_listing(url, options, max_items)
+                with yt_dlp.YoutubeDL(options) as ydl:
+                    if _watermarks.enabled:
+                        return _extract_new_entries(ydl, url, max_items)
+                    return ydl.extract_info(url, download=False)
+
+            return _fixtures.exchange('extract', f"{download_mode}:{url}", extract)
+
+        # Extract info, racing the alternate strategies when the first one is slow or blocked
+        try:
+            tried: List[CookieIdentity] = []
+            while True:
+                try:
+                    info = await _extraction_hedger.extract(run_extraction, opts, cookies, temp_dir)
+                except DeadlineExceeded:
+                    raise
+                except Exception as identity_error:
+                    if identity is None or not _identity_pool.record(identity, str(identity_error)) or not cookie_path:
+                        raise
+                    # Blocked for this account: move the extraction to another identity
+                    tried.append(identity)
+                    replacement = await _identity_pool.acquire(exclude=tried, wait=False)
+                    if replacement is None:
+                        raise
+                    _identity_pool.rotated()
+                    Actor.log.info(f"Retrying {url} with cookie {replacement.name} instead of {identity.name}")  # type: ignore
+                    identity, cookies = replacement, replacement.cookies
+                    await asyncio.to_thread(Path(cookie_path).write_text, cookies, encoding='utf-8')
+                    continue
+                if identity is not None:
+                    # yt-dlp rewrites the cookie file with the session cookies it was sent
+                    cookie_jar = None
+                    if cookie_path:
+                        with contextlib.suppress(OSError):
+                            cookie_jar = await asyncio.to_thread(Path(cookie_path).read_text, encoding='utf-8')
+                    _identity_pool.record(identity, cookie_jar=cookie_jar)
+                break
+            if proxy_url:
+                _m_proxy_extractions.inc(outcome='success')
+        except Exception as extraction_error:
+            try:
+                error_msg = str(extraction_error)
+            except Exception:
+                error_msg = "Unknown extraction error"
+            if proxy_url:
+                _m_proxy_extractions.inc(outcome=_classify_error(error_msg))
+
+            # Metadata-only: the page itself embeds the fields we need
+            info = None
+            if download_mode == 'metadata_only' and not isinstance(extraction_error, DeadlineExceeded):
+                page_html = await _run_stage('extract', asyncio.to_thread(_fetch_page_html, url))
+                info = _parse_embedded_page_metadata(page_html, url) if page_html else None
+                if info:
+                    Actor.log.info(f"Extraction failed, using metadata embedded in the page for {url}")  # type: ignore
+            if info is None:
+                # Check if this is an authentication-related error
+                if any(keyword in error_msg.lower() for keyword in ['login required', 'authentication required', 'not available', 'rate-limit']):
+                    Actor.log.error(f"All extraction attempts failed for {url} - Content may require authentication. Try providing Instagram cookies in the 'cookies' input parameter.")  # type: ignore
+                    Actor.log.error("To get cookies: 1) Log into Instagram in your browser, 2) Use browser dev tools to export cookies, 3) Provide them as JSON in the cookies field")  # type: ignore
+                else:
+                    Actor.log.error(f"All extraction attempts failed for {url}: {error_msg}")  # type: ignore
+                raise extraction_error
+
+        if not info:
+            raise ValueError(f"Could not extract info for {url}")
+
+        results = []
+
+        # Metadata-only listings may hold URL-only entries; resolve them in small batches
+        if download_mode == 'metadata_only' and info.get('entries'):
+            info['entries'] = await _run_stage('extract', _resolve_metadata_stubs(info['entries'], opts))
+
+        # Handle different types of content
+        if 'entries' in info:
+            entries = info['entries']
+            if entries is None:
+                Actor.log.warning(f"No entries found in playlist/channel: {url}")  # type: ignore
+                entries = []
+            else:
+                entries = [e for e in entries if e is not None]
+                Actor.log.info(f"Found {len(entries)} valid items in playlist/channel")  # type: ignore
+                if _scheduling_policy == 'sjf':
+                    # Durations are known after extraction: short items first
+                    entries.sort(key=_estimate_job_seconds)
+
+            for index, entry in enumerate(entries):
+                if _run_budget.exhausted:
+                    # Keep what is done; the caller records the URL as unfinished
+                    Actor.log.warning(f"Run budget exhausted after {len(results)}/{len(entries)} items of {url}")  # type: ignore
+                    if _watermarks.enabled:
+                        for unprocessed in entries[index:]:
+                            _watermarks.mark_failed(url, unprocessed)
+                    results.append({
+                        'url': url,
+                        'error': str(DeadlineExceeded('run', _run_budget.budget_seconds or 0)),
+                        'quality_requested': quality,
+                        'collected_at': datetime.now(UTC).isoformat(),
+                    })
+                    break
+                if entry:
+                    metadata = await process_single_video(entry, download_mode, quality, proxy_url, cookies)
+                    results.append(metadata)
+                    if _watermarks.enabled:
+                        if metadata.get('error'):
+                            _watermarks.mark_failed(url, entry)
+                        else:
+                            _watermarks.mark(url, entry)
+        else:
+            metadata = await process_single_video(info, download_mode, quality, proxy_url, cookies, raise_errors)
+            results.append(metadata)
+
+        return results
+
+    except Exception as e:
+        try:
+            error_str = str(e)
+        except Exception:
+            error_str = "Unknown processing error"
+        Actor.log.error(f"Failed to process {url}: {error_str}")  # type: ignore
+        if raise_errors and _is_retryable_error(error_str):
+            raise
+        return [{
+            'url': url,
+            'error': error_str,
+            'quality_requested': quality,
+            'collected_at': datetime.now(UTC).isoformat(),
+        }]
+
+    finally:
+        _fixture_url.reset(fixture_token)
+        if temp_dir:
+            await asyncio.to_thread(shutil.rmtree, temp_dir, ignore_errors=True)
+
+
+@_profiler.hook('process_single_video')
+async def process_single_video(
+    info: Dict[str, Any],
+    download_mode: str,
+    quality: str,
+    proxy_url: str | None = None,
+    cookies: str | None = None,
+    raise_errors: bool = False,
+) -> Dict[str, Any]:
+    """
+    Process a single video's metadata and optionally download it.
+
+    Args:
+        info: yt-dlp extracted info for the video
+        download_mode: 'videos' or 'metadata_only'
+        quality: Quality preference
+        proxy_url: Optional proxy URL
+        raise_errors: Re-raise retryable failures instead of returning an error record
+
+    Returns:
+        Metadata dictionary
+    """
+    try:
+        # Extract metadata
+        metadata = {
+            'video_id': info.get('id'),
+            'title': info.get('title'),
+            'author': info.get('uploader'),
+            'publish_date': info.get('upload_date'),
+            'duration': info.get('duration'),
             'view_count': info.get('view_count'),
             'like_count': info.get('like_count'),
             'description': info.get('description'),
@@ -918,34 +2129,53 @@ async def process_single_video(
             'quality_requested': quality,
         }
 
+        qualities = _normalize_qualities(quality)
+
+        # Several qualities: one extraction, one fetch, all renditions derived from it
+        if download_mode == 'videos' and len(qualities) > 1:
+            footprint = _estimate_download_footprint(info) * 2 + _output_sink.memory_overhead()
+            async with _memory_budget.reserve(footprint, _download_priority(info)):
+                renditions = await download_renditions(info, qualities, cookies)
+
+            primary = renditions[0]
+            metadata.update({
+                'file_size': primary['file_size'],
+                'file_extension': primary['file_extension'],
+                'file_path': primary['file_path'],
+                'downloaded_format': primary['downloaded_format'],
+                'storage_sink': _output_sink.name,
+                'download_url': primary['download_url'],
+                **{field: primary[field] for field in ('sha256', 'xxhash64', 'size_verified') if field in primary},
+                'renditions': renditions,
+            })
+            Actor.log.info(f"Stored {len(renditions)} renditions of {info.get('id')}: {', '.join(r['quality_requested'] for r in renditions)}")  # type: ignore
+
         # Download video if requested
-        if download_mode == 'videos':
-            video_data, extension, filename, used_format = await download_video_file(info, quality, proxy_url, cookies)
-            
-            # Generate safe key for storage
-            key = _generate_safe_key(info.get('id', 'unknown'), extension)
-            
+        elif download_mode == 'videos':
+            quality = qualities[0]
+            # Admit the download against the memory budget; buffering sinks hold the whole file
+            if _output_sink.buffers_whole_file:
+                footprint = _estimate_download_footprint(info)
+            else:
+                footprint = YDL_BUFFER_SIZE
+            footprint += _output_sink.memory_overhead()
+            async with _memory_budget.reserve(footprint, _download_priority(info)):
+                file_size, extension, key, used_format, download_url, integrity = await download_video_file(info, quality, proxy_url, cookies)
+
             metadata.update({
-                'file_size': len(video_data),
+                'file_size': file_size,
                 'file_extension': extension,
                 'file_path': key,  # Use the safe key instead of filename
                 'downloaded_format': used_format,
+                'storage_sink': _output_sink.name,
+                # Direct URL from the output sink so users can fetch the file without visiting the storage UI
+                'download_url': download_url,
+                **integrity,
             })
-
-            # Store video in key-value store
-            content_type = _guess_content_type(extension)
-            await Actor.set_value(key, video_data, content_type=content_type)  # type: ignore
-
-            # Generate direct API download URL so users can fetch without visiting the KV UI
-            store = await Actor.open_key_value_store()  # type: ignore
-            store_id = getattr(store, 'id', None)
-            if store_id:
-                download_url = f"https://api.apify.com/v2/key-value-stores/{store_id}/records/{key}?raw=1"
-                metadata['download_url'] = download_url
+            if download_url:
                 Actor.log.info(f"Download URL: {download_url}")  # type: ignore
             else:
-                metadata['download_url'] = None
-                Actor.log.warning("Key-value store ID unavailable, download_url set to None")  # type: ignore
+                Actor.log.warning(f"Output sink '{_output_sink.name}' returned no URL, download_url set to None")  # type: ignore
         else:
             metadata.update({
                 'file_size': None,
@@ -963,6 +2193,8 @@ async def process_single_video(
         except Exception:
             error_str = "Unknown video processing error"
         Actor.log.error(f"Failed to process video {info.get('id')}: {error_str}")  # type: ignore
+        if raise_errors and _is_retryable_error(error_str):
+            raise
         return {
             'video_id': info.get('id'),
             'url': info.get('webpage_url') or info.get('url'),
@@ -974,110 +2206,356 @@ async def process_single_video(
         }
 
 
-async def download_video_file(
+def _select_download_format(quality: str) -> str:
+    """Pick the yt-dlp format selector for a quality, avoiding merges when ffmpeg is unavailable."""
+    # Select best format matching user preference
+    format_candidates = _build_format_candidates(quality)
+
+    # Use the first format candidate - yt-dlp will handle fallbacks internally
+    selected_format = format_candidates[0] if format_candidates else 'bestvideo'  # Default to bestvideo when ffmpeg unavailable
+
+    # If ffmpeg is not available, ensure we don't use merging formats
+    if not FFMPEG_AVAILABLE and ('+' in selected_format or '*' in selected_format or 'bestaudio' in selected_format):
+        # For video downloads, prefer video-only formats
+        if quality.lower() not in ['audio_only', 'audio']:
+            selected_format = 'bestvideo'
+        else:
+            selected_format = 'bestaudio'
+
+    return selected_format
+
+
+def _write_cookie_file(cookies: str | None, work_dir: str) -> str | None:
+    """Write cookies as a Netscape cookie file in the work directory. Returns its path."""
+    if not cookies:
+        return None
+    cookie_path = os.path.join(work_dir, 'cookies.txt')
+    try:
+        netscape_cookies = _convert_json_cookies_to_netscape(cookies)
+        with open(cookie_path, 'w', encoding='utf-8') as cf:
+            cf.write(netscape_cookies)
+        Actor.log.info('Using provided cookies for authenticated download')  # type: ignore
+        return cookie_path
+    except Exception as e:
+        Actor.log.warning(f'Could not write cookies file: {e}')  # type: ignore
+        return None
+
+
+@_fixtures.media
+async def _fetch_media(
     info: Dict[str, Any],
     quality: str,
-    proxy_url: str | None = None,
-    cookies: str | None = None,
-) -> tuple[bytes, str, str, str]:
-    """Download the video (or audio) and return its bytes, extension, filename, and format used."""
+    cookies: str | None,
+    work_dir: str,
+    sink: OutputSink | None,
+    key_base: str,
+    format_spec: str | None = None,
+) -> Dict[str, Any]:
+    """
+    Download one rendition of a video into the scratch directory or straight into a sink.
+
+    Args:
+        info: yt-dlp extracted info for the video
+        quality: Quality preference
+        cookies: Optional cookies string
+        work_dir: Scratch directory for this download
+        sink: Output sink to stream into, or None to keep a local file in work_dir
+        key_base: Storage key without extension
+        format_spec: Concrete format from plan_formats(); the quality's yt-dlp selector when omitted
 
+    Returns:
+        Dict with 'format', 'extension' and either 'stored' (key, size, url) when the media
+        already reached the sink, or 'path' of the local file
+    """
     url = info.get('webpage_url') or info.get('url')
     if not url:
         raise ValueError('Video URL missing from info dict')
 
     quality = quality or 'best'
+    selected_format = format_spec or _select_download_format(quality)
+    cookie_path = await asyncio.to_thread(_write_cookie_file, cookies, work_dir)
 
-    # Select best format matching user preference
-    format_candidates = _build_format_candidates(quality)
+    # Separate DASH video+audio: stream both into a stream-copy ffmpeg instead of letting
+    # yt-dlp write two temp files and merge them into a third one
+    if FFMPEG_AVAILABLE and FFMPEG_BINARY and '+' in selected_format and quality.lower() not in ['audio_only', 'audio']:
+        try:
+            mux_opts = get_ydl_opts('videos', quality, None, 0, cookies, url)
+            mux_opts['format'] = selected_format
+            if cookie_path:
+                mux_opts['cookiefile'] = cookie_path
+
+            requested_formats = _resolve_requested_formats(info, mux_opts)
+            if requested_formats:
+                video_fmt, audio_fmt = requested_formats
+                used_format = f"{video_fmt.get('format_id')}+{audio_fmt.get('format_id')}"
+                Actor.log.info(f"Stream-muxing format '{used_format}' through ffmpeg (no intermediate files)")  # type: ignore
+                key = _generate_safe_key(key_base, 'mp4')
+                content_type = _guess_content_type('mp4')
+                if sink is not None:
+                    inner = await sink.open_writer(key, content_type)
+                else:
+                    inner = _LocalFileWriter(Path(work_dir) / key, key, content_type)
+                # The muxed output is hashed as it streams to its destination
+                writer = _HashingWriter(inner, key, content_type)
+                transfer_id = _progress_reporter.start_transfer(f"{info.get('id') or url} [{used_format}, stream mux]")
+                try:
+                    file_size, size_verified = await _mux_streams_to_fmp4(video_fmt, audio_fmt, mux_opts, writer, transfer_id, work_dir)
+                    download_url = await writer.close()
+                except BaseException:
+                    _progress_reporter.finish_transfer(transfer_id, success=False)
+                    await writer.abort()
+                    raise
+                _progress_reporter.finish_transfer(transfer_id)
+                fetched = {
+                    'format': used_format,
+                    'extension': 'mp4',
+                    'integrity': {**writer.digest.result(), 'size_verified': size_verified},
+                }
+                if sink is not None:
+                    fetched['stored'] = (key, file_size, download_url)
+                else:
+                    fetched['path'] = Path(work_dir) / key
+                return fetched
+        except IntegrityError:
+            # Truncated input: retry the download rather than switching strategies
+            raise
+        except Exception as mux_error:
+            Actor.log.warning(f"Stream mux unavailable, falling back to yt-dlp merge: {mux_error}")  # type: ignore
+
+    # A single progressive format goes through the shared CDN client (pooled HTTP/2
+    # connections) straight into its destination, without a temp file
+    if _cdn_client.available and '+' not in selected_format:
+        try:
+            direct_opts = get_ydl_opts('videos', quality, None, 0, cookies, url)
+            direct_opts['format'] = selected_format
+            resolved = _resolve_format_selection(info, direct_opts)
+            if (
+                resolved.get('url') and not resolved.get('requested_formats')
+                and resolved.get('protocol', 'https') in STREAMABLE_PROTOCOLS
+            ):
+                used_format = str(resolved.get('format_id') or selected_format)
+                extension = (resolved.get('ext') or 'mp4').lower()
+                key = _generate_safe_key(key_base, extension)
+                content_type = _guess_content_type(extension)
+                if sink is not None:
+                    inner = await sink.open_writer(key, content_type)
+                else:
+                    inner = _LocalFileWriter(Path(work_dir) / key, key, content_type)
+                writer = _HashingWriter(inner, key, content_type)
+                transfer_id = _progress_reporter.start_transfer(f"{info.get('id') or url} [{used_format}, direct]")
+                try:
+                    size_verified = await _fetch_format_to_writer(resolved, writer, transfer_id)
+                    download_url = await writer.close()
+                except BaseException:
+                    _progress_reporter.finish_transfer(transfer_id, success=False)
+                    await writer.abort()
+                    raise
+                _progress_reporter.finish_transfer(transfer_id)
+                fetched = {
+                    'format': used_format,
+                    'extension': extension,
+                    'integrity': {**writer.digest.result(), 'size_verified': size_verified},
+                }
+                if sink is not None:
+                    fetched['stored'] = (key, writer.size, download_url)
+                else:
+                    fetched['path'] = Path(work_dir) / key
+                return fetched
+        except IntegrityError:
+            raise
+        except Exception as direct_error:
+            Actor.log.warning(f"Direct CDN fetch unavailable, falling back to yt-dlp download: {direct_error}")  # type: ignore
+
+    # CRITICAL FIX: Don't use proxy for video downloads - Instagram CDN doesn't need authentication
+    # Proxy causes 50KB/s bottleneck. Only metadata extraction needs proxy.
+    opts = get_ydl_opts('videos', quality, None, 0, cookies, url)  # Pass None for proxy_url
+    # Name the output after the storage key so several renditions can share a work directory
+    opts['outtmpl'] = os.path.join(work_dir, key_base.replace('%', '%%') + '.%(ext)s')
+    opts['format'] = selected_format
+    if cookie_path:
+        opts['cookiefile'] = cookie_path
+
+    Actor.log.info(f"Download using format '{selected_format}' (ffmpeg available: {FFMPEG_AVAILABLE})")  # type: ignore
+    
+    # Feed byte counters into the run-wide progress reporter (no per-callback logging)
+    transfer_id = _progress_reporter.start_transfer(f"{info.get('id') or url} [{selected_format}]")
+    # Sizes announced by the server (Content-Length) per output file
+    announced_sizes: Dict[str, int] = {}
+
+    def progress_hook(d):
+        """Forward download byte counters to the aggregated progress reporter"""
+        # Raising from a hook aborts the download in yt-dlp's thread
+        _check_deadline()
+        if d['status'] == 'downloading' and d.get('total_bytes') and d.get('filename'):
+            announced_sizes[d['filename']] = d['total_bytes']
+        if d['status'] in ('downloading', 'finished'):
+            _progress_reporter.update(
+                transfer_id,
+                d.get('filename'),
+                d.get('downloaded_bytes') or 0,
+                d.get('total_bytes') or d.get('total_bytes_estimate') or 0,
+            )
+
+    opts['progress_hooks'] = [progress_hook]
+
+    # Single-file downloads are hashed while they are written; remote sinks also start
+    # uploading before the download finishes
+    uploader = None
+    if '+' not in selected_format:
+        streaming_sink = sink if sink is not None and sink.supports_streaming else None
+        uploader = _GrowingFileUploader(streaming_sink, key_base)
+        opts['progress_hooks'].append(uploader.on_progress)
+
+    def run_download() -> Dict[str, Any]:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            # Reuse the formats we already extracted instead of extracting the page again;
+            # both calls report the exact output path, unlike download()
+            if info.get('formats'):
+                return ydl.process_ie_result(copy.deepcopy(info), download=True)
+            return ydl.extract_info(url, download=True)
+
+    try:
+        # Run the blocking download in a worker thread so the event loop (and the
+        # progress publisher) keeps running while bytes are transferred
+        result = await asyncio.to_thread(run_download)
+
+        media_path = _downloaded_file_path(result)
+        if not media_path or not await asyncio.to_thread(media_path.is_file):
+            raise FileNotFoundError('Download completed but no media file was produced')
+
+        file_size = (await asyncio.to_thread(media_path.stat)).st_size
+        expected_size = announced_sizes.get(str(media_path))
+        if expected_size and file_size != expected_size:
+            # Remove it so the retry does not take it for an already finished download
+            await asyncio.to_thread(media_path.unlink, missing_ok=True)
+            raise IntegrityError(f"received {file_size} of {expected_size} bytes")
+
+        extension = media_path.suffix.lstrip('.').lower()
+        fetched = {'format': opts['format'], 'extension': extension, 'path': media_path}
+
+        streamed = await uploader.finish(media_path) if uploader else None
+        if streamed and uploader.uploads:
+            fetched['stored'] = streamed
+        # Merged outputs are new files and need their own pass
+        digest = uploader.digest if uploader and uploader.digest else await asyncio.to_thread(_digest_file, media_path)
+        fetched['integrity'] = {**digest.result(), 'size_verified': expected_size is not None}
+
+        _progress_reporter.finish_transfer(transfer_id)
+        return fetched
+
+    except Exception as e:
+        if uploader:
+            await uploader.discard()
+        _progress_reporter.finish_transfer(transfer_id, success=False)
+        Actor.log.error(f"Download failed for {url} with format '{opts['format']}': {e}")
+        raise
+
+
+async def _fetch_verified_media(
+    info: Dict[str, Any],
+    quality: str,
+    cookies: str | None,
+    work_dir: str,
+    sink: OutputSink | None,
+    key_base: str,
+    format_spec: str | None = None,
+) -> Dict[str, Any]:
+    """_fetch_media(), retried when the download turns out truncated."""
+    attempt = 0
+    while True:
+        try:
+            return await _fetch_media(info, quality, cookies, work_dir, sink, key_base, format_spec)
+        except IntegrityError as integrity_error:
+            attempt += 1
+            if attempt > DOWNLOAD_INTEGRITY_RETRIES:
+                raise
+            Actor.log.warning(f"Incomplete download of {key_base} ({integrity_error}), retrying ({attempt}/{DOWNLOAD_INTEGRITY_RETRIES})")  # type: ignore
+            _m_retries.inc(error_class='integrity')
 
-    # Use the first format candidate - yt-dlp will handle fallbacks internally
-    selected_format = format_candidates[0] if format_candidates else 'bestvideo'  # Default to bestvideo when ffmpeg unavailable
 
-    # If ffmpeg is not available, ensure we don't use merging formats
-    if not FFMPEG_AVAILABLE and ('+' in selected_format or '*' in selected_format or 'bestaudio' in selected_format):
-        # For video downloads, prefer video-only formats
-        if quality.lower() not in ['audio_only', 'audio']:
-            selected_format = 'bestvideo'
-        else:
-            selected_format = 'bestaudio'
+_format_plan_stats: collections.Counter = collections.Counter()
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # CRITICAL FIX: Don't use proxy for video downloads - Instagram CDN doesn't need authentication
-        # Proxy causes 50KB/s bottleneck. Only metadata extraction needs proxy.
-        opts = get_ydl_opts('videos', quality, None, 0, cookies, url)  # Pass None for proxy_url
-        opts['outtmpl'] = os.path.join(temp_dir, '%(id)s.%(ext)s')
-        opts['format'] = selected_format
 
-        cookie_path = None
-        if cookies:
-            cookie_path = os.path.join(temp_dir, 'cookies.txt')
-            try:
-                netscape_cookies = _convert_json_cookies_to_netscape(cookies)
-                with open(cookie_path, 'w', encoding='utf-8') as cf:
-                    cf.write(netscape_cookies)
-                Actor.log.info('Using provided cookies for authenticated download')  # type: ignore
-            except Exception as e:
-                Actor.log.warning(f'Could not write cookies file: {e}')  # type: ignore
-                cookie_path = None
-        if cookie_path:
-            opts['cookiefile'] = cookie_path
-
-        # When we are extracting audio-only and ffmpeg is available, convert to mp3 for convenience
-        if quality.lower() == 'audio_only' and FFMPEG_AVAILABLE:
-            opts['postprocessors'] = [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }]
-            opts['keepvideo'] = False
-            opts['merge_output_format'] = 'mp3'
-
-        _clear_directory(temp_dir)
-
-        Actor.log.info(f"Download using format '{selected_format}' (ffmpeg available: {FFMPEG_AVAILABLE})")  # type: ignore
-        
-        # Add progress hook for monitoring
-        download_start_time = datetime.now(UTC)
-        
-        def progress_hook(d):
-            """Monitor download progress and log speed/ETA"""
-            if d['status'] == 'downloading':
-                downloaded = d.get('downloaded_bytes', 0)
-                total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-                speed = d.get('speed', 0)
-                eta = d.get('eta', 0)
-                
-                if total > 0 and downloaded > 0:
-                    percent = (downloaded / total) * 100
-                    speed_mb = (speed / 1024 / 1024) if speed else 0
-                    Actor.log.info(f"Progress: {percent:.1f}% ({downloaded/1024/1024:.1f}MB/{total/1024/1024:.1f}MB) at {speed_mb:.2f}MB/s, ETA: {eta}s")
-            elif d['status'] == 'finished':
-                elapsed = (datetime.now(UTC) - download_start_time).total_seconds()
-                Actor.log.info(f"Download completed in {elapsed:.1f}s")
-        
-        opts['progress_hooks'] = [progress_hook]
+async def _fetch_planned_media(
+    info: Dict[str, Any],
+    quality: str,
+    cookies: str | None,
+    work_dir: str,
+    sink: OutputSink | None,
+    key_base: str,
+) -> Dict[str, Any]:
+    """
+    Fetch a rendition, moving down the planned formats when a download fails.
 
+    The candidates come from plan_formats() on the already extracted info, so a retry
+    needs neither a new extraction nor a new format selection. Infos without a format
+    list fall back to the quality's yt-dlp selector.
+    """
+    plan = plan_formats(info, quality)
+    if not plan:
+        _format_plan_stats['selector_fallback'] += 1
+        return await _fetch_verified_media(info, quality, cookies, work_dir, sink, key_base)
+
+    _format_plan_stats['planned'] += 1
+    last_error: Exception | None = None
+    for index, format_spec in enumerate(plan):
+        if index:
+            _format_plan_stats['next_candidate'] += 1
+            _m_retries.inc(error_class=_classify_error(str(last_error)))
+            Actor.log.warning(f"Format '{plan[index - 1]}' of {key_base} failed ({str(last_error)[:100]}), trying '{format_spec}'")  # type: ignore
+            # Partial files of the failed format must not be resumed by the next one
+            await asyncio.to_thread(_remove_matching, Path(work_dir), glob.escape(key_base) + '.*')
         try:
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                ydl.download([url])
+            fetched = await _fetch_verified_media(info, quality, cookies, work_dir, sink, key_base, format_spec)
+        except DeadlineExceeded:
+            raise
+        except Exception as format_error:
+            last_error = format_error
+            continue
+        if index:
+            _format_plan_stats['recovered'] += 1
+        return fetched
+
+    _format_plan_stats['exhausted'] += 1
+    raise last_error
 
-            media_path = _find_downloaded_media(temp_dir)
-            if not media_path:
-                raise FileNotFoundError('Download completed but no media file was produced')
 
-            with media_path.open('rb') as f:
-                data = f.read()
+@_profiler.hook('download_video_file')
+async def download_video_file(
+    info: Dict[str, Any],
+    quality: str,
+    proxy_url: str | None = None,
+    cookies: str | None = None,
+) -> tuple[int, str, str, str, str | None, Dict[str, Any]]:
+    """
+    Download the video (or audio) into the output sink.
 
-            extension = media_path.suffix.lstrip('.').lower()
-            filename = media_path.name
+    Returns:
+        Tuple of (file_size, extension, storage key, format used, download URL, integrity),
+        where integrity holds sha256 (and xxhash64) plus size_verified
+    """
+    # Each download borrows a reusable worker directory, reserved against the scratch quota
+    async with _scratch_space.acquire(_estimate_download_footprint(info)) as work_path:
+        key_base = info.get('id', 'unknown')
+        if _needs_audio_extraction(quality):
+            # Fetch the source locally; the mp3 conversion runs in the post-processing pool
+            source = await _run_stage('download', _fetch_planned_media(info, quality, cookies, str(work_path), None, key_base))
+            fetched = await _run_stage('postprocess', _extract_audio(source, str(work_path), key_base))
+        else:
+            fetched = await _run_stage(
+                'download',
+                _fetch_planned_media(info, quality, cookies, str(work_path), _output_sink, key_base),
+            )
 
-            Actor.log.info(f"Download succeeded with format '{opts['format']}' → {filename}")
-            return data, extension, filename, opts['format']
+        if fetched.get('stored'):
+            key, file_size, download_url = fetched['stored']
+        else:
+            media_path = fetched['path']
+            key = _generate_safe_key(info.get('id', 'unknown'), fetched['extension'])
+            file_size = (await asyncio.to_thread(media_path.stat)).st_size
+            download_url = await _run_stage('store', _output_sink.put_file(key, media_path, _guess_content_type(fetched['extension'])))
 
-        except Exception as e:
-            Actor.log.error(f"Download failed for {url} with format '{opts['format']}': {e}")
-            raise
+        return file_size, fetched['extension'], key, fetched['format'], download_url, fetched['integrity']
 
 
 async def process_single_url(
@@ -1088,10 +2566,15 @@ async def process_single_url(
     proxy_url: str | None = None,
     proxy_configuration: Any | None = None,
     cookies: str | None = None,
+    raise_errors: bool = False,
 ) -> tuple[int, int]:
     """
     Process a single Instagram URL with circuit breaker pattern.
-    
+
+    With raise_errors, a retryable failure of the whole URL (extraction, or the
+    download of a single video) is re-raised so a work queue can retry it, instead
+    of being pushed as an error record.
+
     Returns:
         Tuple of (items_processed, items_successful)
     """
@@ -1104,7 +2587,7 @@ async def process_single_url(
             'quality_requested': quality,
             'collected_at': datetime.now(UTC).isoformat(),
         }
-        await Actor.push_data(error_data)
+        await _push_result(error_data)
         return 1, 0
     
     active_proxy_url = proxy_url
@@ -1112,18 +2595,26 @@ async def process_single_url(
         try:
             fresh_url = await proxy_configuration.new_url()
             active_proxy_url = str(fresh_url) if fresh_url else proxy_url
+            _m_proxy_sessions.inc(outcome='new' if fresh_url else 'reused')
         except Exception as proxy_error:
             Actor.log.warning(f"Unable to obtain fresh proxy URL: {proxy_error}")
+            _m_proxy_sessions.inc(outcome='error')
             active_proxy_url = proxy_url
 
     try:
         # Process URL (may return multiple items for playlists/channels)
-        results = await process_url(url, download_mode, quality, max_items, active_proxy_url, cookies)
+        results = await process_url(url, download_mode, quality, max_items, active_proxy_url, cookies, raise_errors)
 
-        # Push each result to dataset
+        if any(_is_run_budget_error(metadata.get('error')) for metadata in results):
+            # Out of time: flush the finished items, leave the URL for a later run
+            _run_budget.add_unfinished(url)
+            results = [metadata for metadata in results if 'error' not in metadata]
+            Actor.log.warning(f"Run budget exhausted, {url} left unfinished ({len(results)} items kept)")
+
+        # Push each result to the dataset (or the CLI result file)
         success_count = 0
         for metadata in results:
-            await Actor.push_data(metadata)
+            await _push_result(metadata)
             if 'error' not in metadata:  # Count successful items
                 success_count += 1
                 _record_success()
@@ -1134,12 +2625,18 @@ async def process_single_url(
         return len(results), success_count
 
     except Exception as e:
+        if _is_run_budget_error(e):
+            _run_budget.add_unfinished(url)
+            Actor.log.warning(f"Run budget exhausted, {url} left unfinished")
+            return 0, 0
         _record_failure()
         try:
             error_str = str(e)
         except Exception:
             error_str = "Unknown processing error"
         Actor.log.error(f"✗ Failed to process {url}: {error_str}")
+        if raise_errors:
+            raise
         # Still push error info to dataset
         error_data = {
             'url': url,
@@ -1147,21 +2644,312 @@ async def process_single_url(
             'quality_requested': quality,
             'collected_at': datetime.now(UTC).isoformat(),
         }
-        await Actor.push_data(error_data)
+        await _push_result(error_data)
         return 1, 0
 
 
+# ============================================================ #
+#                          SCHEDULING                          #
+# ============================================================ #
+
+
+_scheduling_policy = DEFAULT_SCHEDULING_POLICY
+
+
+def _download_priority(info: Dict[str, Any]) -> float | None:
+    """Admission priority for the memory budget (lower goes first); None outside SJF."""
+    return _estimate_job_seconds(info) if _scheduling_policy == 'sjf' else None
+
+
+# ============================================================ #
+#                       WORK QUEUE & POOL                      #
+# ============================================================ #
+
+
+async def _open_request_queue(name: str | None) -> Any:
+    """Open the named Apify request queue (shared by several runs) or a local stand-in."""
+    if name:
+        return await Actor.open_request_queue(name=name)  # type: ignore
+    return LocalRequestQueue(policy=_scheduling_policy)
+
+
+async def _intake_urls(
+    url_source: AsyncIterator[Any],
+    queue: Any,
+    quality: str | List[str],
+    intake_stats: Dict[str, int],
+    intake_done: asyncio.Event,
+) -> None:
+    """Validate, normalize and enqueue a URL stream, recording invalid URLs as error records."""
+    try:
+        async for item in url_source:
+            # Items are URLs or (url, input source) pairs
+            url, source = item if isinstance(item, tuple) else (item, None)
+            intake_stats['urls'] += 1
+            normalized_url = _normalize_instagram_url(url)
+            if not _validate_instagram_url(normalized_url):
+                Actor.log.warning(f"Skipping invalid or unsupported Instagram URL: {url}")
+                await _push_result({
+                    'url': url,
+                    'error': 'Invalid or unsupported Instagram URL',
+                    'quality_requested': quality,
+                    'collected_at': datetime.now(UTC).isoformat(),
+                })
+                intake_stats['invalid'] += 1
+                continue
+            if isinstance(queue, LocalRequestQueue):
+                if _run_budget.exhausted:
+                    # Workers have stopped; keep the rest of the input for a later run
+                    _run_budget.add_unfinished(normalized_url)
+                    continue
+                added = await queue.add_request(LocalRequest(normalized_url, source=source))
+            else:
+                # The platform queue is FIFO; under SJF short kinds at least jump ahead
+                forefront = _scheduling_policy == 'sjf' and _estimate_url_cost(normalized_url) <= SHORT_JOB_SECONDS
+                added = await queue.add_request(normalized_url, forefront=forefront)
+            if added is not None and added.was_already_present:
+                intake_stats['deduplicated'] += 1
+    finally:
+        intake_done.set()
+
+
+async def run_worker_pool(
+    queue: Any,
+    intake_done: asyncio.Event,
+    download_mode: str,
+    quality: str | List[str],
+    max_items: int,
+    proxy_url: str | None = None,
+    proxy_configuration: Any | None = None,
+    cookies: str | None = None,
+    max_concurrency: int = 3,
+    max_retries: int = QUEUE_MAX_RETRIES,
+) -> Dict[str, int]:
+    """
+    Drain a request queue with a fixed number of workers.
+
+    Retryable failures are reclaimed into the queue after an exponential backoff
+    (up to max_retries); an error record is written only once a request gives up.
+    Workers exit when the intake is done and the queue is finished, or when the run
+    budget is exhausted. Each URL runs under the URL deadline and holds one of
+    max_concurrency download slots, except while it waits for post-processing.
+
+    Returns:
+        Counters: processed, success, retried, failed, timed_out
+    """
+    totals = {'processed': 0, 'success': 0, 'retried': 0, 'failed': 0, 'timed_out': 0}
+    # Reclaim task -> its request, so requests still waiting can be recorded as unfinished
+    reclaims: Dict[asyncio.Task, Any] = {}
+    fetched = itertools.count()
+
+    async def reclaim_later(request: Any, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await queue.reclaim_request(request)
+
+    async def run_request(request: Any) -> tuple[int, int]:
+        url_timeout = _run_budget.url_timeout
+        token = _url_deadline.set(time.monotonic() + url_timeout)
+        _m_urls_in_flight.inc()
+        # Stages stop themselves at the deadline; cancellation is the backstop for
+        # anything between stages (e.g. waiting for the memory budget)
+        hard_limit = url_timeout
+        remaining = _run_budget.remaining()
+        if remaining is not None:
+            hard_limit = min(hard_limit, max(0.0, remaining))
+        try:
+            return await asyncio.wait_for(
+                process_single_url(
+                    request.url, download_mode, quality, max_items,
+                    proxy_url, proxy_configuration, cookies, raise_errors=True,
+                ),
+                hard_limit + DEADLINE_HARD_STOP_SLACK,
+            )
+        except asyncio.TimeoutError as timeout_error:
+            scope = 'run' if _run_budget.exhausted else 'url'
+            _run_budget.record_timeout(scope)
+            raise DeadlineExceeded(scope, hard_limit) from timeout_error
+        finally:
+            _m_urls_in_flight.dec()
+            _url_deadline.reset(token)
+
+    async def worker(index: int) -> None:
+        while True:
+            if _run_budget.exhausted:
+                return
+            request = await queue.fetch_next_request()
+            if request is None:
+                if intake_done.is_set() and not reclaims and await queue.is_finished():
+                    return
+                await asyncio.sleep(QUEUE_IDLE_POLL_INTERVAL)
+                continue
+
+            # Add small delay between concurrent requests
+            if next(fetched) > 0:
+                await asyncio.sleep(random.uniform(0.5, 1.5))
+
+            try:
+                async with _download_slots.hold() as slot:
+                    token = _download_slot.set(slot)
+                    try:
+                        processed, success = await run_request(request)
+                    finally:
+                        _download_slot.reset(token)
+            except Exception as e:
+                if _is_run_budget_error(e):
+                    _run_budget.add_unfinished(request.url)
+                    await queue.mark_request_as_handled(request)
+                    continue
+                if isinstance(e, DeadlineExceeded):
+                    totals['timed_out'] += 1
+                error_str = str(e) or 'Unknown processing error'
+                if request.retry_count < max_retries and _is_retryable_error(error_str):
+                    request.retry_count += 1
+                    delay = _queue_retry_delay(request.retry_count)
+                    _m_retries.inc(error_class=_classify_error(error_str))
+                    Actor.log.warning(f"Retrying {request.url} in {delay:.1f}s (attempt {request.retry_count + 1}/{max_retries + 1})")
+                    task = asyncio.create_task(reclaim_later(request, delay))
+                    reclaims[task] = request
+                    task.add_done_callback(lambda done: reclaims.pop(done, None))
+                    totals['retried'] += 1
+                    continue
+
+                await _push_result({
+                    'url': request.url,
+                    'error': error_str,
+                    'quality_requested': quality,
+                    'retry_count': request.retry_count,
+                    'collected_at': datetime.now(UTC).isoformat(),
+                })
+                totals['failed'] += 1
+                processed, success = 1, 0
+
+            await queue.mark_request_as_handled(request)
+            totals['processed'] += processed
+            totals['success'] += success
+
+    # URLs waiting for post-processing lend their download slot, so extra workers
+    # (one per post-processing slot) keep the download slots busy meanwhile
+    worker_count = max(1, max_concurrency)
+    _download_slots.configure(worker_count)
+    if _postprocess_pool.available:
+        if not _postprocess_pool.workers:
+            _postprocess_pool.configure()
+        worker_count += _postprocess_pool.workers
+    try:
+        await asyncio.gather(*(worker(i) for i in range(worker_count)))
+    finally:
+        for task, request in list(reclaims.items()):
+            task.cancel()
+            if _run_budget.exhausted:
+                _run_budget.add_unfinished(request.url)
+    return totals
+
+
+async def _drain_unfinished(queue: LocalRequestQueue) -> None:
+    """Move requests still waiting in a local queue to the run's unfinished URLs."""
+    while True:
+        request = await queue.fetch_next_request()
+        if request is None:
+            return
+        _run_budget.add_unfinished(request.url)
+        await queue.mark_request_as_handled(request)
+
+
+async def process_url_stream(
+    url_source: AsyncIterator[str],
+    download_mode: str,
+    quality: str | List[str],
+    max_items: int,
+    proxy_url: str | None = None,
+    cookies: str | None = None,
+    max_concurrency: int = 3,
+    proxy_configuration: Any | None = None,
+    request_queue: Any | None = None,
+) -> tuple[int, int]:
+    """
+    Process a URL stream of any length through a request queue and a fixed worker pool.
+
+    URLs are validated and enqueued by an intake task while the workers already run,
+    so memory use does not grow with the input size. Duplicate URLs are skipped.
+
+    Args:
+        url_source: Async iterator yielding raw URLs
+        download_mode: 'videos' or 'metadata_only'
+        quality: Quality preference (or list of qualities for multiple renditions)
+        max_items: Maximum items to process per URL
+        proxy_url: Optional proxy URL for metadata extraction
+        cookies: Optional cookies string
+        max_concurrency: Number of workers
+        proxy_configuration: Optional Apify ProxyConfiguration object for rotating proxies
+        request_queue: Apify request queue to use; a LocalRequestQueue when omitted
+
+    Returns:
+        Tuple of (items_processed, items_successful)
+    """
+    global _metrics_queue
+    queue = request_queue if request_queue is not None else LocalRequestQueue(policy=_scheduling_policy)
+    _metrics_queue = queue
+    intake_done = asyncio.Event()
+    intake_stats = {'urls': 0, 'invalid': 0, 'deduplicated': 0}
+
+    Actor.log.info(f"Processing URLs with {max(1, max_concurrency)} workers ({_scheduling_policy} scheduling)")
+    _schedule_metrics.start(_scheduling_policy)
+    _dns_cache.install()
+    _progress_reporter.start()
+    intake_task = asyncio.create_task(_intake_urls(url_source, queue, quality, intake_stats, intake_done))
+    try:
+        totals = await run_worker_pool(
+            queue, intake_done, download_mode, quality, max_items,
+            proxy_url, proxy_configuration, cookies, max_concurrency,
+        )
+        if _run_budget.exhausted and isinstance(queue, LocalRequestQueue):
+            # Draining also frees room for an intake blocked on a full queue
+            while True:
+                await _drain_unfinished(queue)
+                if intake_task.done():
+                    break
+                await asyncio.sleep(QUEUE_IDLE_POLL_INTERVAL)
+            await _drain_unfinished(queue)
+        elif _run_budget.exhausted:
+            Actor.log.warning('Run budget exhausted; unprocessed requests stay in the shared request queue')
+        await intake_task
+    finally:
+        if not intake_task.done():
+            intake_task.cancel()
+        await _progress_reporter.stop()
+        _cdn_client.close()
+
+    processed = totals['processed'] + intake_stats['invalid']
+    Actor.log.info(f"Processing complete! Successfully processed {totals['success']}/{processed} items")
+    if intake_stats['deduplicated']:
+        Actor.log.info(f"Skipped {intake_stats['deduplicated']} duplicate URLs")
+    _run_metrics['request_queue'] = {**intake_stats, **totals}
+    _run_metrics['run_budget'] = _run_budget.report()
+    _run_metrics['extraction_hedging'] = _extraction_hedger.stats()
+    _run_metrics['format_planner'] = dict(_format_plan_stats)
+    _run_metrics['cdn_http'] = _cdn_client.stats()
+    _run_metrics['scheduling'] = _schedule_metrics.report()
+    _run_metrics['dns_cache'] = _dns_cache.stats()
+    _run_metrics['memory_budget'] = _memory_budget.stats()
+    _run_metrics['scratch_space'] = _scratch_space.stats()
+    _run_metrics['stage_utilization'] = {'download': _download_slots.stats(), 'postprocess': _postprocess_pool.stats()}
+    return processed, totals['success']
+
+
 async def process_urls(
     urls: List[str],
     download_mode: str,
-    quality: str,
+    quality: str | List[str],
     max_items: int,
     proxy_url: str | None = None,
     proxy_configuration: Any | None = None,
     cookies: str | None = None,
-) -> None:
+    max_concurrency: int = 3,
+    request_queue: Any | None = None,
+    processes: int = 1,
+) -> tuple[int, int]:
     """
-    Process a list of Instagram URLs with parallel processing.
+    Process a list of Instagram URLs with a bounded worker pool.
 
     Args:
         urls: List of Instagram URLs (videos, reels, posts)
@@ -1170,43 +2958,486 @@ async def process_urls(
         max_items: Maximum items to process
         proxy_url: Optional proxy URL to use for downloading
         proxy_configuration: Optional Apify ProxyConfiguration object for rotating proxies
+        max_concurrency: Number of workers (downloads are further gated by the memory budget)
+        request_queue: Apify request queue to distribute work through; local when omitted
+        processes: Shard the URLs across this many worker processes when above 1
+
+    Returns:
+        Tuple of (items_processed, items_successful)
     """
-    total_processed = 0
-    total_success = 0
-    
-    # Process URLs with limited concurrency (2-3 at a time to avoid rate limits)
-    max_concurrent = min(3, len(urls))
-    semaphore = asyncio.Semaphore(max_concurrent)
-    
-    async def process_with_semaphore(url: str, index: int) -> tuple[int, int]:
-        """Process URL with rate limiting"""
-        async with semaphore:
-            # Add small delay between concurrent requests
-            if index > 0:
-                delay = random.uniform(0.5, 1.5)
-                await asyncio.sleep(delay)
-            return await process_single_url(
-                url, download_mode, quality, max_items, 
-                proxy_url, proxy_configuration, cookies
-            )
-    
-    # Process all URLs concurrently with semaphore limiting
-    Actor.log.info(f"Processing {len(urls)} URLs with max {max_concurrent} concurrent downloads")
-    tasks = [process_with_semaphore(url, i) for i, url in enumerate(urls)]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    # Calculate totals
-    for result in results:
-        if isinstance(result, tuple):
-            processed, success = result
-            total_processed += processed
-            total_success += success
-        else:
-            # Exception occurred
-            Actor.log.error(f"Task failed with exception: {result}")
-            total_processed += 1
+    async def url_source() -> AsyncIterator[str]:
+        for url in urls:
+            yield url
+
+    if processes > 1:
+        if request_queue is not None:
+            Actor.log.warning("Shared request queues are not used in multi-process mode; URLs are sharded locally")
+        if proxy_configuration is not None:
+            Actor.log.info("Worker processes use a fixed proxy URL (proxy rotation needs the Actor context)")
+        return await process_url_stream_sharded(
+            url_source(), download_mode, quality, max_items, proxy_url, cookies,
+            max_concurrency, processes,
+        )
+
+    return await process_url_stream(
+        url_source(), download_mode, quality, max_items, proxy_url, cookies,
+        max(1, min(max_concurrency, len(urls))), proxy_configuration, request_queue,
+    )
+
+
+# ============================================================ #
+#                       PROCESS SHARDING                       #
+# ============================================================ #
+
+
+async def _run_shard(shard_index: int, settings: Dict[str, Any], work_queue: Any, event_queue: Any, breaker_flag: Any) -> None:
+    """Event loop of one shard process: the regular worker pool fed by the parent."""
+    global _output_sink, _result_writer, _shared_breaker_flag, _breaker_listener, _scheduling_policy
+    _output_sink = _create_sink(settings['sink'])
+    _scheduling_policy = settings['scheduling_policy']
+    _result_writer = _EventQueueResultWriter(event_queue)
+    _shared_breaker_flag = breaker_flag
+    _breaker_listener = lambda success: event_queue.put(('breaker', success))
+
+    async def publish_status(message: str) -> None:
+        event_queue.put(('status', shard_index, message))
+
+    _progress_reporter.publisher = publish_status
+    _memory_budget.configure(settings['memory_budget_bytes'])
+    _scratch_space.configure(settings['scratch_storage'], settings['scratch_quota_bytes'])
+    _postprocess_pool.configure(settings['postprocess_workers'])
+    _run_budget.configure(**settings['run_budget'])
+    if settings['profiling']:
+        _profiler.start()
+    await asyncio.to_thread(yt_dlp.load)
+    if settings['fixtures']:
+        _fixtures.configure(**settings['fixtures'])
+    if settings['watermarks'] is not None:
+        _watermarks.configure(settings['watermarks'])
+    if settings['identities'] is not None:
+        _identity_pool.configure(**settings['identities'])
+    _loop_monitor.start(settings['loop_lag_threshold'])
+
+    report: Dict[str, Any] = {'processed': 0, 'success': 0}
+    try:
+        processed, success = await process_url_stream(
+            _iter_work_queue(work_queue),
+            settings['download_mode'],
+            settings['quality'],
+            settings['max_items'],
+            settings['proxy_url'],
+            settings['cookies'],
+            settings['max_concurrency'],
+        )
+        report.update(processed=processed, success=success)
+    finally:
+        _scratch_space.cleanup()
+        report['metrics'] = dict(_run_metrics)
+        report['unfinished'] = list(_run_budget.unfinished)
+        if _watermarks.enabled:
+            report['watermarks'] = {'updates': _watermarks.updates(), 'stats': _watermarks.stats()}
+        if _identity_pool.enabled:
+            report['identities'] = _identity_pool.stats()
+        if _loop_monitor.active:
+            await _loop_monitor.stop()
+            report['event_loop'] = _loop_monitor.report()
+        if _fixtures.mode:
+            _fixtures.close()
+            report['fixtures'] = _fixtures.counts()
+        if _profiler.active:
+            _profiler.stop()
+            report['profile'] = _profiler.report()
+            report['profile_stacks'] = _profiler.stacks()
+        event_queue.put(('done', shard_index, report))
+
+
+def _shard_process_main(shard_index: int, settings: Dict[str, Any], work_queue: Any, event_queue: Any, breaker_flag: Any) -> None:
+    """Entry point of a shard process (spawned, so it starts from a fresh interpreter)."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s [shard {shard_index}] [%(levelname)s] %(message)s',
+        stream=sys.stderr,
+    )
+    asyncio.run(_run_shard(shard_index, settings, work_queue, event_queue, breaker_flag))
+
+
+def _sync_shared_breaker(breaker_flag: Any) -> None:
+    """Mirror the parent's run-wide breaker (including its cooldown) into the flag the shards check."""
+    if _check_circuit_breaker():
+        breaker_flag.set()
+    else:
+        breaker_flag.clear()
+
+
+async def _relay_record_media(record: Dict[str, Any], relay_dir: Path) -> None:
+    """Store media a shard left in the relay directory in the parent's sink and fix up URLs."""
+    uploaded: Dict[str, str | None] = {}
+    for entry in [record, *(record.get('renditions') or [])]:
+        key = entry.get('file_path')
+        if not key:
+            continue
+        if key not in uploaded:
+            path = relay_dir / key
+            if not await asyncio.to_thread(path.is_file):
+                continue
+            extension = entry.get('file_extension') or path.suffix.lstrip('.')
+            uploaded[key] = await _output_sink.put_file(key, path, _guess_content_type(extension))
+            await asyncio.to_thread(path.unlink, missing_ok=True)
+        entry['download_url'] = uploaded[key]
+    if 'storage_sink' in record:
+        record['storage_sink'] = _output_sink.name
+
+
+async def process_url_stream_sharded(
+    url_source: AsyncIterator[str],
+    download_mode: str,
+    quality: str | List[str],
+    max_items: int,
+    proxy_url: str | None = None,
+    cookies: str | None = None,
+    max_concurrency: int = 3,
+    processes: int = 2,
+) -> tuple[int, int]:
+    """
+    Shard a URL stream across worker processes, each with its own event loop and yt-dlp.
+
+    The parent validates and deduplicates URLs and hands them out through a bounded
+    queue, so faster shards take more work. Shards send back result records,
+    circuit-breaker outcomes, status lines and final metrics; the parent pushes the
+    records, keeps the run-wide breaker (and shares its open state with the shards)
+    and aggregates metrics. Memory budget and scratch quota are split between shards.
+    Media for the key-value store is written by shards to a relay directory and
+    stored by the parent, which owns the Actor context.
+
+    Returns:
+        Tuple of (items_processed, items_successful)
+    """
+    context = multiprocessing.get_context('spawn')
+    work_queue = context.Queue(maxsize=processes * max(1, max_concurrency) * 4)
+    event_queue = context.Queue()
+    breaker_flag = context.Event()
+
+    relay_dir: Path | None = None
+    shard_sink = _output_sink.describe()
+    if _output_sink.name == 'kv':
+        relay_dir = Path(tempfile.mkdtemp(prefix=f'{SCRATCH_DIR_PREFIX}{os.getpid()}-relay-'))
+        shard_sink = {'type': 'local', 'directory': str(relay_dir)}
+
+    scratch_quota = _scratch_space.quota_bytes
+    if not scratch_quota:
+        scratch_quota = int(shutil.disk_usage(_scratch_space._base_dir()).free * DEFAULT_SCRATCH_QUOTA_SHARE)
+    settings = {
+        'download_mode': download_mode,
+        'quality': quality,
+        'max_items': max_items,
+        'proxy_url': proxy_url,
+        'cookies': cookies,
+        'max_concurrency': max_concurrency,
+        'sink': shard_sink,
+        'memory_budget_bytes': max(1, _memory_budget.budget_bytes // processes),
+        'scratch_storage': _scratch_space.storage,
+        'scratch_quota_bytes': max(1, scratch_quota // processes),
+        'postprocess_workers': max(1, (_postprocess_pool.workers or _available_cpus()) // processes),
+        'scheduling_policy': _scheduling_policy,
+        'run_budget': _shard_run_budget_settings(),
+        'profiling': _profiler.active,
+        'fixtures': _fixtures.describe(),
+        'watermarks': _watermarks.sources() if _watermarks.enabled else None,
+        'identities': _identity_pool.describe(),
+        'loop_lag_threshold': _loop_monitor.threshold,
+    }
+    if settings['identities'] is not None:
+        # Every shard uses every identity, so each gets a share of the per-identity budget
+        settings['identities']['requests_per_minute'] /= processes
+
+    shards = [
+        context.Process(
+            target=_shard_process_main,
+            args=(index, settings, work_queue, event_queue, breaker_flag),
+            name=f'igdl-shard-{index}',
+            daemon=True,
+        )
+        for index in range(processes)
+    ]
+    # Explicit S3 credentials reach the shards through their inherited environment,
+    # not through the pickled settings
+    credentials = _output_sink.credentials_env() if isinstance(_output_sink, S3Sink) else {}
+    saved_env = {name: os.environ.get(name) for name in credentials}
+    os.environ.update(credentials)
+    try:
+        for shard in shards:
+            shard.start()
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    Actor.log.info(f"Sharding URLs across {processes} worker processes ({max_concurrency} workers each)")
+
+    def put_work(item: str | None) -> None:
+        while True:
+            try:
+                work_queue.put(item, timeout=SHARD_EVENT_POLL_INTERVAL)
+                return
+            except queue.Full:
+                if not any(shard.is_alive() for shard in shards):
+                    raise RuntimeError('All shard processes exited')
+
+    intake_stats = {'urls': 0, 'invalid': 0, 'deduplicated': 0}
+    # URLs wait here, ordered by the scheduling policy, until a shard has room
+    global _metrics_queue
+    pending = LocalRequestQueue(policy=_scheduling_policy)
+    _metrics_queue = pending
+    intake_done = asyncio.Event()
+
+    async def feed() -> None:
+        try:
+            while not (intake_done.is_set() and await pending.is_finished()):
+                if _run_budget.exhausted:
+                    await _drain_unfinished(pending)
+                    if intake_done.is_set():
+                        break
+                    await asyncio.sleep(QUEUE_IDLE_POLL_INTERVAL)
+                    continue
+                request = await pending.fetch_next_request()
+                if request is None:
+                    await asyncio.sleep(QUEUE_IDLE_POLL_INTERVAL)
+                    continue
+                await asyncio.to_thread(put_work, (request.url, request.source))
+                await pending.mark_request_as_handled(request)
+        finally:
+            for _ in shards:
+                await asyncio.to_thread(put_work, None)
+
+    _schedule_metrics.start(_scheduling_policy)
+    intake_task = asyncio.create_task(_intake_urls(url_source, pending, quality, intake_stats, intake_done))
+    feeder = asyncio.create_task(feed())
+    reports: Dict[int, Dict[str, Any]] = {}
+    status_lines: Dict[int, str] = {}
+    finished: set[int] = set()
+    try:
+        while len(finished) < processes:
+            try:
+                event = await asyncio.to_thread(event_queue.get, True, SHARD_EVENT_POLL_INTERVAL)
+            except queue.Empty:
+                for index, shard in enumerate(shards):
+                    if index not in finished and not shard.is_alive():
+                        Actor.log.error(f"Shard {index} exited unexpectedly (exit code {shard.exitcode})")
+                        finished.add(index)
+                # Open shards send no outcomes, so the cooldown is checked here too
+                _sync_shared_breaker(breaker_flag)
+                continue
+
+            kind = event[0]
+            if kind == 'result':
+                record = event[1]
+                if relay_dir is not None:
+                    await _relay_record_media(record, relay_dir)
+                await _push_result(record)
+            elif kind == 'breaker':
+                if event[1]:
+                    _record_success()
+                else:
+                    _record_failure()
+                _sync_shared_breaker(breaker_flag)
+            elif kind == 'status':
+                status_lines[event[1]] = event[2]
+                message = ' | '.join(f"#{index}: {line}" for index, line in sorted(status_lines.items()))
+                try:
+                    await (_progress_reporter.publisher or Actor.set_status_message)(message)  # type: ignore
+                except Exception:
+                    pass
+            elif kind == 'done':
+                finished.add(event[1])
+                reports[event[1]] = event[2]
+
+        for task in (intake_task, feeder):
+            if task.done() and task.exception():
+                Actor.log.error(f"URL intake failed: {task.exception()}")
+    finally:
+        for task in (intake_task, feeder):
+            if not task.done():
+                task.cancel()
+        for shard in shards:
+            await asyncio.to_thread(shard.join, 5)
+            if shard.is_alive():
+                shard.terminate()
+        if relay_dir is not None:
+            shutil.rmtree(relay_dir, ignore_errors=True)
+
+    processed = sum(report['processed'] for report in reports.values()) + intake_stats['invalid']
+    success = sum(report['success'] for report in reports.values())
+    queue_totals = dict(intake_stats)
+    for report in reports.values():
+        for name, value in (report['metrics'].get('request_queue') or {}).items():
+            if name in ('processed', 'success', 'retried', 'failed'):
+                queue_totals[name] = queue_totals.get(name, 0) + value
+    _run_metrics['request_queue'] = queue_totals
+    for index, report in sorted(reports.items()):
+        if report.get('profile'):
+            _profiler.add_shard(index, report['profile'], report.get('profile_stacks') or {})
+        if report.get('fixtures'):
+            _fixtures.merge(report['fixtures'])
+        if report.get('watermarks'):
+            _watermarks.merge(report['watermarks']['updates'], report['watermarks']['stats'])
+        if report.get('identities'):
+            _identity_pool.merge(report['identities'])
+        if report.get('event_loop'):
+            _loop_monitor.merge(report['event_loop'])
+    for report in reports.values():
+        _run_budget.unfinished.extend(report.get('unfinished') or [])
+        for scope, count in ((report['metrics'].get('run_budget') or {}).get('timeouts') or {}).items():
+            _run_budget.record_timeout(scope, count)
+    _run_metrics['run_budget'] = _run_budget.report()
+    _run_metrics['scheduling'] = _schedule_metrics.report()
+    _run_metrics['sharding'] = {
+        'processes': processes,
+        'shards': [
+            {
+                'shard': index,
+                'processed': report['processed'],
+                'success': report['success'],
+                'memory_budget': report['metrics'].get('memory_budget'),
+                'scratch_space': report['metrics'].get('scratch_space'),
+                'extraction_hedging': report['metrics'].get('extraction_hedging'),
+                'stage_utilization': report['metrics'].get('stage_utilization'),
+            }
+            for index, report in sorted(reports.items())
+        ],
+    }
+    Actor.log.info(f"Processing complete! Successfully processed {success}/{processed} items across {processes} processes")
+    return processed, success
+
+
+# ============================================================ #
+#                     COORDINATOR (FAN-OUT)                    #
+# ============================================================ #
+
+
+async def run_coordinator(
+    urls: List[str],
+    inp: Dict[str, Any],
+    shard_count: int,
+    proxy_url: str | None = None,
+) -> tuple[int, int]:
+    """
+    Fan a URL list out to worker runs and merge their results into this run.
+
+    URLs are deduplicated and split into contiguous shards. Each shard runs as a run of
+    this Actor on the platform (a CLI subprocess locally); failed shards are restarted
+    up to fanOutMaxRetries times. Progress is published as the status message, and
+    each shard's dataset and RUN_METRICS are merged once it finishes.
+
+    Returns:
+        Tuple of (items_merged, items_successful)
+    """
+    unique_urls = list(dict.fromkeys(urls))
+    shards = _split_into_shards(unique_urls, shard_count)
+    max_retries = int(inp.get('fanOutMaxRetries', FANOUT_MAX_RETRIES))
+    base_input = {key: value for key, value in inp.items() if key != 'urls'}
+    if inp.get('cookies') or inp.get('cookieSets'):
+        # Every worker run uses every identity, so each gets a share of the per-identity budget
+        requests_per_minute = inp.get('identityRequestsPerMinute')
+        if requests_per_minute is None:
+            requests_per_minute = IDENTITY_REQUESTS_PER_MINUTE
+        base_input['identityRequestsPerMinute'] = float(requests_per_minute) / len(shards)
+
+    if _on_apify_platform():
+        runner: Any = PlatformShardRunner(base_input, inp.get('fanOutMemoryMb'))
+    else:
+        runner = LocalShardRunner(base_input, _output_sink, _scheduling_policy, proxy_url)
+    relay_dir = getattr(runner, 'relay_dir', None)
+
+    state = {index: {'status': 'pending', 'attempts': 0, 'line': ''} for index in range(len(shards))}
+    Actor.log.info(f"Coordinator: {len(unique_urls)} unique URLs in {len(shards)} shards ({type(runner).__name__})")
+
+    async def merge(index: int, handle: Dict[str, Any]) -> Dict[str, Any]:
+        items = success = 0
+        async for record in runner.iterate_results(handle):
+            if relay_dir is not None:
+                await _relay_record_media(record, relay_dir)
+            await _push_result(record)
+            items += 1
+            if 'error' in record:
+                _record_failure()
+            else:
+                success += 1
+                _record_success()
+        _run_budget.unfinished.extend(await runner.unfinished(handle))
+        await runner.merge_state(index, handle)
+        return {'items': items, 'success': success, 'metrics': await runner.metrics(handle)}
+
+    async def run_shard(index: int, shard_urls: List[str]) -> Dict[str, Any]:
+        shard_state = state[index]
+        while True:
+            shard_state['attempts'] += 1
+            handle = await runner.start(index, shard_urls)
+            try:
+                while True:
+                    await asyncio.sleep(FANOUT_POLL_INTERVAL)
+                    shard_state['status'], shard_state['line'] = await runner.poll(handle)
+                    if shard_state['status'] != 'running':
+                        break
+            except BaseException:
+                await runner.cancel(handle)
+                raise
+
+            if shard_state['status'] == 'succeeded' or shard_state['attempts'] > max_retries:
+                if shard_state['status'] != 'succeeded':
+                    Actor.log.error(f"Shard {index} failed after {shard_state['attempts']} attempts ({shard_state['line']}); merging partial results")
+                merged = await merge(index, handle)
+                return {'shard': index, 'urls': len(shard_urls), 'status': shard_state['status'], 'attempts': shard_state['attempts'], **merged}
+            Actor.log.warning(f"Shard {index} failed ({shard_state['line']}), restarting")
+
+    async def report_progress() -> None:
+        while True:
+            await asyncio.sleep(FANOUT_POLL_INTERVAL)
+            counts = collections.Counter(shard['status'] for shard in state.values())
+            summary = ', '.join(f"{count} {status}" for status, count in sorted(counts.items()))
+            try:
+                await Actor.set_status_message(f"Coordinator: {summary}")  # type: ignore
+            except Exception:
+                pass
 
-    Actor.log.info(f"Processing complete! Successfully processed {total_success}/{total_processed} items")
+    progress_task = asyncio.create_task(report_progress())
+    shard_tasks = [asyncio.create_task(run_shard(index, shard_urls)) for index, shard_urls in enumerate(shards)]
+    try:
+        reports = await asyncio.gather(*shard_tasks)
+    finally:
+        progress_task.cancel()
+        # A failed shard must not leave the others running: cancelled shards abort their
+        # worker runs, and the work directory is removed only once they have stopped
+        for task in shard_tasks:
+            task.cancel()
+        await asyncio.gather(*shard_tasks, return_exceptions=True)
+        runner.cleanup()
+
+    items = sum(report['items'] for report in reports)
+    success = sum(report['success'] for report in reports)
+    _run_metrics['fan_out'] = {
+        'runner': type(runner).__name__,
+        'unique_urls': len(unique_urls),
+        'duplicates_removed': len(urls) - len(unique_urls),
+        'items': items,
+        'success': success,
+        'shards': [
+            {
+                'shard': report['shard'],
+                'urls': report['urls'],
+                'status': report['status'],
+                'attempts': report['attempts'],
+                'items': report['items'],
+                'success': report['success'],
+                'duration_seconds': (report['metrics'] or {}).get('duration_seconds'),
+                'request_queue': (report['metrics'] or {}).get('request_queue'),
+            }
+            for report in reports
+        ],
+    }
+    _run_metrics['run_budget'] = _run_budget.report()
+    Actor.log.info(f"Coordinator complete! Merged {items} items ({success} successful) from {len(shards)} shards")
+    return items, success
 
 
 # ============================================================ #
@@ -1220,7 +3451,14 @@ async def main() -> None:
     start_time = datetime.now(UTC)
     Actor.log.info(f"Instagram Video Downloader started at {start_time.isoformat()}")
 
+    # yt-dlp is needed by every mode; import it while the Actor initializes
+    _start_background_imports()
+
+    actor_init_started = time.perf_counter()
     async with Actor:
+        _startup_timer.record('actor_init', time.perf_counter() - actor_init_started)
+        input_started = time.perf_counter()
+
         # Get input
         inp = await Actor.get_input() or {}
 
@@ -1263,6 +3501,9 @@ async def main() -> None:
             Actor.log.error("No URLs provided in input. Expected 'urls' field with string or list of Instagram URLs.")
             return
 
+        _startup_timer.record('input_parsing', time.perf_counter() - input_started)
+        proxy_setup_started = time.perf_counter()
+
         # Extract proxy configuration (ONLY for metadata, not video downloads)
         proxy_url: str | None = None
         proxy_configuration = None
@@ -1292,12 +3533,64 @@ async def main() -> None:
                 proxy_configuration = None
                 proxy_url = None
 
+        _startup_timer.record('proxy_setup', time.perf_counter() - proxy_setup_started)
+
         # Extract additional parameters
         download_mode = inp.get('downloadMode', 'videos')
         quality = inp.get('quality', 'best')
+        # Several qualities produce all renditions from one extraction and one download
+        if inp.get('qualities'):
+            quality = _normalize_qualities(inp['qualities'])
+            if len(quality) == 1:
+                quality = quality[0]
         max_items = int(inp.get('maxItems', 10))
+        max_concurrency = int(inp.get('maxConcurrency') or 3)
+        # 0 means one worker process per available CPU
+        worker_processes = int(inp.get('workerProcesses', 1) or 0)
+        if worker_processes <= 0:
+            worker_processes = _available_cpus()
+        if inp.get('memoryBudgetMb'):
+            _memory_budget.configure(int(inp['memoryBudgetMb']) * 1024 * 1024)
+        global _output_sink, _scheduling_policy
+        scheduling_policy = inp.get('schedulingPolicy') or DEFAULT_SCHEDULING_POLICY
+        if scheduling_policy not in SCHEDULING_POLICIES:
+            Actor.log.warning(f"Unknown scheduling policy '{scheduling_policy}', using '{DEFAULT_SCHEDULING_POLICY}'")
+            scheduling_policy = DEFAULT_SCHEDULING_POLICY
+        _scheduling_policy = scheduling_policy
+        try:
+            _output_sink = _create_sink(_sink_config_from_input(inp))
+        except Exception as sink_error:
+            Actor.log.error(f"Invalid output sink configuration: {sink_error}")
+            return
+        Actor.log.info(f"Output sink: {_output_sink.name}")
+
+        scratch_quota_mb = inp.get('scratchQuotaMb')
+        _scratch_space.configure(
+            inp.get('scratchStorage') or 'disk',
+            int(scratch_quota_mb) * 1024 * 1024 if scratch_quota_mb else None,
+        )
+        _postprocess_pool.configure(int(inp.get('postprocessWorkers') or 0) or None)
+
+        # The run budget ends at the configured limit or the platform timeout, whichever is first
+        budget_candidates = [_platform_seconds_left()]
+        if inp.get('runTimeBudgetSecs'):
+            budget_candidates.append(float(inp['runTimeBudgetSecs']) - (time.perf_counter() - actor_init_started))
+        budget_candidates = [seconds for seconds in budget_candidates if seconds is not None]
+        try:
+            stage_timeouts = _parse_stage_timeouts(inp.get('stageTimeoutSecs'))
+        except ValueError as stage_error:
+            Actor.log.warning(f"Ignoring stage timeouts: {stage_error}")
+            stage_timeouts = {}
+        _run_budget.configure(
+            max(1.0, min(budget_candidates)) if budget_candidates else None,
+            inp.get('urlTimeoutSecs'),
+            stage_timeouts,
+        )
+        if _run_budget.budget_seconds:
+            Actor.log.info(f"Run time budget: {_run_budget.budget_seconds:.0f}s (work stops {_run_budget.grace_seconds:.0f}s before)")
 
         Actor.log.info(f"Download mode: {download_mode}, Quality: {quality}, Max items: {max_items}")
+        Actor.log.info(f"Worker processes: {worker_processes}, max concurrency: {max_concurrency}, download memory budget: {_memory_budget.budget_bytes // (1024 * 1024)}MB")
 
         # Validate URLs (comprehensive Instagram URL validation)
         valid_urls = []
@@ -1309,24 +3602,86 @@ async def main() -> None:
                 Actor.log.warning(f"Skipping invalid or unsupported Instagram URL: {url}")
 
         if not valid_urls:
-            Actor.log.error("No valid Instagram URLs found. Supported formats: posts (/p/), reels (/reel/), IGTV (/tv/)")
+            Actor.log.error("No valid Instagram URLs found. Supported formats: posts (/p/), reels (/reel/), IGTV (/tv/), stories (/stories/), profiles (/<username>/ and its /reels/, /tagged/ tabs), hashtags (/explore/tags/<tag>/)")
             return
 
         # Extract cookies if provided
         cookies = inp.get('cookies')
         if cookies:
             Actor.log.info('Cookies provided in input — will use for authenticated downloads')
+        cookie_sets = ([cookies] if cookies else []) + list(inp.get('cookieSets') or [])
+        if cookie_sets:
+            requests_per_minute = inp.get('identityRequestsPerMinute')
+            _identity_pool.configure(
+                [_cookie_set_text(cookie_set) for cookie_set in cookie_sets],
+                float(requests_per_minute) if requests_per_minute is not None else None,
+            )
+            Actor.log.info(f"Cookie identities: {len(_identity_pool.identities)} ({_identity_pool.requests_per_minute:g} extractions per minute each)")
 
-        # Process the URLs
-        await process_urls(
-            valid_urls,
-            download_mode,
-            quality,
-            max_items,
-            proxy_url,
-            proxy_configuration,
-            cookies,
-        )
+        # Wait for the background yt-dlp import (usually already done) and report startup
+        with _startup_timer.phase('wait_yt_dlp'):
+            await asyncio.to_thread(yt_dlp.load)
+        _startup_timer.record('time_to_first_url', time.perf_counter() - actor_init_started)
+        _run_metrics['startup'] = _startup_timer.report()
+
+        # A named request queue lets several runs share (and deduplicate) the same work
+        request_queue = None
+        if inp.get('requestQueueName'):
+            try:
+                request_queue = await _open_request_queue(inp['requestQueueName'])
+                Actor.log.info(f"Using shared request queue '{inp['requestQueueName']}'")
+            except Exception as queue_error:
+                Actor.log.warning(f"Unable to open request queue, processing locally: {queue_error}")
+
+        if inp.get('profiling'):
+            _profiler.start()
+
+        # Incremental mode: listings stop at content seen by earlier runs
+        if inp.get('incremental'):
+            try:
+                await _watermarks.load(inp.get('watermarkStoreName'))
+            except Exception as watermark_error:
+                Actor.log.warning(f"Unable to load watermarks, crawling listings in full: {watermark_error}")
+
+        # Live metrics for scrapers, on the container's web server port
+        if inp.get('metricsEndpoint'):
+            try:
+                await _metrics_server.start(_web_server_port())
+            except OSError as server_error:
+                Actor.log.warning(f"Unable to start the metrics endpoint: {server_error}")
+
+        # Catch synchronous work that blocks the event loop
+        lag_threshold_ms = inp.get('loopLagThresholdMs')
+        _loop_monitor.start(lag_threshold_ms / 1000 if lag_threshold_ms is not None else None)
+
+        # Coordinator mode: fan the URLs out to worker runs and merge their results
+        fan_out_runs = int(inp.get('fanOutRuns') or 0)
+        if fan_out_runs > 1:
+            await run_coordinator(valid_urls, inp, fan_out_runs, proxy_url)
+        else:
+            await process_urls(
+                valid_urls,
+                download_mode,
+                quality,
+                max_items,
+                proxy_url,
+                proxy_configuration,
+                cookies,
+                max_concurrency,
+                request_queue,
+                worker_processes,
+            )
+        await _save_unfinished_urls()
+        await _watermarks.save()
+        if _watermarks.enabled:
+            _run_metrics['incremental'] = _watermarks.report()
+        if _identity_pool.enabled:
+            _run_metrics['identities'] = _identity_pool.stats()
+        if _loop_monitor.active:
+            await _loop_monitor.stop()
+            _run_metrics['event_loop'] = _loop_monitor.report()
+        await _metrics_server.stop()
+        await _save_profile()
 
         # Performance metrics
         end_time = datetime.now(UTC)
@@ -1342,6 +3697,291 @@ async def main() -> None:
         Actor.log.info(f"✓ Success rate: {(_success_count/(_success_count + _failure_count) * 100):.1f}%" if (_success_count + _failure_count) > 0 else "N/A")
         Actor.log.info("=" * 60)
 
+        _scratch_space.cleanup()
+
+        _run_metrics['duration_seconds'] = round(duration, 3)
+        try:
+            await Actor.set_value('RUN_METRICS', _run_metrics)
+        except Exception as metrics_error:
+            Actor.log.warning(f"Unable to store run metrics: {metrics_error}")
+
+
+# ============================================================ #
+#                        CLI BATCH MODE                        #
+# ============================================================ #
+
+def _parse_url_line(line: str) -> tuple[str, str | None] | None:
+    """
+    Extract a URL from one input line: plain text, a JSON string or a JSON object with 'url'.
+
+    Returns:
+        Tuple of (url, source) where source is the object's optional 'source' field used
+        by fair-share scheduling, or None for blank and comment lines
+    """
+    text = line.strip()
+    if not text or text.startswith('#'):
+        return None
+    if text[0] in '{"':
+        try:
+            parsed = json.loads(text)
+        except ValueError:
+            return text, None
+        if isinstance(parsed, dict):
+            url = parsed.get('url')
+            source = parsed.get('source')
+            return (str(url), str(source) if source else None) if url else None
+        return (str(parsed), None) if parsed else None
+    return text, None
+
+
+async def _iter_url_lines(source: str) -> AsyncIterator[tuple[str, str | None]]:
+    """Yield (url, source) pairs from a text/JSONL file (or '-' for stdin) one line at a time."""
+    stream = sys.stdin if source == '-' else await asyncio.to_thread(open, source, encoding='utf-8')
+    try:
+        while True:
+            # readline() can block (stdin, slow disks); keep it off the event loop
+            line = await asyncio.to_thread(stream.readline)
+            if not line:
+                return
+            parsed = _parse_url_line(line)
+            if parsed:
+                yield parsed
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+async def _log_status(message: str) -> None:
+    """Progress publisher for the CLI: there is no Actor status message outside the platform."""
+    Actor.log.info(f"Status: {message}")
+
+
+def _build_arg_parser() -> argparse.ArgumentParser:
+    """Command line interface. Without a command the script runs as an Apify Actor."""
+    parser = argparse.ArgumentParser(
+        description='Instagram video downloader. Runs as an Apify Actor when started without a command.',
+    )
+    parser.add_argument('--benchmark-import', action='store_true',
+                        help='Measure module import time in fresh interpreters and exit')
+    commands = parser.add_subparsers(dest='command')
+
+    batch = commands.add_parser('batch', help='Process URLs from a file or stdin, writing JSON Lines results')
+    batch.add_argument('input', help="Text or JSONL file with one URL (or {\"url\": ...} object) per line, '-' for stdin")
+    batch.add_argument('-o', '--output', default='results.jsonl', help='JSON Lines result file (default: results.jsonl)')
+    batch.add_argument('--append', action='store_true', help='Append to the result file instead of overwriting it')
+    batch.add_argument('--media-dir', default='./output', help='Directory for downloaded media (default: ./output)')
+    batch.add_argument('--mode', choices=['videos', 'metadata_only'], default='videos', help='Download mode')
+    batch.add_argument('--quality', default='best',
+                       help='best, 720p, 1080p or audio_only; comma-separated for multiple renditions')
+    batch.add_argument('--max-items', type=int, default=10, help='Maximum items per URL')
+    batch.add_argument('--concurrency', type=int, default=3, help='URLs processed at once (per process)')
+    batch.add_argument('--processes', type=int, default=1, help='Worker processes; 0 for one per available CPU')
+    batch.add_argument('--schedule', choices=SCHEDULING_POLICIES, default=DEFAULT_SCHEDULING_POLICY,
+                       help='Order of pending URLs: arrival order (default), shortest job first, or fair share per input source')
+    batch.add_argument('--memory-budget-mb', type=int, help='Memory budget for in-flight downloads')
+    batch.add_argument('--scratch-storage', choices=['disk', 'tmpfs'], default='disk', help='Where temporary files live')
+    batch.add_argument('--scratch-quota-mb', type=int, help='Scratch space quota')
+    batch.add_argument('--postprocess-workers', type=int, help='Concurrent ffmpeg post-processing jobs (default: one per available CPU)')
+    batch.add_argument('--run-budget', type=float, metavar='SECONDS',
+                       help='Stop starting new work and record unfinished URLs before this many seconds pass')
+    batch.add_argument('--url-timeout', type=float, metavar='SECONDS', help=f'Deadline per URL (default: {DEFAULT_URL_TIMEOUT:.0f})')
+    batch.add_argument('--stage-timeout', action='append', metavar='STAGE=SECONDS',
+                       help=f"Deadline per stage ({', '.join(STAGE_TIMEOUTS)}); repeatable")
+    batch.add_argument('--unfinished', metavar='PATH',
+                       help='File for URLs left unfinished by the run budget (default: next to the result file)')
+    batch.add_argument('--proxy', help='Proxy URL for metadata extraction')
+    batch.add_argument('--cookies-file', action='append',
+                       help='Cookies file (Netscape or JSON format); repeat to spread extractions across several accounts')
+    batch.add_argument('--identity-rpm', type=float, metavar='N',
+                       help=f'Extractions per minute for each cookie identity (default: {IDENTITY_REQUESTS_PER_MINUTE:g}, 0 for no limit)')
+    batch.add_argument('--metrics', help='Also write run metrics as JSON to this path')
+    batch.add_argument('--metrics-port', type=int, metavar='PORT',
+                       help=f'Serve live Prometheus metrics on this port at {METRICS_PATH} while the batch runs')
+    batch.add_argument('--loop-lag-threshold-ms', type=float, metavar='MS', default=DEFAULT_LOOP_LAG_THRESHOLD * 1000,
+                       help='Capture the blocking stack when the event loop stalls this long; 0 turns the monitor off')
+    batch.add_argument('--profile', metavar='DIR',
+                       help='Sample CPU stacks and trace allocations; write profile.json and profile.stacks.txt to DIR')
+    batch.add_argument('--incremental', metavar='STATE_FILE',
+                       help='Only output listing items not seen by earlier runs; watermarks are kept in STATE_FILE')
+    fixtures = batch.add_mutually_exclusive_group()
+    fixtures.add_argument('--record-fixtures', metavar='DIR',
+                          help='Record page fetches, extractions and media fetches with their timing into DIR')
+    fixtures.add_argument('--replay-fixtures', metavar='DIR',
+                          help='Serve recorded exchanges from DIR instead of the network')
+    batch.add_argument('--fixture-media', choices=FIXTURE_MEDIA_MODES, default='placeholder',
+                       help='Record media bytes, or only their size (replayed as zeros)')
+    batch.add_argument('--replay-speed', type=float, default=1.0, metavar='FACTOR',
+                       help='Scale recorded durations on replay (1 = as recorded, 0 = no waiting)')
+    batch.add_argument('--baseline', metavar='PATH',
+                       help='Compare throughput, HTTP requests per URL and peak memory of a fixture run with this '
+                            f'baseline (written when missing); exit with {REGRESSION_EXIT_CODE} on a regression')
+    batch.add_argument('--update-baseline', action='store_true', help='Overwrite the baseline with this run instead')
+    batch.add_argument('--baseline-tolerance', type=float, default=BASELINE_TOLERANCE, metavar='SHARE',
+                       help=f'Allowed throughput drop and peak memory growth (default: {BASELINE_TOLERANCE})')
+    return parser
+
+
+async def run_batch(args: argparse.Namespace) -> int:
+    """
+    Run the downloader over a URL file or stdin outside the Actor runtime.
+
+    Results are appended to a JSON Lines file as items finish and media goes to a
+    local directory. Input is read lazily, so memory use is independent of its size.
+
+    Returns:
+        Process exit code
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stderr)
+    _start_background_imports()
+    started = time.perf_counter()
+
+    if args.input != '-' and not os.path.isfile(args.input):
+        Actor.log.error(f"Input file not found: {args.input}")
+        return 2
+
+    global _output_sink, _result_writer, _scheduling_policy
+    # Both create their directory and the result file, so they are set up in a thread
+    _output_sink = await asyncio.to_thread(LocalDirectorySink, args.media_dir)
+    _scheduling_policy = args.schedule
+    _result_writer = await asyncio.to_thread(JsonlResultWriter, args.output, append=args.append)
+    _progress_reporter.publisher = _log_status
+    if args.memory_budget_mb:
+        _memory_budget.configure(args.memory_budget_mb * 1024 * 1024)
+    _scratch_space.configure(
+        args.scratch_storage,
+        args.scratch_quota_mb * 1024 * 1024 if args.scratch_quota_mb else None,
+    )
+    _postprocess_pool.configure(args.postprocess_workers)
+    try:
+        stage_timeouts = _parse_stage_timeouts(args.stage_timeout)
+    except ValueError as stage_error:
+        Actor.log.error(str(stage_error))
+        return 2
+    _run_budget.configure(args.run_budget, args.url_timeout, stage_timeouts)
+    _run_budget.unfinished_path = args.unfinished or str(Path(args.output).expanduser().with_suffix('.unfinished.txt'))
+
+    cookies = None
+    if args.cookies_file:
+        cookie_sets = [await asyncio.to_thread(Path(path).expanduser().read_text, encoding='utf-8') for path in args.cookies_file]
+        cookies = cookie_sets[0]
+        _identity_pool.configure([_cookie_set_text(cookie_set) for cookie_set in cookie_sets], args.identity_rpm)
+
+    qualities = _normalize_qualities(args.quality)
+    quality: str | List[str] = qualities[0] if len(qualities) == 1 else qualities
+
+    Actor.log.info(f"Batch mode: {args.input} -> {args.output}, media in {_output_sink.directory}")
+    Actor.log.info(f"Download mode: {args.mode}, Quality: {quality}, Max items: {args.max_items}, Concurrency: {args.concurrency}")
+
+    with _startup_timer.phase('wait_yt_dlp'):
+        await asyncio.to_thread(yt_dlp.load)
+    _run_metrics['startup'] = _startup_timer.report()
+
+    if args.record_fixtures or args.replay_fixtures:
+        try:
+            await asyncio.to_thread(
+                _fixtures.configure,
+                'record' if args.record_fixtures else 'replay',
+                args.record_fixtures or args.replay_fixtures,
+                args.fixture_media,
+                args.replay_speed,
+            )
+        except (OSError, ValueError) as fixture_error:
+            Actor.log.error(f"Fixtures unavailable: {fixture_error}")
+            return 2
+        Actor.log.info(f"Fixture mode: {_fixtures.mode} ({_fixtures.directory})")
+
+    if args.incremental:
+        await _watermarks.load(path=args.incremental)
+    if args.metrics_port:
+        await _metrics_server.start(args.metrics_port)
+    _loop_monitor.start(args.loop_lag_threshold_ms / 1000)
+    if args.profile:
+        _profiler.output_dir = args.profile
+        _profiler.start()
+
+    processes = args.processes if args.processes > 0 else _available_cpus()
+    processing_started = time.perf_counter()
+    try:
+        if processes > 1:
+            processed, success = await process_url_stream_sharded(
+                _iter_url_lines(args.input),
+                args.mode,
+                quality,
+                args.max_items,
+                args.proxy,
+                cookies,
+                args.concurrency,
+                processes,
+            )
+        else:
+            processed, success = await process_url_stream(
+                _iter_url_lines(args.input),
+                args.mode,
+                quality,
+                args.max_items,
+                args.proxy,
+                cookies,
+                args.concurrency,
+            )
+    finally:
+        await _loop_monitor.stop()
+        await _save_unfinished_urls()
+        await _watermarks.save()
+        await _metrics_server.stop()
+        await _save_profile()
+        await asyncio.to_thread(_result_writer.close)
+        await asyncio.to_thread(_scratch_space.cleanup)
+
+    duration = time.perf_counter() - started
+    _run_metrics['duration_seconds'] = round(duration, 3)
+    if _watermarks.enabled:
+        _run_metrics['incremental'] = _watermarks.report()
+    if _identity_pool.enabled:
+        _run_metrics['identities'] = _identity_pool.stats()
+    if _loop_monitor.threshold > 0:
+        _run_metrics['event_loop'] = _loop_monitor.report()
+
+    regressions: List[str] = []
+    if _fixtures.mode:
+        await asyncio.to_thread(_fixtures.close)
+        summary = _fixtures.summary(processed, time.perf_counter() - processing_started)
+        _run_metrics['fixtures'] = summary
+        Actor.log.info(
+            f"Fixture {summary['mode']}: {summary['urls_per_second']} URLs/s, "
+            f"{summary['requests_per_url']} HTTP requests per URL, peak memory {summary['peak_memory_bytes']} bytes"
+        )
+        if args.baseline:
+            baseline_path = Path(args.baseline).expanduser()
+            if args.update_baseline or not await asyncio.to_thread(baseline_path.is_file):
+                await asyncio.to_thread(baseline_path.write_text, json.dumps(summary, indent=2), encoding='utf-8')
+                Actor.log.info(f"Baseline written to {baseline_path}")
+            else:
+                baseline = json.loads(await asyncio.to_thread(baseline_path.read_text, encoding='utf-8'))
+                regressions = _compare_with_baseline(summary, baseline, args.baseline_tolerance)
+                for regression in regressions:
+                    Actor.log.error(f"Regression against {baseline_path}: {regression}")
+                if not regressions:
+                    Actor.log.info(f"No regression against {baseline_path}")
+    elif args.baseline:
+        Actor.log.warning('--baseline needs --record-fixtures or --replay-fixtures; skipping the comparison')
+
+    if args.metrics:
+        metrics_path = Path(args.metrics).expanduser()
+        await asyncio.to_thread(metrics_path.write_text, json.dumps(_run_metrics, indent=2, default=str), encoding='utf-8')
+
+    Actor.log.info(f"✓ Wrote {_result_writer.count} records to {args.output} in {duration:.2f}s ({success}/{processed} successful)")
+    if regressions:
+        return REGRESSION_EXIT_CODE
+    return 1 if processed and not success else 0
+
+
+_startup_timer.record('module_import', time.perf_counter() - _MODULE_IMPORT_STARTED)
+
 
 if __name__ == "__main__":
+    cli_args = _build_arg_parser().parse_args()
+    if cli_args.benchmark_import:
+        sys.exit(_benchmark_import_time())
+    if cli_args.command == 'batch':
+        sys.exit(asyncio.run(run_batch(cli_args)))
     asyncio.run(main())
@@ -0,0 +1,243 @@
+"""Live metrics in the Prometheus text exposition format, and the server exposing them."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from typing import Any, Dict, List
+
+from actor import Actor
+
+
+# ============================================================ #
+#                         LIVE METRICS                         #
+# ============================================================ #
+
+METRICS_PREFIX = 'igdl'
+METRICS_PATH = '/metrics'
+DEFAULT_WEB_SERVER_PORT = 4321
+
+# Latency buckets (seconds) shared by the stage histograms
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+
+def _escape_label_value(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    """Base of the metric types: a name, help text, label names and per-label-set values."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.documentation = documentation
+        self.label_names = labels
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class MetricCounter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}_total{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class MetricGauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class MetricHistogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                bound_label = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, bound_label)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-wide metrics in the Prometheus text exposition format.
+
+    Instrumented code updates counters, gauges and histograms as it runs; values that
+    already live elsewhere (circuit breaker, queues, progress) are read by collectors
+    at scrape time.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Any] = []
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> MetricCounter:
+        metric = MetricCounter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> MetricGauge:
+        metric = MetricGauge(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> MetricHistogram:
+        metric = MetricHistogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, function: Any) -> Any:
+        """Register a function that refreshes gauges right before each scrape."""
+        self._collectors.append(function)
+        return function
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as collect_error:
+                Actor.log.debug(f"Metrics collector failed: {collect_error}")
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+_metrics = MetricsRegistry()
+_m_urls_in_flight = _metrics.gauge('urls_in_flight', 'URLs being processed by workers.')
+_m_stage_in_flight = _metrics.gauge('stage_in_flight', 'Items currently in a processing stage.', ('stage',))
+_m_stage_seconds = _metrics.histogram('stage_duration_seconds', 'Duration of processing stages.', ('stage', 'outcome'))
+_m_results = _metrics.counter('results', 'Result records written.', ('outcome',))
+_m_retries = _metrics.counter('retries', 'Retried operations by error class.', ('error_class',))
+_m_proxy_sessions = _metrics.counter('proxy_sessions', 'Proxy session requests by outcome.', ('outcome',))
+_m_proxy_extractions = _metrics.counter('proxy_extractions', 'Extractions through a proxy by outcome.', ('outcome',))
+_m_breaker_open = _metrics.gauge('circuit_breaker_open', 'Whether the circuit breaker is open (1) or closed (0).')
+_m_breaker_outcomes = _metrics.gauge('circuit_breaker_outcomes', 'Outcomes counted by the circuit breaker.', ('outcome',))
+_m_queue_depth = _metrics.gauge('queue_requests', 'Requests in the local work queue by state.', ('state',))
+_m_downloaded_bytes = _metrics.gauge('downloaded_bytes', 'Bytes downloaded so far, including transfers in progress.')
+_m_transfers = _metrics.gauge('transfers', 'Media transfers by state.', ('state',))
+_m_memory_budget = _metrics.gauge('memory_budget_bytes', 'Download memory budget by state.', ('state',))
+_m_stage_slots = _metrics.gauge('stage_slots', 'Download and post-processing slots by state.', ('stage', 'state'))
+
+
+class MetricsServer:
+    """Minimal HTTP server answering GET /metrics with the registry's text output."""
+
+    def __init__(self, registry: MetricsRegistry) -> None:
+        self.registry = registry
+        self._server: asyncio.AbstractServer | None = None
+        self.port: int | None = None
+
+    async def start(self, port: int, host: str = '0.0.0.0') -> None:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.port = port
+        Actor.log.info(f"Serving live metrics on port {port} at {METRICS_PATH}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            # Drain the request headers
+            while (await asyncio.wait_for(reader.readline(), 10)).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?', 1)[0] if len(parts) > 1 else ''
+            if len(parts) > 1 and parts[0] == 'GET' and path in (METRICS_PATH, '/'):
+                body = self.registry.render().encode('utf-8')
+                status, content_type = '200 OK', 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                body, status, content_type = b'Not Found\n', '404 Not Found', 'text/plain'
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+_metrics_server = MetricsServer(_metrics)
+
+
+def _web_server_port() -> int:
+    """Port of the container web server (ACTOR_WEB_SERVER_PORT on the platform)."""
+    try:
+        port = Actor.configuration.web_server_port  # type: ignore
+    except Exception:
+        port = None
+    return int(port or os.environ.get('ACTOR_WEB_SERVER_PORT') or DEFAULT_WEB_SERVER_PORT)
@@ -0,0 +1,548 @@
+"""Sampling profiler of a run, and the monitor of event loop stalls."""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import collections
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from pathlib import Path
+from typing import Any, Dict, List
+
+from actor import Actor
+from metrics import _metrics
+
+
+# ============================================================ #
+#                          PROFILING                           #
+# ============================================================ #
+
+PROFILE_REPORT_KEY = 'PROFILE_REPORT'
+PROFILE_STACKS_KEY = 'PROFILE_STACKS'
+
+# The sampler records the stack of every thread this often (seconds)
+PROFILE_SAMPLE_INTERVAL = 0.02
+PROFILE_MAX_STACK_DEPTH = 64
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_TOP_ALLOCATIONS = 25
+
+# Frames kept per allocation by tracemalloc; more frames cost more memory and time
+TRACEMALLOC_FRAMES = 5
+
+# A new peak snapshot is taken when traced memory grew by this share, at most this often
+PROFILE_SNAPSHOT_GROWTH = 0.1
+PROFILE_SNAPSHOT_MIN_INTERVAL = 10.0
+
+# Where sampled time goes, decided by the innermost matching frame's file
+PROFILE_CATEGORIES: tuple[tuple[str, tuple[str, ...]], ...] = (
+    ('json', ('/json/',)),
+    ('regex', ('/re/', '/re.py', '/sre_')),
+    ('ffmpeg', ('/subprocess.py', '/asyncio/subprocess.py')),
+    ('io_wait', ('/socket.py', '/ssl.py', '/http/client.py', '/urllib3/', '/httpcore/', '/httpx/', '/selectors.py')),
+    ('yt_dlp', ('/yt_dlp/',)),
+    ('storage', ('/apify/', '/crawlee/', '/boto3/', '/botocore/')),
+)
+
+
+def _profile_frame_label(code: types.CodeType, lineno: int | None = None) -> str:
+    """Function label of a sampled frame (at lineno if given), with library paths shortened to the package."""
+    filename = code.co_filename
+    for marker in ('/site-packages/', '/lib/python3'):
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+            if marker == '/lib/python3':
+                filename = filename.split('/', 1)[-1]
+            break
+    else:
+        filename = os.path.basename(filename)
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{name} ({filename}:{lineno or code.co_firstlineno})"
+
+
+def _classify_stack(codes: List[types.CodeType]) -> str:
+    """
+    Category of one sampled stack, innermost frame first.
+
+    Idle pool threads and the event loop waiting for events are told apart from
+    threads blocked on sockets, so I/O waits are not hidden among idle threads.
+    """
+    for index, code in enumerate(codes):
+        if code.co_name == '_worker' and code.co_filename.endswith('concurrent/futures/thread.py'):
+            # A pool thread is idle unless it is inside a work item
+            if index == 0 or codes[index - 1].co_name != 'run':
+                return 'idle'
+            break
+    if codes and codes[0].co_filename.endswith('selectors.py') and any(code.co_name == '_run_once' for code in codes):
+        return 'event_loop_wait'
+    for code in codes:
+        filename = code.co_filename
+        for category, markers in PROFILE_CATEGORIES:
+            if any(marker in filename for marker in markers):
+                return category
+    return 'other'
+
+
+class RunProfiler:
+    """
+    Opt-in CPU and memory profiling for diagnosing slow runs.
+
+    A background thread samples the stacks of all threads every PROFILE_SAMPLE_INTERVAL
+    (cProfile only sees the thread that enabled it, while most work here runs in
+    worker threads). Samples are aggregated per function, per category (json, regex,
+    ffmpeg, I/O waits, ...) and as collapsed stacks for flame graphs. Profiled hooks
+    record calls, wall time and the net memory each call left allocated; tracemalloc
+    snapshots at the start, at memory peaks and at the end give the top allocation sites.
+    """
+
+    def __init__(self) -> None:
+        self.active = False
+        self.sample_interval = PROFILE_SAMPLE_INTERVAL
+        self.trace_memory = False
+        # CLI: reports go to this directory instead of the key-value store
+        self.output_dir: str | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._started = 0.0
+        self._duration = 0.0
+        self._samples = 0
+        # Thread-seconds per function (innermost frame / anywhere on the stack) and per category
+        self._self_seconds: collections.Counter = collections.Counter()
+        self._total_seconds: collections.Counter = collections.Counter()
+        self._category_seconds: collections.Counter = collections.Counter()
+        self._stacks: collections.Counter = collections.Counter()
+        self._hooks: Dict[str, Dict[str, float]] = {}
+        self._baseline: Any = None
+        self._peak_snapshot: Any = None
+        self._peak_size = 0
+        self._last_snapshot_at = 0.0
+        self._final_snapshot: Any = None
+        self._shards: List[Dict[str, Any]] = []
+
+    def start(self, sample_interval: float | None = None, trace_memory: bool = True) -> None:
+        if self.active:
+            return
+        self.sample_interval = sample_interval or PROFILE_SAMPLE_INTERVAL
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._baseline = self._snapshot()
+            self._last_snapshot_at = time.monotonic()
+        self._started = time.perf_counter()
+        self._stop.clear()
+        self.active = True
+        self._thread = threading.Thread(target=self._sample_loop, name='igdl-profiler', daemon=True)
+        self._thread.start()
+        Actor.log.info(f"Profiling enabled (sampling every {self.sample_interval * 1000:.0f}ms{', tracing allocations' if trace_memory else ''})")
+
+    def stop(self) -> None:
+        if not self.active:
+            return
+        self.active = False
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._duration += time.perf_counter() - self._started
+        if tracemalloc.is_tracing():
+            self._final_snapshot = self._snapshot()
+            tracemalloc.stop()
+
+    @staticmethod
+    def _snapshot() -> Any:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+
+    def _sample_loop(self) -> None:
+        own_thread = threading.get_ident()
+        last_sample = time.perf_counter()
+        while not self._stop.wait(self.sample_interval):
+            frames = sys._current_frames()
+            # Threads holding the GIL in C code (JSON, regex) delay samples; each sample
+            # stands for the time since the previous one, so the totals stay in seconds
+            now = time.perf_counter()
+            weight = now - last_sample
+            last_sample = now
+            with self._lock:
+                self._samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own_thread:
+                        continue
+                    codes: List[types.CodeType] = []
+                    while frame is not None and len(codes) < PROFILE_MAX_STACK_DEPTH:
+                        codes.append(frame.f_code)
+                        frame = frame.f_back
+                    self._record_stack(codes, weight)
+            del frames
+            if self.trace_memory:
+                self._maybe_snapshot_peak()
+
+    def _record_stack(self, codes: List[types.CodeType], weight: float) -> None:
+        if not codes:
+            return
+        category = _classify_stack(codes)
+        self._category_seconds[category] += weight
+        if category == 'idle':
+            return
+        labels = [_profile_frame_label(code) for code in codes]
+        self._self_seconds[labels[0]] += weight
+        for label in set(labels):
+            self._total_seconds[label] += weight
+        self._stacks[';'.join([category, *reversed(labels)])] += weight
+
+    def _maybe_snapshot_peak(self) -> None:
+        current, _ = tracemalloc.get_traced_memory()
+        if current <= self._peak_size * (1 + PROFILE_SNAPSHOT_GROWTH):
+            return
+        if time.monotonic() - self._last_snapshot_at < PROFILE_SNAPSHOT_MIN_INTERVAL:
+            return
+        self._peak_snapshot = self._snapshot()
+        self._peak_size = current
+        self._last_snapshot_at = time.monotonic()
+
+    def hook(self, name: str) -> Any:
+        """Decorator recording calls of an async function while profiling is active."""
+        def decorate(function: Any) -> Any:
+            @functools.wraps(function)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                if not self.active:
+                    return await function(*args, **kwargs)
+                started = time.perf_counter()
+                memory_before = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+                failed = True
+                try:
+                    result = await function(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    elapsed = time.perf_counter() - started
+                    # Net bytes still allocated after the call; concurrent calls blur this
+                    retained = tracemalloc.get_traced_memory()[0] - memory_before if self.trace_memory and tracemalloc.is_tracing() else 0
+                    self._record_hook(name, elapsed, retained, failed)
+            return wrapper
+        return decorate
+
+    def _record_hook(self, name: str, elapsed: float, retained: int, failed: bool) -> None:
+        with self._lock:
+            stats = self._hooks.setdefault(name, {
+                'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                'retained_bytes': 0, 'max_retained_bytes': 0,
+            })
+            stats['calls'] += 1
+            stats['errors'] += int(failed)
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            stats['retained_bytes'] += retained
+            stats['max_retained_bytes'] = max(stats['max_retained_bytes'], retained)
+
+    def add_shard(self, shard_index: int, report: Dict[str, Any], stacks: Dict[str, float]) -> None:
+        """Merge a shard process's profile into this (parent) profile."""
+        self._shards.append({'shard': shard_index, **report})
+        with self._lock:
+            for stack, seconds in stacks.items():
+                self._stacks[f"shard-{shard_index};{stack}"] += seconds
+
+    @staticmethod
+    def _top_allocations(snapshot: Any, baseline: Any) -> List[Dict[str, Any]]:
+        if snapshot is None:
+            return []
+        if baseline is not None:
+            stats = snapshot.compare_to(baseline, 'traceback')
+            stats.sort(key=lambda stat: stat.size_diff, reverse=True)
+        else:
+            stats = snapshot.statistics('traceback')
+        top = []
+        for stat in stats[:PROFILE_TOP_ALLOCATIONS]:
+            entry = {
+                'size_bytes': stat.size,
+                'count': stat.count,
+                'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+            }
+            if baseline is not None:
+                entry['size_diff_bytes'] = stat.size_diff
+                entry['count_diff'] = stat.count_diff
+            top.append(entry)
+        return top
+
+    def stacks(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._stacks)
+
+    def collapsed_stacks(self) -> str:
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope, weighted in milliseconds."""
+        return ''.join(
+            f"{stack} {round(seconds * 1000)}\n"
+            for stack, seconds in sorted(self.stacks().items())
+            if round(seconds * 1000) > 0
+        )
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            busy_seconds = sum(seconds for category, seconds in self._category_seconds.items() if category != 'idle') or 1.0
+
+            def top(counter: collections.Counter) -> List[Dict[str, Any]]:
+                return [
+                    {'function': label, 'seconds': round(seconds, 3), 'share': round(seconds / busy_seconds, 4)}
+                    for label, seconds in counter.most_common(PROFILE_TOP_FUNCTIONS)
+                ]
+
+            report: Dict[str, Any] = {
+                'duration_seconds': round(self._duration, 3),
+                'sample_interval_ms': round(self.sample_interval * 1000, 3),
+                'samples': self._samples,
+                # Thread-seconds per category; idle pool threads are counted but left out of the shares
+                'categories': {
+                    category: {
+                        'seconds': round(seconds, 3),
+                        'share': round(seconds / busy_seconds, 4) if category != 'idle' else None,
+                    }
+                    for category, seconds in self._category_seconds.most_common()
+                },
+                'top_self': top(self._self_seconds),
+                'top_cumulative': top(self._total_seconds),
+                'hooks': {
+                    name: {
+                        **{key: round(value, 3) if isinstance(value, float) else value for key, value in stats.items()},
+                        'mean_seconds': round(stats['total_seconds'] / stats['calls'], 3),
+                    }
+                    for name, stats in sorted(self._hooks.items())
+                },
+            }
+        if self._baseline is not None:
+            report['memory'] = {
+                'peak_traced_bytes': self._peak_size,
+                'top_allocations_at_peak': self._top_allocations(self._peak_snapshot, self._baseline),
+                'top_allocations_at_end': self._top_allocations(self._final_snapshot, self._baseline),
+            }
+        if self._shards:
+            report['shards'] = self._shards
+        return report
+
+
+_profiler = RunProfiler()
+
+
+def _write_profile(output_dir: Path, report: Dict[str, Any], stacks: str) -> None:
+    """Write the profile report and collapsed stacks into a directory (CLI)."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / 'profile.json').write_text(json.dumps(report, indent=2, default=str), encoding='utf-8')
+    (output_dir / 'profile.stacks.txt').write_text(stacks, encoding='utf-8')
+
+
+async def _save_profile() -> None:
+    """Stop the profiler and store its report and collapsed stacks."""
+    if not _profiler.active:
+        return
+    await asyncio.to_thread(_profiler.stop)
+    report = await asyncio.to_thread(_profiler.report)
+    stacks = _profiler.collapsed_stacks()
+    if _profiler.output_dir:
+        output_dir = Path(_profiler.output_dir).expanduser()
+        await asyncio.to_thread(_write_profile, output_dir, report, stacks)
+        Actor.log.info(f"Profile written to {output_dir}")
+        return
+    try:
+        await Actor.set_value(PROFILE_REPORT_KEY, report)  # type: ignore
+        await Actor.set_value(PROFILE_STACKS_KEY, stacks, content_type='text/plain')  # type: ignore
+        Actor.log.info(f"Profile stored under '{PROFILE_REPORT_KEY}' and '{PROFILE_STACKS_KEY}' in the key-value store")
+    except Exception as store_error:
+        Actor.log.error(f"Could not store the profile: {store_error}")
+
+
+# ============================================================ #
+#                       LOOP LAG MONITOR                       #
+# ============================================================ #
+
+# The heartbeat task asks to wake up this often (seconds); lateness is the loop lag
+LOOP_LAG_INTERVAL = 0.05
+
+# A stall longer than this captures the stack blocking the loop
+DEFAULT_LOOP_LAG_THRESHOLD = 0.1
+
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_TOP_OFFENDERS = 10
+LOOP_LAG_STACK_DEPTH = 16
+
+# Stalled time may grow by this much on top of the relative tolerance before a replay regresses
+LOOP_STALL_BASELINE_SLACK = 0.5
+
+# Stalls are attributed to the innermost frame in the actor's own modules
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_m_loop_lag = _metrics.histogram('event_loop_lag_seconds', 'Scheduling delay of the event loop.', buckets=LOOP_LAG_BUCKETS)
+_m_loop_stalls = _metrics.counter('event_loop_stalls', 'Event loop stalls past the threshold by blocking call site.', ('site',))
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop runs callbacks and catches the code blocking it.
+
+    A heartbeat task sleeps LOOP_LAG_INTERVAL and records how much later than asked
+    it woke up. A watchdog thread watches the heartbeat: when the loop has not come
+    back for longer than the threshold, it captures the loop thread's stack, which is
+    the synchronous call holding the loop (a yt-dlp call, a browser call, file I/O).
+    Stalls are grouped by the innermost call site in this module; each keeps its
+    count, total and longest blocking time and the stack of its first capture.
+    """
+
+    def __init__(self) -> None:
+        self.active = False
+        self.threshold = DEFAULT_LOOP_LAG_THRESHOLD
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._loop_thread: int | None = None
+        self._beat = 0.0
+        # Call site of the stall being watched, once the watchdog captured it
+        self._stall: str | None = None
+        self._buckets = [0] * (len(LOOP_LAG_BUCKETS) + 1)
+        self._samples = 0
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._stalls = 0
+        self._stalled_seconds = 0.0
+        self._offenders: Dict[str, Dict[str, Any]] = {}
+
+    def start(self, threshold: float | None = None) -> None:
+        """Start monitoring the running loop (a threshold of 0 leaves the monitor off)."""
+        if threshold is not None:
+            self.threshold = threshold
+        if self.active or self.threshold <= 0:
+            return
+        self.active = True
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='igdl-loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        if not self.active:
+            return
+        self.active = False
+        self._stop.set()
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._thread.join()
+        self._task = self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            now = time.monotonic()
+            with self._lock:
+                lag = max(0.0, now - self._beat - LOOP_LAG_INTERVAL)
+                self._beat = now
+                self._samples += 1
+                self._lag_total += lag
+                self._lag_max = max(self._lag_max, lag)
+                self._buckets[bisect.bisect_left(LOOP_LAG_BUCKETS, lag)] += 1
+                site, self._stall = self._stall, None
+                if site is not None:
+                    # The watchdog caught this stall: charge all of its blocking time to the site
+                    offender = self._offenders[site]
+                    offender['total_seconds'] += lag
+                    offender['max_seconds'] = max(offender['max_seconds'], lag)
+                    self._stalled_seconds += lag
+            _m_loop_lag.observe(lag)
+            if site is not None:
+                _m_loop_stalls.inc(site=site)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            with self._lock:
+                if self._stall is not None or time.monotonic() - self._beat - LOOP_LAG_INTERVAL < self.threshold:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is None:
+                    continue
+                stack: List[str] = []
+                site = None
+                while frame is not None and len(stack) < LOOP_LAG_STACK_DEPTH:
+                    label = _profile_frame_label(frame.f_code, frame.f_lineno)
+                    stack.append(label)
+                    if site is None and os.path.dirname(frame.f_code.co_filename) == SOURCE_DIR:
+                        site = label
+                    frame = frame.f_back
+                del frame
+                site = site or stack[0]
+                self._stall = site
+                self._stalls += 1
+                offender = self._offenders.setdefault(site, {
+                    'site': site, 'blocked_in': stack[0], 'count': 0,
+                    'total_seconds': 0.0, 'max_seconds': 0.0, 'stack': stack,
+                })
+                offender['count'] += 1
+
+    @property
+    def stalled_seconds(self) -> float:
+        with self._lock:
+            return self._stalled_seconds
+
+    def report(self) -> Dict[str, Any]:
+        """Lag histogram, percentiles and the worst blocking call sites for the run metrics."""
+        with self._lock:
+            buckets = list(self._buckets)
+            samples = self._samples
+            offenders = sorted(self._offenders.values(), key=lambda offender: -offender['total_seconds'])
+            report = {
+                'threshold_seconds': self.threshold,
+                'interval_seconds': LOOP_LAG_INTERVAL,
+                'samples': samples,
+                'total_lag_seconds': round(self._lag_total, 3),
+                'mean_lag_seconds': round(self._lag_total / samples, 4) if samples else None,
+                'max_lag_seconds': round(self._lag_max, 3),
+                'stalls': self._stalls,
+                'stalled_seconds': round(self._stalled_seconds, 3),
+            }
+        bounds = [str(bound) for bound in LOOP_LAG_BUCKETS] + ['+Inf']
+        report['histogram'] = dict(zip(bounds, buckets))
+        for name, share in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            # Upper bound of the bucket holding the percentile (None past the last bucket)
+            seen = 0
+            for bound, count in zip(LOOP_LAG_BUCKETS + (None,), buckets):
+                seen += count
+                if samples and seen >= samples * share:
+                    report[f'{name}_lag_le_seconds'] = bound
+                    break
+        report['worst_offenders'] = [
+            {**offender, 'total_seconds': round(offender['total_seconds'], 3), 'max_seconds': round(offender['max_seconds'], 3)}
+            for offender in offenders[:LOOP_LAG_TOP_OFFENDERS]
+        ]
+        return report
+
+    def merge(self, report: Dict[str, Any]) -> None:
+        """Add a shard's report (offenders beyond its top list are not reported back)."""
+        with self._lock:
+            for index, count in enumerate((report.get('histogram') or {}).values()):
+                self._buckets[index] += count
+            self._samples += report.get('samples') or 0
+            self._lag_total += report.get('total_lag_seconds') or 0.0
+            self._lag_max = max(self._lag_max, report.get('max_lag_seconds') or 0.0)
+            self._stalls += report.get('stalls') or 0
+            self._stalled_seconds += report.get('stalled_seconds') or 0.0
+            for shard_offender in report.get('worst_offenders') or []:
+                offender = self._offenders.setdefault(shard_offender['site'], {
+                    **shard_offender, 'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                })
+                offender['count'] += shard_offender['count']
+                offender['total_seconds'] += shard_offender['total_seconds']
+                offender['max_seconds'] = max(offender['max_seconds'], shard_offender['max_seconds'])
+
+
+_loop_monitor = LoopLagMonitor()
@@ -0,0 +1,188 @@
+"""Run-wide aggregated download progress, published as the Actor status message."""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import threading
+import time
+from typing import Any, Dict
+
+from actor import Actor
+
+
+# ============================================================ #
+#                      PROGRESS REPORTING                      #
+# ============================================================ #
+
+# How often the aggregated progress is published as the Actor status message
+PROGRESS_PUBLISH_INTERVAL = 1.0
+
+
+class ProgressReporter:
+    """
+    Run-wide aggregated download progress.
+
+    yt-dlp progress hooks (called from download threads) only bump byte counters here;
+    a single background task publishes global throughput, active transfers and ETA as
+    the Actor status message at a bounded rate. Per-file log lines are written only
+    when a transfer starts and finishes.
+    """
+
+    def __init__(self, interval: float = PROGRESS_PUBLISH_INTERVAL) -> None:
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._transfers: Dict[int, Dict[str, Any]] = {}
+        self._finished_files = 0
+        self._failed_files = 0
+        self._finished_bytes = 0
+        self._last_total_bytes = 0
+        self._last_sample_time = time.monotonic()
+        self._throughput = 0.0
+        self._last_message: str | None = None
+        self._task: asyncio.Task | None = None
+        # Async callable receiving the status line; defaults to the Actor status message
+        self.publisher: Any = None
+
+    def start_transfer(self, label: str) -> int:
+        """Register a new transfer and log its start. Returns the transfer id."""
+        transfer_id = next(self._ids)
+        with self._lock:
+            self._transfers[transfer_id] = {
+                'label': label,
+                'started': time.monotonic(),
+                'files': {},
+            }
+        Actor.log.info(f"Download started: {label}")  # type: ignore
+        return transfer_id
+
+    def update(self, transfer_id: int, part: str | None, downloaded: int, total: int = 0) -> None:
+        """Set absolute byte counters for one file (part) of a transfer. Cheap, thread-safe."""
+        with self._lock:
+            transfer = self._transfers.get(transfer_id)
+            if transfer is not None:
+                transfer['files'][part or ''] = (downloaded or 0, total or 0)
+
+    def add_bytes(self, transfer_id: int, part: str, count: int) -> None:
+        """Add bytes to one part of a transfer (for streams without absolute counters)."""
+        with self._lock:
+            transfer = self._transfers.get(transfer_id)
+            if transfer is not None:
+                downloaded, total = transfer['files'].get(part, (0, 0))
+                transfer['files'][part] = (downloaded + count, total)
+
+    def finish_transfer(self, transfer_id: int, success: bool = True) -> None:
+        """Remove a transfer from the active set and log a single summary line for it."""
+        with self._lock:
+            transfer = self._transfers.pop(transfer_id, None)
+            if transfer is None:
+                return
+            downloaded = sum(done for done, _ in transfer['files'].values())
+            self._finished_bytes += downloaded
+            if success:
+                self._finished_files += 1
+            else:
+                self._failed_files += 1
+
+        elapsed = max(time.monotonic() - transfer['started'], 1e-6)
+        size_mb = downloaded / 1024 / 1024
+        if success:
+            Actor.log.info(f"Download finished: {transfer['label']} — {size_mb:.1f}MB in {elapsed:.1f}s ({size_mb / elapsed:.2f}MB/s)")  # type: ignore
+        else:
+            Actor.log.warning(f"Download failed: {transfer['label']} after {elapsed:.1f}s ({size_mb:.1f}MB received)")  # type: ignore
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Compute the current aggregate view (throughput is sampled between calls)."""
+        now = time.monotonic()
+        with self._lock:
+            active = len(self._transfers)
+            active_bytes = 0
+            remaining = 0
+            for transfer in self._transfers.values():
+                for done, total in transfer['files'].values():
+                    active_bytes += done
+                    if total > done:
+                        remaining += total - done
+            total_bytes = self._finished_bytes + active_bytes
+            finished = self._finished_files
+            failed = self._failed_files
+
+            elapsed = now - self._last_sample_time
+            if elapsed > 0:
+                instant = max(total_bytes - self._last_total_bytes, 0) / elapsed
+                # Smooth the rate so the status message does not jump around every tick
+                self._throughput = instant if not self._throughput else 0.7 * self._throughput + 0.3 * instant
+            self._last_total_bytes = total_bytes
+            self._last_sample_time = now
+
+        eta = remaining / self._throughput if self._throughput > 0 and remaining else None
+        return {
+            'active_transfers': active,
+            'finished_files': finished,
+            'failed_files': failed,
+            'bytes_downloaded': total_bytes,
+            'throughput_bps': self._throughput,
+            'eta_seconds': eta,
+        }
+
+    def totals(self) -> Dict[str, int]:
+        """Counters for metrics scrapes; unlike snapshot() it leaves the throughput sampling alone."""
+        with self._lock:
+            active_bytes = sum(
+                done for transfer in self._transfers.values() for done, _ in transfer['files'].values()
+            )
+            return {
+                'active_transfers': len(self._transfers),
+                'finished_files': self._finished_files,
+                'failed_files': self._failed_files,
+                'bytes_downloaded': self._finished_bytes + active_bytes,
+            }
+
+    def format_status(self, snap: Dict[str, Any]) -> str:
+        """Render a snapshot as a one-line status message."""
+        message = (
+            f"Downloading: {snap['active_transfers']} active, {snap['finished_files']} finished"
+            f" | {snap['throughput_bps'] / 1024 / 1024:.2f}MB/s"
+            f" | {snap['bytes_downloaded'] / 1024 / 1024:.1f}MB total"
+        )
+        if snap['failed_files']:
+            message += f" | {snap['failed_files']} failed"
+        if snap['eta_seconds'] is not None:
+            message += f" | ETA {snap['eta_seconds']:.0f}s"
+        return message
+
+    async def _publish(self) -> None:
+        message = self.format_status(self.snapshot())
+        if message == self._last_message:
+            return
+        self._last_message = message
+        try:
+            await (self.publisher or Actor.set_status_message)(message)  # type: ignore
+        except Exception:
+            # Status messages are best-effort (e.g. not available outside the platform)
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._publish()
+
+    def start(self) -> None:
+        """Start the periodic publisher on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the publisher and publish one final status."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._publish()
+
+
+_progress_reporter = ProgressReporter()
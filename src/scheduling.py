@@ -0,0 +1,240 @@
+"""Scheduling policies and the in-process request queue."""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import heapq
+import itertools
+import random
+import re
+import statistics
+import time
+import types
+from typing import Any, Dict, List
+
+from budgets import ESTIMATED_BYTES_PER_SECOND
+
+
+# ============================================================ #
+#                          SCHEDULING                          #
+# ============================================================ #
+
+SCHEDULING_POLICIES = ('sjf', 'fair', 'fifo')
+DEFAULT_SCHEDULING_POLICY = 'fifo'
+
+# Expected processing time per URL kind, before anything is extracted
+URL_KIND_COST_SECONDS = {'reel': 30.0, 'p': 60.0, 'tv': 600.0}
+LISTING_COST_SECONDS = 900.0  # profiles and other listings expand into many items
+SHORT_JOB_SECONDS = 60.0
+
+_INSTAGRAM_PATH_RE = re.compile(r'instagram\.com/(?:([A-Za-z0-9._]+)/)?(reels?|p|tv)/', re.IGNORECASE)
+_INSTAGRAM_ACCOUNT_RE = re.compile(r'instagram\.com/([A-Za-z0-9._]+)/?(?:[?#]|$)', re.IGNORECASE)
+
+
+def _estimate_url_cost(url: str) -> float:
+    """Cheap pre-extraction cost estimate (seconds) from the URL kind."""
+    match = _INSTAGRAM_PATH_RE.search(url)
+    if not match:
+        return LISTING_COST_SECONDS
+    kind = match.group(2).lower()
+    return URL_KIND_COST_SECONDS['reel' if kind.startswith('reel') else kind]
+
+
+def _default_url_source(url: str) -> str:
+    """Input source used by fair-share scheduling: the account in the URL, else the URL kind."""
+    match = _INSTAGRAM_PATH_RE.search(url)
+    if match:
+        return match.group(1) or match.group(2).lower()
+    account = _INSTAGRAM_ACCOUNT_RE.search(url)
+    return account.group(1) if account else 'other'
+
+
+def _estimate_job_seconds(info: Dict[str, Any]) -> float:
+    """Post-extraction cost estimate (seconds) from duration or approximate size."""
+    if info.get('duration'):
+        try:
+            return float(info['duration'])
+        except (TypeError, ValueError):
+            pass
+    size = info.get('filesize') or info.get('filesize_approx')
+    if size:
+        return float(size) / ESTIMATED_BYTES_PER_SECOND
+    return _estimate_url_cost(info.get('webpage_url') or info.get('url') or '')
+
+
+class _PendingRequests:
+    """Pending part of LocalRequestQueue, ordered by the scheduling policy."""
+
+    def __init__(self, policy: str) -> None:
+        self.policy = policy
+        self._seq = itertools.count()
+        self._fifo: collections.deque = collections.deque()
+        self._heap: List[tuple] = []
+        self._by_source: Dict[str, collections.deque] = {}
+        self._served: collections.Counter = collections.Counter()
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def push(self, request: Any, forefront: bool = False) -> None:
+        self._count += 1
+        if self.policy == 'sjf':
+            heapq.heappush(self._heap, (-1.0 if forefront else request.cost, next(self._seq), request))
+        elif self.policy == 'fair':
+            queue_for_source = self._by_source.setdefault(request.source, collections.deque())
+            if forefront:
+                queue_for_source.appendleft(request)
+            else:
+                queue_for_source.append(request)
+        elif forefront:
+            self._fifo.appendleft(request)
+        else:
+            self._fifo.append(request)
+
+    def pop(self) -> Any:
+        self._count -= 1
+        if self.policy == 'sjf':
+            return heapq.heappop(self._heap)[2]
+        if self.policy == 'fair':
+            # The least served source with pending work goes next (round-robin on ties)
+            source = min(
+                (name for name, pending in self._by_source.items() if pending),
+                key=lambda name: self._served[name],
+            )
+            self._served[source] += 1
+            request = self._by_source[source].popleft()
+            if not self._by_source[source]:
+                del self._by_source[source]
+            return request
+        return self._fifo.popleft()
+
+
+class ScheduleMetrics:
+    """Completion times of results relative to the start of processing."""
+
+    def __init__(self) -> None:
+        self.policy = DEFAULT_SCHEDULING_POLICY
+        self._started: float | None = None
+        self._completions: List[float] = []
+        self._total = 0.0
+        self._count = 0
+
+    def start(self, policy: str) -> None:
+        self.policy = policy
+        if self._started is None:
+            self._started = time.perf_counter()
+
+    def record_result(self) -> None:
+        if self._started is None:
+            return
+        elapsed = time.perf_counter() - self._started
+        self._count += 1
+        self._total += elapsed
+        # The first results are enough for percentiles; keep memory bounded on huge runs
+        if len(self._completions) < 100_000:
+            self._completions.append(elapsed)
+
+    def report(self) -> Dict[str, Any]:
+        completions = self._completions
+        return {
+            'policy': self.policy,
+            'results': self._count,
+            'time_to_first_result_seconds': round(completions[0], 3) if completions else None,
+            'mean_completion_seconds': round(self._total / self._count, 3) if self._count else None,
+            'median_completion_seconds': round(statistics.median(completions), 3) if completions else None,
+        }
+
+
+_schedule_metrics = ScheduleMetrics()
+
+
+# ============================================================ #
+#                        REQUEST QUEUE                         #
+# ============================================================ #
+
+QUEUE_MAX_RETRIES = 3
+QUEUE_RETRY_BASE_DELAY = 5.0  # seconds before the first retry, doubled per attempt
+QUEUE_RETRY_MAX_DELAY = 120.0
+QUEUE_IDLE_POLL_INTERVAL = 0.5
+LOCAL_QUEUE_MAX_PENDING = 1000  # intake pauses while this many requests are waiting
+
+
+class LocalRequest:
+    """Minimal stand-in for the request objects of the Apify request queue."""
+
+    __slots__ = ('url', 'unique_key', 'retry_count', 'cost', 'source')
+
+    def __init__(self, url: str, unique_key: str | None = None, source: str | None = None) -> None:
+        self.url = url
+        self.unique_key = unique_key or url
+        self.retry_count = 0
+        self.cost = _estimate_url_cost(url)
+        self.source = source or _default_url_source(url)
+
+
+class LocalRequestQueue:
+    """
+    In-process request queue with the method names of the Apify request queue.
+
+    Requests are deduplicated by unique key for the lifetime of the queue. add_request()
+    waits while max_pending requests are queued, so a streaming intake never holds more
+    than that many URLs in memory. Pending requests are handed out by the scheduling
+    policy: in arrival order (fifo), cheapest URL kind first (sjf), or round-robin over
+    input sources, least served first (fair).
+    """
+
+    def __init__(self, max_pending: int = LOCAL_QUEUE_MAX_PENDING, policy: str = 'fifo') -> None:
+        self.max_pending = max_pending
+        self.policy = policy if policy in SCHEDULING_POLICIES else 'fifo'
+        self._pending = _PendingRequests(self.policy)
+        self._in_progress: Dict[str, LocalRequest] = {}
+        self._seen: set[str] = set()
+        self._handled = 0
+        self._space = asyncio.Condition()
+
+    async def add_request(self, request: str | LocalRequest, *, forefront: bool = False) -> types.SimpleNamespace:
+        if isinstance(request, str):
+            request = LocalRequest(request)
+        if request.unique_key in self._seen:
+            return types.SimpleNamespace(unique_key=request.unique_key, was_already_present=True)
+        async with self._space:
+            await self._space.wait_for(lambda: len(self._pending) < self.max_pending)
+            self._seen.add(request.unique_key)
+            self._pending.push(request, forefront)
+        return types.SimpleNamespace(unique_key=request.unique_key, was_already_present=False)
+
+    async def fetch_next_request(self) -> LocalRequest | None:
+        if not self._pending:
+            return None
+        async with self._space:
+            request = self._pending.pop()
+            self._in_progress[request.unique_key] = request
+            self._space.notify_all()
+        return request
+
+    async def mark_request_as_handled(self, request: LocalRequest) -> None:
+        self._in_progress.pop(request.unique_key, None)
+        self._handled += 1
+
+    async def reclaim_request(self, request: LocalRequest, *, forefront: bool = False) -> None:
+        # Reclaimed requests bypass max_pending: they were already admitted once
+        self._in_progress.pop(request.unique_key, None)
+        self._pending.push(request, forefront)
+
+    async def is_finished(self) -> bool:
+        return not self._pending and not self._in_progress
+
+    def depths(self) -> tuple[int, int]:
+        """Numbers of pending and in-progress requests."""
+        return len(self._pending), len(self._in_progress)
+
+    async def get_handled_count(self) -> int:
+        return self._handled
+
+
+def _queue_retry_delay(retry_count: int) -> float:
+    """Exponential backoff with jitter before a failed request is reclaimed."""
+    delay = min(QUEUE_RETRY_MAX_DELAY, QUEUE_RETRY_BASE_DELAY * (2 ** (retry_count - 1)))
+    return delay * random.uniform(0.8, 1.2)
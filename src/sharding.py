@@ -0,0 +1,332 @@
+"""Splitting work across shard processes and fan-out worker runs."""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List
+
+from actor import Actor
+from deadlines import UNFINISHED_URLS_KEY, _run_budget
+from sinks import LocalDirectorySink, OutputSink
+from fixtures import _fixtures
+from profiling import _profiler
+from watermarks import _watermarks
+from identities import _cookie_set_text
+
+
+# ============================================================ #
+#                       PROCESS SHARDING                       #
+# ============================================================ #
+
+SHARD_EVENT_POLL_INTERVAL = 0.5
+
+
+def _available_cpus() -> int:
+    """CPUs this process may use, honouring affinity and the cgroup v2 CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = Path('/sys/fs/cgroup/cpu.max').read_text().split()[:2]
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+class _EventQueueResultWriter:
+    """Result writer of a shard process: forwards records to the parent."""
+
+    def __init__(self, event_queue: Any) -> None:
+        self._events = event_queue
+
+    async def push(self, record: Dict[str, Any]) -> None:
+        self._events.put(('result', record))
+
+    def close(self) -> None:
+        pass
+
+
+def _shard_run_budget_settings() -> Dict[str, Any]:
+    """Deadline settings for a shard; its run budget ends when the parent's does."""
+    settings: Dict[str, Any] = {
+        'url_timeout': _run_budget.url_timeout,
+        'stage_timeouts': dict(_run_budget.stage_timeouts),
+    }
+    remaining = _run_budget.remaining()
+    if remaining is not None:
+        settings['budget_seconds'] = max(0.001, remaining + _run_budget.grace_seconds)
+        settings['grace_seconds'] = _run_budget.grace_seconds
+    return settings
+
+
+async def _iter_work_queue(work_queue: Any) -> AsyncIterator[tuple[str, str]]:
+    """
+    Yield (url, source) pairs handed out by the parent until its end-of-work marker (None).
+
+    Reads time out regularly so a shard whose parent died stops instead of waiting
+    on the queue forever.
+    """
+    parent_pid = os.getppid()
+    while True:
+        try:
+            url = await asyncio.to_thread(work_queue.get, True, SHARD_EVENT_POLL_INTERVAL)
+        except queue.Empty:
+            if os.getppid() != parent_pid:
+                Actor.log.warning('Parent process is gone, shard stops taking work')  # type: ignore
+                return
+            continue
+        if url is None:
+            return
+        yield url
+
+
+# ============================================================ #
+#                    COORDINATOR (FAN-OUT)                     #
+# ============================================================ #
+
+FANOUT_POLL_INTERVAL = 5.0
+FANOUT_MAX_RETRIES = 1
+FANOUT_FAILED_STATUSES = {'FAILED', 'ABORTED', 'TIMED-OUT'}
+
+# Local worker runs start the CLI batch mode of this script
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def _on_apify_platform() -> bool:
+    return os.environ.get('APIFY_IS_AT_HOME') == '1'
+
+
+def _split_into_shards(urls: List[str], shard_count: int) -> List[List[str]]:
+    """Split URLs into at most shard_count contiguous, nearly equal shards."""
+    shard_count = max(1, min(shard_count, len(urls)))
+    size, extra = divmod(len(urls), shard_count)
+    shards, start = [], 0
+    for index in range(shard_count):
+        end = start + size + (1 if index < extra else 0)
+        shards.append(urls[start:end])
+        start = end
+    return shards
+
+
+class PlatformShardRunner:
+    """Runs each shard as a separate run of this Actor (same build) and reads back its storages."""
+
+    def __init__(self, base_input: Dict[str, Any], memory_mbytes: int | None = None) -> None:
+        self.base_input = base_input
+        self.memory_mbytes = memory_mbytes
+        self.actor_id = Actor.configuration.actor_id  # type: ignore
+        self.build = Actor.configuration.actor_build_number  # type: ignore
+
+    async def start(self, index: int, urls: List[str]) -> Dict[str, Any]:
+        run_input = {**self.base_input, 'urls': urls, 'fanOutRuns': 0}
+        remaining = _run_budget.remaining()
+        if remaining is not None:
+            # Worker runs stop (and record unfinished URLs) when the coordinator's budget ends
+            run_input['runTimeBudgetSecs'] = max(1, int(remaining + _run_budget.grace_seconds))
+        run = await Actor.start(self.actor_id, run_input, build=self.build, memory_mbytes=self.memory_mbytes)  # type: ignore
+        Actor.log.info(f"Shard {index}: started run {run.id} with {len(urls)} URLs")
+        return {'run_id': run.id, 'dataset_id': run.default_dataset_id, 'store_id': run.default_key_value_store_id}
+
+    async def poll(self, handle: Dict[str, Any]) -> tuple[str, str]:
+        """Return ('running' | 'succeeded' | 'failed', status line)."""
+        run = await Actor.apify_client.run(handle['run_id']).get() or {}  # type: ignore
+        status = run.get('status') or 'UNKNOWN'
+        state = 'succeeded' if status == 'SUCCEEDED' else 'failed' if status in FANOUT_FAILED_STATUSES else 'running'
+        return state, run.get('statusMessage') or status
+
+    async def iterate_results(self, handle: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        async for item in Actor.apify_client.dataset(handle['dataset_id']).iterate_items():  # type: ignore
+            yield item
+
+    async def metrics(self, handle: Dict[str, Any]) -> Dict[str, Any] | None:
+        record = await Actor.apify_client.key_value_store(handle['store_id']).get_record('RUN_METRICS')  # type: ignore
+        return record.get('value') if record else None
+
+    async def unfinished(self, handle: Dict[str, Any]) -> List[str]:
+        record = await Actor.apify_client.key_value_store(handle['store_id']).get_record(UNFINISHED_URLS_KEY)  # type: ignore
+        return list((record.get('value') or {}).get('urls') or []) if record else []
+
+    async def merge_state(self, index: int, handle: Dict[str, Any]) -> None:
+        # Worker runs save watermarks to the shared store and keep their own profiles
+        pass
+
+    async def cancel(self, handle: Dict[str, Any]) -> None:
+        await Actor.apify_client.run(handle['run_id']).abort()  # type: ignore
+
+    def cleanup(self) -> None:
+        pass
+
+
+class LocalShardRunner:
+    """
+    Stand-in for worker runs outside the platform: each shard is a CLI batch subprocess.
+
+    Media goes to relay_dir when the coordinator's sink is not a local directory; the
+    coordinator then stores it in its own sink while merging. Workers get the same
+    features as worker runs: incremental crawling starts from the coordinator's
+    watermarks (merged back from each worker), profiles are merged into the
+    coordinator's, and fixtures are recorded or replayed with the same settings.
+    """
+
+    def __init__(self, base_input: Dict[str, Any], sink: OutputSink, scheduling_policy: str, proxy_url: str | None = None) -> None:
+        self.base_input = base_input
+        self.scheduling_policy = scheduling_policy
+        self.proxy_url = proxy_url
+        self.work_dir = Path(tempfile.mkdtemp(prefix='igdl-fanout-'))
+        self._attempts = itertools.count()
+        if isinstance(sink, LocalDirectorySink):
+            self.media_dir, self.relay_dir = sink.directory, None
+        else:
+            self.media_dir = self.relay_dir = self.work_dir / 'media'
+
+    def _command(self, shard_dir: Path) -> List[str]:
+        inp = self.base_input
+        qualities = inp.get('qualities') or [inp.get('quality') or 'best']
+        command = [
+            sys.executable, MAIN_SCRIPT, 'batch', str(shard_dir / 'urls.txt'),
+            '-o', str(shard_dir / 'results.jsonl'),
+            '--metrics', str(shard_dir / 'metrics.json'),
+            '--media-dir', str(self.media_dir),
+            '--mode', inp.get('downloadMode') or 'videos',
+            '--quality', ','.join(qualities) if isinstance(qualities, list) else str(qualities),
+            '--max-items', str(int(inp.get('maxItems', 10))),
+            '--concurrency', str(int(inp.get('maxConcurrency') or 3)),
+            '--schedule', self.scheduling_policy,
+            '--url-timeout', str(_run_budget.url_timeout),
+        ]
+        command += [f'--stage-timeout={stage}={seconds}' for stage, seconds in _run_budget.stage_timeouts.items()]
+        remaining = _run_budget.remaining()
+        if remaining is not None:
+            command += ['--run-budget', str(max(1, int(remaining + _run_budget.grace_seconds)))]
+        if inp.get('memoryBudgetMb'):
+            command += ['--memory-budget-mb', str(int(inp['memoryBudgetMb']))]
+        if inp.get('postprocessWorkers'):
+            command += ['--postprocess-workers', str(int(inp['postprocessWorkers']))]
+        if inp.get('loopLagThresholdMs') is not None:
+            command += ['--loop-lag-threshold-ms', str(inp['loopLagThresholdMs'])]
+        cookie_sets = ([inp['cookies']] if inp.get('cookies') else []) + list(inp.get('cookieSets') or [])
+        for index, cookie_set in enumerate(cookie_sets):
+            cookie_path = shard_dir / ('cookies.txt' if index == 0 else f'cookies-{index + 1}.txt')
+            cookie_path.write_text(_cookie_set_text(cookie_set), encoding='utf-8')
+            command += ['--cookies-file', str(cookie_path)]
+        if cookie_sets and inp.get('identityRequestsPerMinute') is not None:
+            command += ['--identity-rpm', str(inp['identityRequestsPerMinute'])]
+        if self.proxy_url:
+            command += ['--proxy', self.proxy_url]
+        if _watermarks.enabled:
+            state_path = shard_dir / 'watermarks.json'
+            state_path.write_text(json.dumps({'sources': _watermarks.sources()}), encoding='utf-8')
+            command += ['--incremental', str(state_path)]
+        if _profiler.active:
+            command += ['--profile', str(shard_dir / 'profile')]
+        fixtures = _fixtures.describe()
+        if fixtures is not None:
+            command += [
+                f"--{fixtures['mode']}-fixtures", fixtures['directory'],
+                '--fixture-media', fixtures['media_mode'],
+                '--replay-speed', str(fixtures['time_scale']),
+            ]
+        return command
+
+    def _prepare(self, shard_dir: Path, urls: List[str]) -> List[str]:
+        shard_dir.mkdir(parents=True)
+        (shard_dir / 'urls.txt').write_text('\n'.join(urls) + '\n', encoding='utf-8')
+        return self._command(shard_dir)
+
+    async def start(self, index: int, urls: List[str]) -> Dict[str, Any]:
+        shard_dir = self.work_dir / f'shard-{index}-{next(self._attempts)}'
+        # Writing the shard's files runs in a thread, like all file access of the runner
+        command = await asyncio.to_thread(self._prepare, shard_dir, urls)
+        log_file = await asyncio.to_thread(open, shard_dir / 'worker.log', 'wb')
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=log_file, stderr=subprocess.STDOUT,
+        )
+        log_file.close()
+        Actor.log.info(f"Shard {index}: started local worker (pid {process.pid}) with {len(urls)} URLs")
+        return {'process': process, 'dir': shard_dir, 'offset': 0, 'lines': 0}
+
+    @staticmethod
+    def _read_new_results(handle: Dict[str, Any]) -> bytes:
+        results = handle['dir'] / 'results.jsonl'
+        if not results.exists():
+            return b''
+        with open(results, 'rb') as f:
+            f.seek(handle['offset'])
+            return f.read()
+
+    async def poll(self, handle: Dict[str, Any]) -> tuple[str, str]:
+        # Count finished records incrementally instead of re-reading the file
+        chunk = await asyncio.to_thread(self._read_new_results, handle)
+        handle['offset'] += len(chunk)
+        handle['lines'] += chunk.count(b'\n')
+        returncode = handle['process'].returncode
+        if returncode is None:
+            return 'running', f"{handle['lines']} results"
+        # 1 only means that no item succeeded; the batch itself completed
+        state = 'succeeded' if returncode in (0, 1) else 'failed'
+        return state, f"exited with code {returncode}, {handle['lines']} results"
+
+    async def iterate_results(self, handle: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        results = handle['dir'] / 'results.jsonl'
+        if not await asyncio.to_thread(results.exists):
+            return
+        f = await asyncio.to_thread(open, results, encoding='utf-8')
+        try:
+            while True:
+                line = await asyncio.to_thread(f.readline)
+                if not line:
+                    return
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            f.close()
+
+    @staticmethod
+    def _read_text(path: Path) -> str | None:
+        return path.read_text(encoding='utf-8') if path.exists() else None
+
+    async def metrics(self, handle: Dict[str, Any]) -> Dict[str, Any] | None:
+        text = await asyncio.to_thread(self._read_text, handle['dir'] / 'metrics.json')
+        return json.loads(text) if text is not None else None
+
+    async def unfinished(self, handle: Dict[str, Any]) -> List[str]:
+        text = await asyncio.to_thread(self._read_text, handle['dir'] / 'results.unfinished.txt')
+        return [line.strip() for line in (text or '').splitlines() if line.strip()]
+
+    async def merge_state(self, index: int, handle: Dict[str, Any]) -> None:
+        """Fold a finished worker's watermarks and profile into the coordinator's."""
+        state = await asyncio.to_thread(self._read_text, handle['dir'] / 'watermarks.json')
+        if _watermarks.enabled and state is not None:
+            _watermarks.merge(json.loads(state).get('sources') or {})
+        profile_dir = handle['dir'] / 'profile'
+        profile = await asyncio.to_thread(self._read_text, profile_dir / 'profile.json')
+        if _profiler.active and profile is not None:
+            report = json.loads(profile)
+            stacks: Dict[str, float] = {}
+            collapsed = await asyncio.to_thread(self._read_text, profile_dir / 'profile.stacks.txt')
+            for line in (collapsed or '').splitlines():
+                # Collapsed stacks are weighted in milliseconds
+                stack, _, millis = line.rpartition(' ')
+                if stack:
+                    stacks[stack] = int(millis) / 1000
+            _profiler.add_shard(index, report, stacks)
+
+    async def cancel(self, handle: Dict[str, Any]) -> None:
+        if handle['process'].returncode is None:
+            handle['process'].terminate()
+            await handle['process'].wait()
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.work_dir, ignore_errors=True)
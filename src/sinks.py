@@ -0,0 +1,657 @@
+"""Output sinks for downloaded media (key-value store, local directory, S3) and content integrity."""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import importlib
+import importlib.util
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Dict, List
+
+from actor import Actor
+
+
+# ============================================================ #
+#                          INTEGRITY                           #
+# ============================================================ #
+
+XXHASH_AVAILABLE = importlib.util.find_spec('xxhash') is not None
+HASH_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_INTEGRITY_RETRIES = 2
+
+
+class IntegrityError(Exception):
+    """Downloaded bytes do not match what the server announced (e.g. a truncated CDN response)."""
+
+
+class ContentDigest:
+    """SHA-256 (plus xxh64 when the optional xxhash package is installed), fed incrementally."""
+
+    def __init__(self) -> None:
+        self._sha256 = hashlib.sha256()
+        self._xxh64 = importlib.import_module('xxhash').xxh64() if XXHASH_AVAILABLE else None
+        self.size = 0
+
+    def update(self, chunk: bytes) -> None:
+        self._sha256.update(chunk)
+        if self._xxh64 is not None:
+            self._xxh64.update(chunk)
+        self.size += len(chunk)
+
+    def result(self) -> Dict[str, str]:
+        result = {'sha256': self._sha256.hexdigest()}
+        if self._xxh64 is not None:
+            result['xxhash64'] = self._xxh64.hexdigest()
+        return result
+
+
+def _digest_file(path: Path) -> ContentDigest:
+    """Hash a finished file (only for outputs that could not be hashed while written)."""
+    digest = ContentDigest()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest
+
+
+# ============================================================ #
+#                         OUTPUT SINKS                         #
+# ============================================================ #
+
+# Common extension lookups
+VIDEO_FILE_EXTENSIONS = {'.mp4', '.mkv', '.webm', '.mov', '.m4v'}
+AUDIO_FILE_EXTENSIONS = {'.mp3', '.m4a', '.aac', '.opus', '.ogg', '.wav', '.flac'}
+MEDIA_FILE_EXTENSIONS = VIDEO_FILE_EXTENSIONS | AUDIO_FILE_EXTENSIONS
+
+CONTENT_TYPE_BY_EXTENSION = {
+    '.mp4': 'video/mp4',
+    '.mkv': 'video/x-matroska',
+    '.webm': 'video/webm',
+    '.mov': 'video/quicktime',
+    '.m4v': 'video/x-m4v',
+    '.m4a': 'audio/mp4',
+    '.aac': 'audio/aac',
+    '.opus': 'audio/ogg',
+    '.ogg': 'audio/ogg',
+    '.wav': 'audio/wav',
+    '.flac': 'audio/flac',
+    '.mp3': 'audio/mpeg',
+}
+
+# Read size when copying a finished file into a sink
+SINK_CHUNK_SIZE = 1024 * 1024
+
+# S3 multipart settings (every part except the last must be at least 5MB)
+S3_PART_SIZE = 8 * 1024 * 1024
+S3_UPLOAD_CONCURRENCY = 4
+
+
+def _generate_safe_key(video_id: str, extension: str) -> str:
+    """
+    Generate a safe key for the key-value store.
+    
+    Args:
+        video_id: The video ID
+        extension: File extension
+        
+    Returns:
+        Safe key string (max 256 chars, only allowed characters)
+    """
+    # Use video ID and extension for the key
+    key = f"{video_id}.{extension}"
+    
+    # Ensure it's within length limits (Apify allows up to 256 chars)
+    if len(key) > 256:
+        # Truncate if necessary (unlikely for video IDs)
+        key = key[:256]
+        # Make sure we don't cut off in the middle of extension
+        if not key.endswith(f".{extension}"):
+            key = f"{video_id[:256-len(extension)-1]}.{extension}"
+    
+    return key
+
+
+def _guess_content_type(extension: str | None) -> str:
+    """Infer content type for storing files in the key-value store."""
+    if not extension:
+        return 'application/octet-stream'
+    ext = extension.lower()
+    if not ext.startswith('.'):
+        ext = f'.{ext}'
+    return CONTENT_TYPE_BY_EXTENSION.get(ext, 'application/octet-stream')
+
+
+class SinkWriter:
+    """Incremental writer for a single stored object."""
+
+    def __init__(self, key: str, content_type: str) -> None:
+        self.key = key
+        self.content_type = content_type
+        self.size = 0
+
+    async def write(self, chunk: bytes) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> str | None:
+        """Finish the object and return its download URL (if the sink has one)."""
+        raise NotImplementedError
+
+    async def abort(self) -> None:
+        """Discard everything written so far."""
+
+
+class OutputSink:
+    """
+    Destination for downloaded media files.
+
+    Subclasses implement open_writer(); put_file() copies a finished file through a
+    writer unless the sink can do something cheaper.
+    """
+
+    name = 'sink'
+    # True when writing while the download is still running saves work (e.g. remote uploads)
+    supports_streaming = False
+    # True when a whole file is held in memory before it is stored
+    buffers_whole_file = False
+
+    def memory_overhead(self) -> int:
+        """Memory a single write needs on top of any whole-file buffering."""
+        return SINK_CHUNK_SIZE
+
+    async def open_writer(self, key: str, content_type: str) -> SinkWriter:
+        raise NotImplementedError
+
+    async def put_file(self, key: str, path: Path, content_type: str) -> str | None:
+        """Store a finished file and return its download URL."""
+        writer = await self.open_writer(key, content_type)
+        try:
+            f = await asyncio.to_thread(path.open, 'rb')
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(f.read, SINK_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await writer.write(chunk)
+            finally:
+                f.close()
+        except BaseException:
+            await writer.abort()
+            raise
+        return await writer.close()
+
+    def describe(self) -> Dict[str, Any]:
+        """Configuration that _create_sink() can rebuild this sink from."""
+        return {'type': self.name}
+
+
+class _KeyValueStoreWriter(SinkWriter):
+    def __init__(self, sink: 'KeyValueStoreSink', key: str, content_type: str) -> None:
+        super().__init__(key, content_type)
+        self._sink = sink
+        self._buffer = bytearray()
+
+    async def write(self, chunk: bytes) -> None:
+        # Records are stored in one request, so the value has to be buffered
+        self._buffer.extend(chunk)
+        self.size += len(chunk)
+
+    async def close(self) -> str | None:
+        data = bytes(self._buffer)
+        self._buffer = bytearray()
+        await Actor.set_value(self.key, data, content_type=self.content_type)  # type: ignore
+        return await self._sink.public_url(self.key)
+
+    async def abort(self) -> None:
+        self._buffer = bytearray()
+
+
+class KeyValueStoreSink(OutputSink):
+    """Stores media as records of the run's default Apify key-value store."""
+
+    name = 'kv'
+    buffers_whole_file = True
+
+    async def open_writer(self, key: str, content_type: str) -> SinkWriter:
+        return _KeyValueStoreWriter(self, key, content_type)
+
+    async def put_file(self, key: str, path: Path, content_type: str) -> str | None:
+        data = await asyncio.to_thread(path.read_bytes)
+        await Actor.set_value(key, data, content_type=content_type)  # type: ignore
+        return await self.public_url(key)
+
+    async def public_url(self, key: str) -> str | None:
+        """Public URL of a record, as reported by the key-value store."""
+        try:
+            store = await Actor.open_key_value_store()  # type: ignore
+            return str(await store.get_public_url(key)) if store is not None else None
+        except Exception as url_error:
+            Actor.log.warning(f"Key-value store URL unavailable for {key}: {url_error}")  # type: ignore
+            return None
+
+
+class _LocalFileWriter(SinkWriter):
+    def __init__(self, target: Path, key: str, content_type: str) -> None:
+        super().__init__(key, content_type)
+        self._target = target
+        self._partial = target.with_name(target.name + '.part')
+        self._file = None
+
+    async def write(self, chunk: bytes) -> None:
+        if self._file is None:
+            self._file = await asyncio.to_thread(self._partial.open, 'wb')
+        await asyncio.to_thread(self._file.write, chunk)
+        self.size += len(chunk)
+
+    async def close(self) -> str | None:
+        if self._file is None:
+            self._file = await asyncio.to_thread(self._partial.open, 'wb')
+        # Closing flushes the last buffered chunk to disk
+        await asyncio.to_thread(self._file.close)
+        await asyncio.to_thread(os.replace, self._partial, self._target)
+        return self._target.as_uri()
+
+    async def abort(self) -> None:
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+        await asyncio.to_thread(self._partial.unlink, missing_ok=True)
+
+
+class LocalDirectorySink(OutputSink):
+    """Stores media as files in a local directory."""
+
+    name = 'local'
+
+    def __init__(self, directory: str) -> None:
+        self.directory = Path(directory).expanduser().resolve()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    async def open_writer(self, key: str, content_type: str) -> SinkWriter:
+        return _LocalFileWriter(self.directory / key, key, content_type)
+
+    async def put_file(self, key: str, path: Path, content_type: str) -> str | None:
+        # The scratch file is discarded afterwards, so a move (rename on the same disk) is enough
+        target = self.directory / key
+        await asyncio.to_thread(shutil.move, str(path), str(target))
+        return target.as_uri()
+
+    def describe(self) -> Dict[str, Any]:
+        return {'type': self.name, 'directory': str(self.directory)}
+
+
+class _S3MultipartWriter(SinkWriter):
+    """
+    Uploads an object as S3 multipart parts while it is being written.
+
+    Parts are uploaded in parallel (bounded by the sink's concurrency, which also bounds
+    buffered memory); small objects fall back to a single put_object.
+    """
+
+    def __init__(self, sink: 'S3Sink', key: str, content_type: str) -> None:
+        super().__init__(key, content_type)
+        self._sink = sink
+        self._object_key = sink.object_key(key)
+        self._buffer = bytearray()
+        self._upload_id: str | None = None
+        self._part_number = 0
+        self._uploads: List[asyncio.Task] = []
+        self._slots = asyncio.Semaphore(sink.concurrency)
+
+    async def write(self, chunk: bytes) -> None:
+        self._buffer.extend(chunk)
+        self.size += len(chunk)
+        while len(self._buffer) >= self._sink.part_size:
+            part = bytes(self._buffer[:self._sink.part_size])
+            del self._buffer[:self._sink.part_size]
+            await self._submit_part(part)
+
+    async def _submit_part(self, body: bytes) -> None:
+        client = self._sink.client()
+        if self._upload_id is None:
+            response = await asyncio.to_thread(
+                client.create_multipart_upload,
+                Bucket=self._sink.bucket, Key=self._object_key, ContentType=self.content_type,
+            )
+            self._upload_id = response['UploadId']
+
+        # Wait for a free upload slot: at most `concurrency` parts are in flight/buffered
+        await self._slots.acquire()
+        self._part_number += 1
+        self._uploads.append(asyncio.create_task(self._upload_part(self._part_number, body)))
+
+    async def _upload_part(self, part_number: int, body: bytes) -> Dict[str, Any]:
+        try:
+            response = await asyncio.to_thread(
+                self._sink.client().upload_part,
+                Bucket=self._sink.bucket, Key=self._object_key,
+                PartNumber=part_number, UploadId=self._upload_id, Body=body,
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self._slots.release()
+
+    async def close(self) -> str | None:
+        client = self._sink.client()
+        try:
+            if self._upload_id is None:
+                await asyncio.to_thread(
+                    client.put_object,
+                    Bucket=self._sink.bucket, Key=self._object_key,
+                    Body=bytes(self._buffer), ContentType=self.content_type,
+                )
+            else:
+                if self._buffer:
+                    await self._submit_part(bytes(self._buffer))
+                parts = await asyncio.gather(*self._uploads)
+                await asyncio.to_thread(
+                    client.complete_multipart_upload,
+                    Bucket=self._sink.bucket, Key=self._object_key, UploadId=self._upload_id,
+                    MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])},
+                )
+        except BaseException:
+            await self.abort()
+            raise
+        self._buffer = bytearray()
+        return self._sink.url(self.key)
+
+    async def abort(self) -> None:
+        for upload in self._uploads:
+            upload.cancel()
+        await asyncio.gather(*self._uploads, return_exceptions=True)
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            upload_id, self._upload_id = self._upload_id, None
+            try:
+                await asyncio.to_thread(
+                    self._sink.client().abort_multipart_upload,
+                    Bucket=self._sink.bucket, Key=self._object_key, UploadId=upload_id,
+                )
+            except Exception as abort_error:
+                Actor.log.warning(f"Could not abort multipart upload for {self._object_key}: {abort_error}")  # type: ignore
+
+
+class S3Sink(OutputSink):
+    """
+    Stores media in S3-compatible object storage (AWS S3, MinIO, R2, ...).
+
+    Requires the optional boto3 package. Credentials fall back to the usual AWS
+    environment/config chain when not given explicitly.
+    """
+
+    name = 's3'
+    supports_streaming = True
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = '',
+        endpoint_url: str | None = None,
+        region: str | None = None,
+        access_key_id: str | None = None,
+        secret_access_key: str | None = None,
+        public_url_base: str | None = None,
+        part_size: int = S3_PART_SIZE,
+        concurrency: int = S3_UPLOAD_CONCURRENCY,
+    ) -> None:
+        if not bucket:
+            raise ValueError('S3 output sink requires a bucket')
+        self.bucket = bucket
+        self.prefix = (prefix or '').strip('/')
+        self.endpoint_url = endpoint_url or None
+        self.region = region or None
+        self.access_key_id = access_key_id or None
+        self.secret_access_key = secret_access_key or None
+        self.public_url_base = public_url_base or None
+        self.part_size = max(int(part_size), 5 * 1024 * 1024)
+        self.concurrency = max(int(concurrency), 1)
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def memory_overhead(self) -> int:
+        # One part being filled plus the parts in flight
+        return self.part_size * (self.concurrency + 1)
+
+    def client(self) -> Any:
+        """Lazily created boto3 S3 client (thread-safe, shared by all uploads)."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    try:
+                        boto3 = importlib.import_module('boto3')
+                    except ImportError as import_error:
+                        raise RuntimeError('The S3 output sink requires the boto3 package') from import_error
+                    self._client = boto3.client(
+                        's3',
+                        endpoint_url=self.endpoint_url,
+                        region_name=self.region,
+                        aws_access_key_id=self.access_key_id,
+                        aws_secret_access_key=self.secret_access_key,
+                    )
+        return self._client
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def url(self, key: str) -> str:
+        object_key = self.object_key(key)
+        if self.public_url_base:
+            return f"{self.public_url_base.rstrip('/')}/{object_key}"
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{object_key}"
+        return f"s3://{self.bucket}/{object_key}"
+
+    async def open_writer(self, key: str, content_type: str) -> SinkWriter:
+        return _S3MultipartWriter(self, key, content_type)
+
+    def credentials_env(self) -> Dict[str, str]:
+        """Explicit credentials as the AWS environment variables boto3 reads (empty when none were given)."""
+        if not (self.access_key_id and self.secret_access_key):
+            return {}
+        return {'AWS_ACCESS_KEY_ID': self.access_key_id, 'AWS_SECRET_ACCESS_KEY': self.secret_access_key}
+
+    def describe(self) -> Dict[str, Any]:
+        """Non-secret settings; credentials are left to the environment of whoever recreates the sink."""
+        return {
+            'type': self.name,
+            'bucket': self.bucket,
+            'prefix': self.prefix,
+            'endpoint_url': self.endpoint_url,
+            'region': self.region,
+            'public_url_base': self.public_url_base,
+            'part_size': self.part_size,
+            'concurrency': self.concurrency,
+        }
+
+
+def _create_sink(config: Dict[str, Any] | None) -> OutputSink:
+    """Build an output sink from a describe()-style configuration dict."""
+    config = dict(config or {})
+    sink_type = (config.pop('type', None) or 'kv').lower()
+    if sink_type in ('kv', 'key_value_store'):
+        return KeyValueStoreSink()
+    if sink_type == 'local':
+        return LocalDirectorySink(config.get('directory') or './output')
+    if sink_type == 's3':
+        return S3Sink(**config)
+    raise ValueError(f"Unknown output sink type: {sink_type}")
+
+
+def _sink_config_from_input(inp: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate Actor input fields into an output sink configuration."""
+    sink_type = (inp.get('outputSink') or 'kv').lower()
+    if sink_type == 'local':
+        return {'type': 'local', 'directory': inp.get('localOutputDir') or './output'}
+    if sink_type == 's3':
+        return {
+            'type': 's3',
+            'bucket': inp.get('s3Bucket'),
+            'prefix': inp.get('s3Prefix') or '',
+            'endpoint_url': inp.get('s3EndpointUrl'),
+            'region': inp.get('s3Region'),
+            'access_key_id': inp.get('s3AccessKeyId'),
+            'secret_access_key': inp.get('s3SecretAccessKey'),
+            'public_url_base': inp.get('s3PublicUrlBase'),
+        }
+    return {'type': 'kv'}
+
+
+class _HashingWriter(SinkWriter):
+    """Hashes every chunk on its way to an inner writer (or nowhere, when only hashing)."""
+
+    def __init__(self, inner: SinkWriter | None, key: str, content_type: str) -> None:
+        super().__init__(key, content_type)
+        self.inner = inner
+        self.digest = ContentDigest()
+
+    async def write(self, chunk: bytes) -> None:
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        if self.inner is not None:
+            await self.inner.write(chunk)
+
+    async def close(self) -> str | None:
+        return await self.inner.close() if self.inner is not None else None
+
+    async def abort(self) -> None:
+        if self.inner is not None:
+            await self.inner.abort()
+
+
+class _GrowingFileUploader:
+    """
+    Streams a file into a sink writer while yt-dlp is still downloading it.
+
+    The progress hook (download thread) reports the temp file and how many bytes are on
+    disk; an async pump hashes newly written bytes (while they are still in the page
+    cache) and forwards them to the writer. Without a sink the file is only hashed.
+    Streaming is abandoned when the download produces several files (merges), restarts,
+    or the final output turns out to be a different file (post-processing); the caller
+    then stores (and hashes) the finished file normally.
+    """
+
+    def __init__(self, sink: OutputSink | None, video_id: str) -> None:
+        self._sink = sink
+        self._video_id = video_id
+        self._lock = threading.Lock()
+        self._filename: str | None = None
+        self._tmpfilename: str | None = None
+        self._available = 0
+        self._abandoned = False
+        self._done = False
+        self._file = None
+        self._offset = 0
+        self.writer: _HashingWriter | None = None
+        self.digest: ContentDigest | None = None
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._pump())
+
+    def on_progress(self, d: Dict[str, Any]) -> None:
+        """yt-dlp progress hook (called from the download thread)."""
+        if d.get('status') != 'downloading':
+            return
+        with self._lock:
+            filename = d.get('filename')
+            downloaded = d.get('downloaded_bytes') or 0
+            if self._filename is None:
+                self._filename = filename
+                self._tmpfilename = d.get('tmpfilename') or filename
+            elif filename != self._filename or downloaded < self._available:
+                self._abandoned = True
+            self._available = max(self._available, downloaded)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _pump(self) -> None:
+        while not self._done:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                abandoned, tmpfilename, available = self._abandoned, self._tmpfilename, self._available
+            if abandoned:
+                return
+            if self._file is None:
+                if not tmpfilename or not os.path.exists(tmpfilename):
+                    continue
+                self._file = await asyncio.to_thread(open, tmpfilename, 'rb')
+                extension = Path(self._filename).suffix.lstrip('.').lower()
+                key = _generate_safe_key(self._video_id, extension)
+                content_type = _guess_content_type(extension)
+                inner = await self._sink.open_writer(key, content_type) if self._sink is not None else None
+                self.writer = _HashingWriter(inner, key, content_type)
+            while self._offset < available:
+                chunk = await asyncio.to_thread(self._file.read, min(SINK_CHUNK_SIZE, available - self._offset))
+                if not chunk:
+                    break
+                self._offset += len(chunk)
+                await self.writer.write(chunk)
+
+    @property
+    def uploads(self) -> bool:
+        """True when bytes go to a sink (not just through the hash)."""
+        return self._sink is not None
+
+    async def finish(self, final_path: Path | None) -> tuple[str, int, str | None] | None:
+        """
+        Complete the streamed object if it matches the final output file.
+
+        On success, digest holds the hash of the complete file.
+
+        Returns:
+            (key, size, url) when the streamed object was completed, otherwise None
+        """
+        self._done = True
+        self._wakeup.set()
+        try:
+            await self._task
+        except Exception as pump_error:
+            Actor.log.warning(f"Streaming upload interrupted: {pump_error}")  # type: ignore
+            self._abandoned = True
+
+        try:
+            try:
+                same_file = (
+                    not self._abandoned and self._file is not None and final_path is not None
+                    and final_path.name == Path(self._filename).name
+                    and os.fstat(self._file.fileno()).st_ino == (await asyncio.to_thread(final_path.stat)).st_ino
+                )
+            except OSError:
+                same_file = False
+            if not same_file:
+                await self.discard()
+                return None
+
+            # The temp file was renamed to the final path; finish reading it to EOF
+            while True:
+                chunk = await asyncio.to_thread(self._file.read, SINK_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await self.writer.write(chunk)
+            if self.writer.size != (await asyncio.to_thread(final_path.stat)).st_size:
+                await self.discard()
+                return None
+            url = await self.writer.close()
+            self.digest = self.writer.digest
+            return self.writer.key, self.writer.size, url
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    async def discard(self) -> None:
+        """Abort the streamed object (download failed or produced a different file)."""
+        self._done = True
+        self._wakeup.set()
+        if not self._task.done():
+            self._task.cancel()
+            with contextlib.suppress(BaseException):
+                await self._task
+        if self.writer is not None:
+            await self.writer.abort()
+            self.writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,107 @@
+"""Lazy imports of the heavy dependencies and startup timing."""
+
+from __future__ import annotations
+
+import contextlib
+import importlib
+import importlib.util
+import shutil
+import threading
+import time
+from typing import Any, Dict
+
+from actor import Actor
+
+
+# ============================================================ #
+#                    LAZY IMPORTS & STARTUP                    #
+# ============================================================ #
+
+# Module import (fresh interpreter, `import main`) must stay under this budget.
+# Checked by `python3 src/main.py --benchmark-import`.
+IMPORT_TIME_BUDGET_SECONDS = 0.75
+
+
+class _LazyModule:
+    """Module proxy that performs the real (thread-safe) import on first attribute access."""
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Any:
+        """Import the module if needed and return it."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    self._module = importlib.import_module(self._name)
+                    _startup_timer.record(f'import_{self._name}', time.perf_counter() - started)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.load(), attr)
+
+
+class StartupTimer:
+    """Collects how long each startup phase took, for the startup timing report."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.phases: Dict[str, float] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] = round(self.phases.get(name, 0.0) + seconds, 4)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block as a named startup phase."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def report(self) -> Dict[str, float]:
+        """Log the startup phases and return them."""
+        with self._lock:
+            phases = dict(self.phases)
+        Actor.log.info("STARTUP TIMING: " + ", ".join(f"{name}={seconds:.3f}s" for name, seconds in phases.items()))  # type: ignore
+        module_import = phases.get('module_import')
+        if module_import is not None and module_import > IMPORT_TIME_BUDGET_SECONDS:
+            Actor.log.warning(f"Module import took {module_import:.3f}s, over the {IMPORT_TIME_BUDGET_SECONDS:.2f}s budget")  # type: ignore
+        return phases
+
+
+_startup_timer = StartupTimer()
+
+# Heavy dependencies are imported on first use (yt-dlp is warmed up in the background
+# while the Actor initializes; scrapling only when a page is actually fetched with it)
+yt_dlp = _LazyModule('yt_dlp')
+scrapling = _LazyModule('scrapling')
+
+SCRAPLING_AVAILABLE = importlib.util.find_spec('scrapling') is not None
+if not SCRAPLING_AVAILABLE:
+    Actor.log.info("scrapling not available — proceeding without scrapling utilities.")  # type: ignore
+
+# Only the presence of ffmpeg-python matters, so avoid importing it
+FFMPEG_AVAILABLE = importlib.util.find_spec('ffmpeg') is not None
+if not FFMPEG_AVAILABLE:
+    Actor.log.info("ffmpeg-python not available — post-processing disabled.")  # type: ignore
+
+
+def _start_background_imports() -> threading.Thread:
+    """Import yt-dlp in a daemon thread so it overlaps with Actor initialization."""
+    thread = threading.Thread(target=yt_dlp.load, name='warmup-imports', daemon=True)
+    thread.start()
+    return thread
+
+
+# The streaming muxer talks to the ffmpeg binary directly (no temp files in between)
+FFMPEG_BINARY = shutil.which('ffmpeg')
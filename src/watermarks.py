@@ -0,0 +1,250 @@
+"""Per-source watermarks for incremental crawling of profiles and other listings."""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import json
+import re
+import threading
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any, Dict
+
+from actor import Actor
+from deadlines import DeadlineExceeded, _check_deadline
+
+
+# ============================================================ #
+#                     INCREMENTAL CRAWLING                     #
+# ============================================================ #
+
+# Named key-value store shared by scheduled runs, and the record holding the watermarks
+WATERMARK_STORE_NAME = 'igdl-watermarks'
+WATERMARKS_KEY = 'WATERMARKS'
+
+# Ids of recently processed items kept per source
+WATERMARK_RECENT_IDS = 200
+
+# Enumeration stops after this many consecutive already-seen items; one more than the
+# 3 posts Instagram lets a profile pin, since pinned posts are old but listed first
+WATERMARK_STOP_AFTER_SEEN = 4
+
+
+def _watermark_source(url: str) -> str:
+    """Watermark key of a listing URL: without query, fragment and trailing slash."""
+    return re.split(r'[?#]', url, maxsplit=1)[0].rstrip('/').lower()
+
+
+def _entry_timestamp(entry: Dict[str, Any]) -> int | None:
+    """Upload time of an entry as a Unix timestamp, from 'timestamp' or 'upload_date'."""
+    if entry.get('timestamp') is not None:
+        return int(entry['timestamp'])
+    try:
+        return int(datetime.strptime(str(entry['upload_date']), '%Y%m%d').replace(tzinfo=UTC).timestamp())
+    except (KeyError, ValueError):
+        return None
+
+
+class WatermarkStore:
+    """
+    Per-source watermarks for incremental crawling.
+
+    A source's watermark holds the newest shortcode and upload time processed so far, the
+    ids of recently processed items and the ids of items to retry. Listings come newest
+    first: an item counts as seen when it was processed or is not newer than the
+    watermark, and enumeration stops after WATERMARK_STOP_AFTER_SEEN consecutive seen
+    items. Items that failed or were left unprocessed are kept for retry, so they come
+    back on the next run even though they are older than the watermark.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.store_name = WATERMARK_STORE_NAME
+        # CLI: watermarks live in this JSON file instead of the key-value store
+        self.path: str | None = None
+        self._sources: Dict[str, Dict[str, Any]] = {}
+        self._touched: set[str] = set()
+        self._lock = threading.Lock()
+        self._stats: collections.Counter = collections.Counter()
+
+    def configure(self, sources: Dict[str, Dict[str, Any]]) -> None:
+        self.enabled = True
+        with self._lock:
+            self._sources = {
+                source: {**watermark, 'ids': list(watermark.get('ids') or []), 'retry': list(watermark.get('retry') or [])}
+                for source, watermark in sources.items()
+            }
+
+    async def _read(self) -> Dict[str, Dict[str, Any]]:
+        if self.path:
+            path = Path(self.path).expanduser()
+            if not await asyncio.to_thread(path.is_file):
+                return {}
+            return json.loads(await asyncio.to_thread(path.read_text, encoding='utf-8')).get('sources') or {}
+        store = await Actor.open_key_value_store(name=self.store_name)  # type: ignore
+        return ((await store.get_value(WATERMARKS_KEY)) or {}).get('sources') or {}
+
+    async def load(self, store_name: str | None = None, path: str | None = None) -> None:
+        self.store_name = store_name or WATERMARK_STORE_NAME
+        self.path = path
+        self.configure(await self._read())
+        Actor.log.info(f"Incremental mode: watermarks for {len(self._sources)} sources loaded")
+
+    def sources(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {source: dict(watermark) for source, watermark in self._sources.items()}
+
+    def _count(self, name: str, count: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += count
+
+    def _watermark(self, source: str) -> Dict[str, Any]:
+        return self._sources.setdefault(_watermark_source(source), {'ids': [], 'retry': []})
+
+    def is_seen(self, source: str, entry: Dict[str, Any]) -> bool:
+        with self._lock:
+            watermark = self._sources.get(_watermark_source(source))
+            if not watermark:
+                return False
+            entry_id = entry.get('id')
+            if entry_id in watermark['ids']:
+                return True
+            if entry_id in watermark['retry']:
+                return False
+            timestamp = _entry_timestamp(entry)
+            newest = watermark.get('newest_timestamp')
+            return timestamp is not None and newest is not None and timestamp <= newest
+
+    def new_entries(self, source: str, entries: Any, max_items: int = 0) -> Any:
+        """Yield the unseen entries of a newest-first listing, stopping once it reaches seen content."""
+        consecutive_seen = 0
+        taken = 0
+        for entry in entries:
+            if not entry:
+                continue
+            if self.is_seen(source, entry):
+                consecutive_seen += 1
+                self._count('skipped_seen')
+                if consecutive_seen >= WATERMARK_STOP_AFTER_SEEN:
+                    self._count('stopped_early')
+                    return
+                continue
+            consecutive_seen = 0
+            self._count('new_items')
+            yield entry
+            taken += 1
+            if max_items > 0 and taken >= max_items:
+                return
+
+    def mark(self, source: str, entry: Dict[str, Any]) -> None:
+        """Record a successfully processed item of a listing."""
+        entry_id = entry.get('id')
+        if not entry_id:
+            return
+        timestamp = _entry_timestamp(entry)
+        with self._lock:
+            watermark = self._watermark(source)
+            if entry_id not in watermark['ids']:
+                watermark['ids'] = [entry_id, *watermark['ids']][:WATERMARK_RECENT_IDS]
+            if entry_id in watermark['retry']:
+                watermark['retry'].remove(entry_id)
+            if timestamp is not None and timestamp >= (watermark.get('newest_timestamp') or 0):
+                watermark['newest_timestamp'] = timestamp
+                watermark['newest_id'] = entry_id
+            watermark.setdefault('newest_id', entry_id)
+            watermark['updated_at'] = datetime.now(UTC).isoformat()
+            self._touched.add(_watermark_source(source))
+
+    def mark_failed(self, source: str, entry: Dict[str, Any]) -> None:
+        """Keep a listing item that failed or was not processed for the next run."""
+        entry_id = entry.get('id')
+        if not entry_id:
+            return
+        with self._lock:
+            watermark = self._watermark(source)
+            if entry_id not in watermark['ids'] and entry_id not in watermark['retry']:
+                watermark['retry'] = [entry_id, *watermark['retry']][:WATERMARK_RECENT_IDS]
+                self._touched.add(_watermark_source(source))
+
+    def updates(self) -> Dict[str, Dict[str, Any]]:
+        """Watermarks of the sources this process marked items for."""
+        with self._lock:
+            return {source: dict(self._sources[source]) for source in self._touched}
+
+    def merge(self, updates: Dict[str, Dict[str, Any]], stats: Dict[str, int] | None = None) -> None:
+        """Fold in watermarks (and counts) from a shard process or another run."""
+        with self._lock:
+            self._stats.update(stats or {})
+            for source, update in updates.items():
+                watermark = self._sources.setdefault(source, {'ids': [], 'retry': []})
+                ids = list(dict.fromkeys([*(update.get('ids') or []), *watermark['ids']]))[:WATERMARK_RECENT_IDS]
+                retry = dict.fromkeys([*(update.get('retry') or []), *watermark['retry']])
+                watermark['ids'] = ids
+                watermark['retry'] = [entry_id for entry_id in retry if entry_id not in ids][:WATERMARK_RECENT_IDS]
+                if (update.get('newest_timestamp') or 0) >= (watermark.get('newest_timestamp') or 0):
+                    for field in ('newest_timestamp', 'newest_id'):
+                        if update.get(field) is not None:
+                            watermark[field] = update[field]
+                watermark['updated_at'] = max(str(watermark.get('updated_at') or ''), str(update.get('updated_at') or '')) or None
+                self._touched.add(source)
+
+    async def save(self) -> None:
+        """Store the watermarks, merged into what concurrent runs stored meanwhile."""
+        if not self.enabled or not self._touched:
+            return
+        try:
+            updates = self.updates()
+            self.configure(await self._read())
+            self.merge(updates)
+            record = {'sources': self.sources(), 'updated_at': datetime.now(UTC).isoformat()}
+            if self.path:
+                path = Path(self.path).expanduser()
+                await asyncio.to_thread(path.write_text, json.dumps(record, indent=2), encoding='utf-8')
+            else:
+                store = await Actor.open_key_value_store(name=self.store_name)  # type: ignore
+                await store.set_value(WATERMARKS_KEY, record)
+            Actor.log.info(f"Watermarks of {len(updates)} sources saved")
+        except Exception as save_error:
+            Actor.log.error(f"Could not save watermarks: {save_error}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'sources': len(self._sources), 'updated_sources': len(self._touched), **self._stats}
+
+
+_watermarks = WatermarkStore()
+
+
+def _extract_new_entries(ydl: Any, url: str, max_items: int) -> Dict[str, Any] | None:
+    """
+    Extract a URL, resolving only the listing entries not seen by earlier runs (blocking).
+
+    The listing is enumerated without processing, so pages past the watermark are never
+    requested and seen items are never resolved. Single items are extracted as usual.
+    """
+    raw = ydl.extract_info(url, download=False, process=False)
+    # Follow a single redirect-style result (e.g. a share URL resolving to a profile)
+    if raw and raw.get('_type') in ('url', 'url_transparent') and raw.get('url') and raw.get('url') != url:
+        raw = ydl.extract_info(raw['url'], download=False, process=False)
+    if not raw or (raw.get('_type') != 'playlist' and 'entries' not in raw):
+        return ydl.process_ie_result(raw, download=False) if raw else raw
+
+    entries = []
+    for entry in _watermarks.new_entries(url, raw.get('entries') or [], max_items):
+        _check_deadline()
+        try:
+            processed = ydl.process_ie_result(entry, download=False)
+        except DeadlineExceeded:
+            raise
+        except Exception as entry_error:
+            Actor.log.warning(f"Could not extract listing entry {entry.get('id') or entry.get('url')}: {entry_error}")  # type: ignore
+            _watermarks.mark_failed(url, entry)
+            continue
+        if processed:
+            entries.append(processed)
+    return {**{field: value for field, value in raw.items() if field != 'entries'}, 'entries': entries}
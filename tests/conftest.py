@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The actor runs as a script from src/; make its modules importable the same way
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
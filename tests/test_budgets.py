@@ -0,0 +1,85 @@
+import asyncio
+import tempfile
+import time
+
+import budgets
+
+
+def test_byte_budget_holds_jobs_that_do_not_fit():
+    async def scenario():
+        budget = budgets.ByteBudget(100)
+        order = []
+
+        async def job(name, nbytes, hold):
+            async with budget.reserve(nbytes):
+                order.append(f'{name}+')
+                await asyncio.sleep(hold)
+                order.append(f'{name}-')
+
+        await asyncio.gather(job('a', 60, 0.05), job('b', 60, 0), job('c', 30, 0))
+        return budget, order
+
+    budget, order = asyncio.run(scenario())
+
+    # 'b' does not fit next to 'a'; 'c' queues behind it to keep the wake-up order
+    assert order.index('b+') > order.index('a-')
+    assert budget.stats()['peak_bytes'] <= 100
+    assert budget.stats()['admitted'] == 3
+    assert budget.stats()['in_use_bytes'] == 0
+
+
+def test_byte_budget_admits_an_oversized_job_alone():
+    async def scenario():
+        budget = budgets.ByteBudget(100)
+        await budget.acquire(500)
+        stats = budget.stats()
+        await budget.release(500)
+        return stats
+
+    stats = asyncio.run(scenario())
+
+    assert stats['oversized'] == 1
+    assert stats['active_jobs'] == 1
+
+
+def test_byte_budget_admits_lower_priority_values_first():
+    async def scenario():
+        budget = budgets.ByteBudget(100)
+        order = []
+        await budget.acquire(100)
+
+        async def job(name, priority):
+            async with budget.reserve(60, priority=priority):
+                order.append(name)
+
+        waiters = [asyncio.create_task(job('late', 5.0)), asyncio.create_task(job('soon', 1.0))]
+        await asyncio.sleep(0.01)
+        await budget.release(100)
+        await asyncio.gather(*waiters)
+        return order
+
+    assert asyncio.run(scenario()) == ['soon', 'late']
+
+
+def test_concurrent_first_downloads_share_one_scratch_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    scratch = budgets.ScratchSpace()
+    scratch.configure(quota_bytes=100)
+    # A slow stale-root sweep widens the window in which first downloads overlap
+    monkeypatch.setattr(scratch, '_remove_stale_roots', lambda base_dir: time.sleep(0.05))
+
+    async def download(nbytes):
+        async with scratch.acquire(nbytes) as work_dir:
+            await asyncio.sleep(0.01)
+            return work_dir
+
+    async def scenario():
+        return await asyncio.gather(*(download(10) for _ in range(4)))
+
+    try:
+        work_dirs = asyncio.run(scenario())
+        assert len(list(tmp_path.glob(f'{budgets.SCRATCH_DIR_PREFIX}*'))) == 1
+        assert {work_dir.parent for work_dir in work_dirs} == {scratch.root}
+        assert scratch._quota.stats()['in_use_bytes'] == 0
+    finally:
+        scratch.cleanup()
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import pytest
+
+import deadlines
+
+
+@pytest.fixture
+def run_budget(monkeypatch):
+    budget = deadlines.RunBudget()
+    monkeypatch.setattr(deadlines, '_run_budget', budget)
+    return budget
+
+
+def test_run_budget_keeps_a_grace_period(run_budget):
+    run_budget.configure(100)
+
+    assert run_budget.grace_seconds == 10
+    assert 89 < run_budget.remaining() <= 90
+    assert not run_budget.exhausted
+
+
+def test_time_left_is_the_earliest_deadline(run_budget):
+    run_budget.configure(url_timeout=600, stage_timeouts={'download': 30})
+
+    assert deadlines._time_left('download') == (30, 'download')
+    assert deadlines._time_left('unknown') == (None, 'unknown')
+
+    token = deadlines._url_deadline.set(time.monotonic() + 5)
+    try:
+        seconds, scope = deadlines._time_left('download')
+    finally:
+        deadlines._url_deadline.reset(token)
+    assert scope == 'url' and 4 < seconds <= 5
+
+    run_budget.configure(10, grace_seconds=8)
+    seconds, scope = deadlines._time_left('download')
+    assert scope == 'run' and 1 < seconds <= 2
+
+
+def test_run_stage_maps_a_timeout_to_deadline_exceeded(run_budget):
+    run_budget.configure(stage_timeouts={'extract': 0.01})
+
+    with pytest.raises(deadlines.DeadlineExceeded) as raised:
+        asyncio.run(deadlines._run_stage('extract', asyncio.sleep(1)))
+
+    assert raised.value.scope == 'extract'
+    assert run_budget.report()['timeouts'] == {'extract': 1}
+
+
+def test_run_stage_fails_fast_once_the_run_budget_is_spent(run_budget):
+    run_budget.configure(1, grace_seconds=1)
+    stage = asyncio.sleep(0)
+
+    with pytest.raises(deadlines.DeadlineExceeded) as raised:
+        asyncio.run(deadlines._run_stage('download', stage))
+
+    assert raised.value.scope == 'run'
+    assert deadlines._is_run_budget_error(raised.value)
+    assert stage.cr_frame is None  # closed without being awaited
+
+
+def test_run_stage_returns_the_result_and_keeps_other_errors(run_budget):
+    async def value():
+        return 42
+
+    async def broken():
+        raise ValueError('boom')
+
+    assert asyncio.run(deadlines._run_stage('store', value())) == 42
+    with pytest.raises(ValueError):
+        asyncio.run(deadlines._run_stage('store', broken()))
+
+
+def test_parse_stage_timeouts():
+    assert deadlines._parse_stage_timeouts({'download': 600}) == {'download': 600.0}
+    assert deadlines._parse_stage_timeouts(['extract=30', 'store = 5', 'ignored']) == {'extract': 30.0, 'store': 5.0}
+    assert deadlines._parse_stage_timeouts(None) == {}
+    with pytest.raises(ValueError, match="Unknown stage 'upload'"):
+        deadlines._parse_stage_timeouts({'upload': 10})
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+
+import deadlines
+import main
+
+
+@pytest.fixture(autouse=True)
+def quick_hedging(monkeypatch):
+    monkeypatch.setattr(deadlines, '_run_budget', deadlines.RunBudget())
+    monkeypatch.setattr(main, 'HEDGE_DEFAULT_DELAY', 0.05)
+
+
+def _hedger():
+    return main.ExtractionHedger({
+        name: {'build': lambda opts, cookies, temp_dir, name=name: {**opts, 'strategy': name}, 'attempts': 1, 'base_delay': 0}
+        for name in ('primary', 'mobile')
+    })
+
+
+def _extraction(behaviour):
+    """Blocking extraction whose outcome per strategy is (seconds, error or None)."""
+    def run_extraction(opts):
+        seconds, error = behaviour[opts['strategy']]
+        time.sleep(seconds)
+        if error:
+            raise RuntimeError(error)
+        return {'id': 'POST', 'strategy': opts['strategy']}
+    return run_extraction
+
+
+def test_slow_strategy_is_hedged_and_the_first_success_wins():
+    hedger = _hedger()
+    run_extraction = _extraction({'primary': (0.5, None), 'mobile': (0, None)})
+
+    info = asyncio.run(hedger.extract(run_extraction, {}))
+
+    assert info['strategy'] == 'mobile'
+    stats = hedger.stats()
+    assert stats['hedged_on_latency'] == 1
+    assert stats['cancelled'] == 1
+    assert stats['strategies']['mobile']['wins'] == 1
+
+
+def test_bot_check_starts_the_next_strategy_without_waiting():
+    hedger = _hedger()
+    hedger.hedge_delay = lambda name: 30.0
+    run_extraction = _extraction({'primary': (0, 'HTTP Error 429: Too Many Requests'), 'mobile': (0, None)})
+
+    started = time.perf_counter()
+    info = asyncio.run(hedger.extract(run_extraction, {}))
+
+    assert info['strategy'] == 'mobile'
+    assert time.perf_counter() - started < 5
+    assert hedger.stats()['strategies']['primary']['wins'] == 0
+
+
+def test_all_strategies_failing_raises_the_last_error():
+    hedger = _hedger()
+    run_extraction = _extraction({'primary': (0, 'first failure'), 'mobile': (0, 'second failure')})
+
+    with pytest.raises(RuntimeError, match='second failure'):
+        asyncio.run(hedger.extract(run_extraction, {}))
+    assert hedger.stats()['failed'] == 1
+
+
+def test_strategies_are_ranked_by_win_rate():
+    hedger = _hedger()
+    assert hedger.ranked() == ['primary', 'mobile']
+
+    run_extraction = _extraction({'primary': (0, 'blocked'), 'mobile': (0, None)})
+    for _ in range(3):
+        asyncio.run(hedger.extract(run_extraction, {}))
+
+    assert hedger.ranked() == ['mobile', 'primary']
+
+
+def test_hedge_delay_follows_the_latency_percentile():
+    hedger = _hedger()
+    assert hedger.hedge_delay('primary') == main.HEDGE_DEFAULT_DELAY
+
+    hedger._latencies['primary'].extend([float(seconds) for seconds in range(1, 21)])
+    assert hedger.hedge_delay('primary') == 19.0
+
+    hedger._latencies['mobile'].extend([0.01] * main.HEDGE_MIN_SAMPLES)
+    assert hedger.hedge_delay('mobile') == main.HEDGE_MIN_DELAY
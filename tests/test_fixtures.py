@@ -0,0 +1,25 @@
+import fixtures
+
+
+BASELINE = {'urls_per_second': 2.0, 'requests_per_url': 3, 'peak_memory_bytes': 100 * 1024 * 1024, 'loop_stalled_seconds': 1.0}
+
+
+def test_run_within_tolerance_has_no_regressions():
+    summary = {'urls_per_second': 1.85, 'requests_per_url': 3, 'peak_memory_bytes': 105 * 1024 * 1024, 'loop_stalled_seconds': 1.5}
+
+    assert fixtures._compare_with_baseline(summary, BASELINE) == []
+
+
+def test_each_regressed_measure_is_reported():
+    summary = {'urls_per_second': 1.5, 'requests_per_url': 3.5, 'peak_memory_bytes': 200 * 1024 * 1024, 'loop_stalled_seconds': 2.0}
+
+    assert fixtures._compare_with_baseline(summary, BASELINE) == [
+        'throughput 1.500 URLs/s is below the baseline 2.000 URLs/s',
+        '3.5 HTTP requests per URL, baseline 3',
+        'peak memory 200MB exceeds the baseline 100MB',
+        'event loop stalled for 2.00s, baseline 1.00s',
+    ]
+
+
+def test_measures_missing_from_either_side_are_skipped():
+    assert fixtures._compare_with_baseline({'urls_per_second': 0.1}, {'requests_per_url': 1}) == []
@@ -0,0 +1,83 @@
+import types
+
+import pytest
+
+import budgets
+import main
+
+MB = 1024 * 1024
+
+
+def _info(*formats, duration=60):
+    return {'duration': duration, 'formats': [{'url': f"https://cdn.example/{fmt['format_id']}", **fmt} for fmt in formats]}
+
+
+PROGRESSIVE_720 = {'format_id': 'p720', 'height': 720, 'vcodec': 'avc1.64001f', 'acodec': 'mp4a.40.2', 'ext': 'mp4', 'filesize': 20 * MB}
+PROGRESSIVE_480 = {'format_id': 'p480', 'height': 480, 'vcodec': 'avc1.64001e', 'acodec': 'mp4a.40.2', 'ext': 'mp4', 'filesize': 10 * MB}
+VIDEO_1080 = {'format_id': 'v1080', 'height': 1080, 'vcodec': 'avc1.640028', 'acodec': 'none', 'ext': 'mp4', 'filesize': 60 * MB}
+AUDIO = {'format_id': 'a128', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'ext': 'm4a', 'abr': 128, 'filesize': 1 * MB}
+
+
+@pytest.fixture
+def can_merge(monkeypatch):
+    monkeypatch.setattr(main, 'FFMPEG_AVAILABLE', True)
+    monkeypatch.setattr(main, 'FFMPEG_BINARY', '/usr/bin/ffmpeg')
+
+
+@pytest.fixture
+def cannot_merge(monkeypatch):
+    monkeypatch.setattr(main, 'FFMPEG_AVAILABLE', False)
+
+
+def test_height_limit_ranks_formats_within_the_limit_first(can_merge):
+    plan = main.plan_formats(_info(VIDEO_1080, PROGRESSIVE_720, PROGRESSIVE_480, AUDIO), '720p')
+
+    assert plan[:2] == ['p720', 'p480']
+    assert plan[2] == 'v1080+a128'
+
+
+def test_best_merges_video_only_format_with_best_audio(can_merge):
+    plan = main.plan_formats(_info(VIDEO_1080, PROGRESSIVE_720, AUDIO), 'best')
+
+    assert plan[0] == 'v1080+a128'
+
+
+def test_without_ffmpeg_progressive_formats_win(cannot_merge):
+    plan = main.plan_formats(_info(VIDEO_1080, PROGRESSIVE_720, AUDIO), 'best')
+
+    assert plan[0] == 'p720'
+    assert 'v1080+a128' not in plan
+
+
+def test_formats_fitting_the_memory_budget_rank_higher(monkeypatch, cannot_merge):
+    monkeypatch.setattr(main, '_output_sink', types.SimpleNamespace(buffers_whole_file=True))
+    monkeypatch.setattr(main, '_memory_budget', budgets.ByteBudget(15 * MB))
+    same_height = {**PROGRESSIVE_720, 'format_id': 'p720-small', 'filesize': 5 * MB, 'tbr': 100}
+    large = {**PROGRESSIVE_720, 'tbr': 5000}
+
+    assert main.plan_formats(_info(large, same_height), 'best')[0] == 'p720-small'
+
+
+def test_budget_is_ignored_when_the_sink_streams(monkeypatch, cannot_merge):
+    monkeypatch.setattr(main, '_output_sink', types.SimpleNamespace(buffers_whole_file=False))
+    monkeypatch.setattr(main, '_memory_budget', budgets.ByteBudget(15 * MB))
+    same_height = {**PROGRESSIVE_720, 'format_id': 'p720-small', 'filesize': 5 * MB, 'tbr': 100}
+    large = {**PROGRESSIVE_720, 'tbr': 5000}
+
+    assert main.plan_formats(_info(large, same_height), 'best')[0] == 'p720'
+
+
+def test_audio_only_prefers_audio_formats(can_merge):
+    plan = main.plan_formats(_info(VIDEO_1080, PROGRESSIVE_720, PROGRESSIVE_480, AUDIO), 'audio_only')
+
+    # Audio first, then the smallest progressive format as a fallback source
+    assert plan[:3] == ['a128', 'p480', 'p720']
+
+
+def test_plan_is_limited_and_skips_unusable_formats(can_merge):
+    storyboard = {'format_id': 'sb0', 'vcodec': 'none', 'acodec': 'none', 'ext': 'mhtml'}
+    info = _info(VIDEO_1080, PROGRESSIVE_720, PROGRESSIVE_480, AUDIO, storyboard)
+
+    assert len(main.plan_formats(info, 'best', max_candidates=2)) == 2
+    assert 'sb0' not in main.plan_formats(info, 'best')
+    assert main.plan_formats({'formats': []}, 'best') == []
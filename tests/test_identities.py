@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import identities
+
+
+def _pool(cookie_sets, requests_per_minute=0.0):
+    pool = identities.IdentityPool()
+    pool.configure(cookie_sets, requests_per_minute)
+    return pool
+
+
+def _acquire(pool, **kwargs):
+    return asyncio.run(pool.acquire(**kwargs))
+
+
+def test_identities_are_used_round_robin_and_deduplicated():
+    pool = _pool(['jar-a', 'jar-b', 'jar-a', ' '])
+
+    assert [identity.name for identity in pool.identities] == ['identity-1', 'identity-2']
+    assert [_acquire(pool).cookies for _ in range(3)] == ['jar-a', 'jar-b', 'jar-a']
+
+
+def test_extractions_per_minute_are_limited_per_identity():
+    pool = _pool(['jar-a'], requests_per_minute=60)
+
+    assert _acquire(pool) is not None
+    assert _acquire(pool, wait=False) is None
+    assert pool.stats()['unavailable'] == 1
+
+
+def test_rate_limited_identity_rests_for_longer_each_time():
+    pool = _pool(['jar-a', 'jar-b'])
+    first = _acquire(pool)
+
+    assert pool.record(first, 'HTTP Error 429: Too Many Requests')
+    assert first.state == 'resting'
+    rest = first.rest_until - time.monotonic()
+    assert identities.IDENTITY_REST_SECONDS - 5 < rest <= identities.IDENTITY_REST_SECONDS
+    assert [_acquire(pool).name for _ in range(2)] == ['identity-2', 'identity-2']
+
+    pool.record(first, 'Please wait a few minutes: rate limit')
+    assert first.rest_until - time.monotonic() > 2 * identities.IDENTITY_REST_SECONDS - 5
+
+    pool.record(first)
+    assert first.strikes == 0
+
+
+def test_identity_is_retired_after_repeated_auth_failures():
+    pool = _pool(['jar-a', 'jar-b'])
+    identity = pool.identities[0]
+
+    for _ in range(identities.IDENTITY_MAX_AUTH_FAILURES - 1):
+        assert pool.record(identity, 'Login required')
+    assert identity.state == 'healthy'
+    pool.record(identity, 'Login required')
+
+    assert identity.state == 'expired'
+    assert {_acquire(pool).name for _ in range(3)} == {'identity-2'}
+    assert _acquire(pool, exclude=[pool.identities[1]]) is None
+
+
+def test_other_failures_do_not_rotate_the_identity():
+    pool = _pool(['jar-a'])
+    identity = _acquire(pool)
+
+    assert not pool.record(identity, 'Unsupported URL')
+    assert identity.state == 'healthy'
+    assert identity.report()['failed'] == 1
+
+
+def test_refreshed_cookie_jar_replaces_the_identity_jar():
+    pool = _pool(['# Netscape HTTP Cookie File\nold'])
+    identity = _acquire(pool)
+    jar = '# Netscape HTTP Cookie File\n.instagram.com\tTRUE\t/\tTRUE\t0\tsessionid\tnew\n'
+
+    pool.record(identity, cookie_jar=jar)
+
+    assert identity.cookies.endswith('sessionid\tnew\n')
+    assert identity.report()['jar_refreshed'] == 1
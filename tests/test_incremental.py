@@ -0,0 +1,68 @@
+import watermarks
+
+SOURCE = 'https://www.instagram.com/natgeo/'
+
+
+def _listing(*ids, start=1_700_000_000):
+    # Newest first, one day apart
+    return [{'id': entry_id, 'timestamp': start - index * 86400} for index, entry_id in enumerate(ids)]
+
+
+def _ids(entries):
+    return [entry['id'] for entry in entries]
+
+
+def test_unknown_source_yields_everything_up_to_max_items():
+    store = watermarks.WatermarkStore()
+    store.configure({})
+
+    assert _ids(store.new_entries(SOURCE, _listing('a', 'b', 'c'))) == ['a', 'b', 'c']
+    assert _ids(store.new_entries(SOURCE, _listing('a', 'b', 'c'), max_items=2)) == ['a', 'b']
+
+
+def test_enumeration_stops_after_consecutive_seen_items():
+    store = watermarks.WatermarkStore()
+    store.configure({})
+    for entry in _listing('old1', 'old2', 'old3', 'old4', 'old5', start=1_600_000_000):
+        store.mark(SOURCE, entry)
+
+    listing = iter(_listing('new', 'old1', 'old2', 'old3', 'old4', 'old5'))
+    new = _ids(store.new_entries(SOURCE, listing))
+
+    assert new == ['new']
+    # Later pages are never requested
+    assert _ids(listing) == ['old5']
+    assert store.stats() == {'new_items': 1, 'skipped_seen': watermarks.WATERMARK_STOP_AFTER_SEEN, 'stopped_early': 1}
+
+
+def test_pinned_seen_posts_do_not_stop_enumeration():
+    store = watermarks.WatermarkStore()
+    store.configure({watermarks._watermark_source(SOURCE): {'ids': ['pinned1', 'pinned2', 'pinned3']}})
+    listing = [{'id': 'pinned1'}, {'id': 'pinned2'}, {'id': 'pinned3'}, *_listing('new1', 'new2')]
+
+    assert _ids(store.new_entries(SOURCE, listing)) == ['new1', 'new2']
+
+
+def test_items_older_than_the_watermark_count_as_seen_unless_kept_for_retry():
+    store = watermarks.WatermarkStore()
+    store.configure({})
+    store.mark(SOURCE, {'id': 'newest', 'timestamp': 1_700_000_000})
+    store.mark_failed(SOURCE.rstrip('/') + '?hl=en', {'id': 'failed', 'timestamp': 1_600_000_000})
+
+    assert store.is_seen(SOURCE, {'id': 'older', 'upload_date': '20200101'})
+    assert not store.is_seen(SOURCE, {'id': 'failed', 'timestamp': 1_600_000_000})
+    assert not store.is_seen(SOURCE, {'id': 'undated'})
+
+    store.mark(SOURCE, {'id': 'failed', 'timestamp': 1_600_000_000})
+    assert store.updates()[watermarks._watermark_source(SOURCE)]['retry'] == []
+
+
+def test_merge_keeps_the_newest_watermark():
+    store = watermarks.WatermarkStore()
+    store.configure({'source': {'ids': ['a'], 'newest_id': 'a', 'newest_timestamp': 200}})
+    store.merge({'source': {'ids': ['b'], 'newest_id': 'b', 'newest_timestamp': 100}}, {'new_items': 1})
+
+    watermark = store.sources()['source']
+    assert watermark['ids'] == ['b', 'a']
+    assert (watermark['newest_id'], watermark['newest_timestamp']) == ('a', 200)
+    assert store.stats() == {'new_items': 1}
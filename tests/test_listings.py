@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+import main
+import watermarks
+
+PROFILE_URL = 'https://www.instagram.com/natgeo/'
+
+
+class FakeYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL: serves canned listings, resolves URL stubs to items."""
+
+    listings: dict = {}
+    resolved: list = []
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False, process=True):
+        if url in self.listings:
+            listing = self.listings[url]
+            # Listings page lazily, like the real extractor
+            return {**listing, 'entries': (entry for entry in listing['entries'])}
+        shortcode = url.rstrip('/').rsplit('/', 1)[-1]
+        return self.process_ie_result({'_type': 'url', 'url': url, 'id': shortcode})
+
+    def process_ie_result(self, entry, download=False):
+        self.resolved.append(entry['id'])
+        return {'id': entry['id'], 'title': f"Post {entry['id']}", 'webpage_url': entry['url'], 'uploader': 'natgeo'}
+
+
+def _profile_listing(count):
+    return {
+        '_type': 'playlist',
+        'id': 'natgeo',
+        'title': 'natgeo',
+        'entries': [
+            {'_type': 'url', 'url': f'https://www.instagram.com/p/POST{i}/', 'id': f'POST{i}'}
+            for i in range(count)
+        ],
+    }
+
+
+class ListWriter:
+    def __init__(self):
+        self.records = []
+
+    async def push(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_ydl(monkeypatch):
+    monkeypatch.setattr(FakeYoutubeDL, 'listings', {PROFILE_URL: _profile_listing(6)})
+    monkeypatch.setattr(FakeYoutubeDL, 'resolved', [])
+    monkeypatch.setattr(main.yt_dlp, 'YoutubeDL', FakeYoutubeDL)
+    monkeypatch.setattr(main, '_fetch_page_html', lambda url: None)
+    return FakeYoutubeDL
+
+
+def _use_watermarks(monkeypatch, store):
+    # main and the watermarks module each hold a reference to the singleton
+    monkeypatch.setattr(main, '_watermarks', store)
+    monkeypatch.setattr(watermarks, '_watermarks', store)
+
+
+@pytest.mark.parametrize('url', [
+    PROFILE_URL,
+    'https://www.instagram.com/natgeo',
+    'https://instagram.com/natgeo/?hl=en',
+    'https://www.instagram.com/natgeo/reels/',
+    'https://www.instagram.com/natgeo/tagged/',
+    'https://www.instagram.com/explore/tags/wildlife/',
+    'https://www.instagram.com/p/C3v8HnK8JdL/',
+    'https://www.instagram.com/natgeo/reel/C4d9IpL9KeM/',
+])
+def test_content_and_listing_urls_are_accepted(url):
+    assert main._validate_instagram_url(main._normalize_instagram_url(url))
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.instagram.com/',
+    'https://www.instagram.com/explore/',
+    'https://www.instagram.com/accounts/login/',
+    'https://www.instagram.com/natgeo/followers/',
+    'https://example.com/natgeo/',
+])
+def test_site_pages_are_rejected(url):
+    assert not main._validate_instagram_url(url)
+
+
+def test_profile_url_reaches_incremental_extraction(monkeypatch, fake_ydl):
+    store = watermarks.WatermarkStore()
+    # Every post was processed by an earlier run: the listing stops without resolving any
+    store.configure({watermarks._watermark_source(PROFILE_URL): {'ids': [f'POST{i}' for i in range(6)]}})
+    _use_watermarks(monkeypatch, store)
+    writer = ListWriter()
+    monkeypatch.setattr(main, '_result_writer', writer)
+
+    calls = []
+    extract_new_entries = main._extract_new_entries
+
+    def spy(ydl, url, max_items):
+        calls.append(url)
+        return extract_new_entries(ydl, url, max_items)
+
+    monkeypatch.setattr(main, '_extract_new_entries', spy)
+
+    async def urls():
+        yield PROFILE_URL
+
+    asyncio.run(main.process_url_stream(urls(), 'videos', 'best', 0, max_concurrency=1))
+
+    assert calls == [PROFILE_URL]
+    assert fake_ydl.resolved == []
+    assert store.stats() == {'skipped_seen': watermarks.WATERMARK_STOP_AFTER_SEEN, 'stopped_early': 1}
+    assert not any(record.get('error') == 'Invalid or unsupported Instagram URL' for record in writer.records)
+
+
+def test_metadata_listing_returns_stubs_and_resolves_them(monkeypatch, fake_ydl):
+    _use_watermarks(monkeypatch, watermarks.WatermarkStore())
+    monkeypatch.setattr(main, 'METADATA_BATCH_SIZE', 2)
+
+    listing = main._extract_metadata_listing(PROFILE_URL, {}, 5)
+
+    assert listing['_type'] == 'playlist'
+    assert listing['webpage_url'] == PROFILE_URL
+    assert [entry['_type'] for entry in listing['entries']] == ['url'] * 5
+    assert fake_ydl.resolved == []
+
+    resolved = asyncio.run(main._resolve_metadata_stubs(listing['entries'], {}))
+
+    assert [entry['id'] for entry in resolved] == [f'POST{i}' for i in range(5)]
+    assert all(set(entry) == set(main.METADATA_FIELDS) for entry in resolved)
+    assert resolved[0]['title'] == 'Post POST0'
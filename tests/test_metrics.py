@@ -0,0 +1,52 @@
+import metrics
+
+
+def test_render_uses_the_prometheus_text_format():
+    registry = metrics.MetricsRegistry()
+    results = registry.counter('results', 'Result records written.', ('outcome',))
+    in_flight = registry.gauge('in_flight', 'URLs in flight.')
+    seconds = registry.histogram('stage_seconds', 'Stage durations.', ('stage',), buckets=(1.0, 2.5))
+    results.inc(outcome='success')
+    results.inc(2, outcome='error')
+    in_flight.set(3)
+    in_flight.dec()
+    seconds.observe(0.5, stage='download')
+    seconds.observe(2.0, stage='download')
+    seconds.observe(7.25, stage='download')
+
+    assert registry.render() == '\n'.join([
+        '# HELP igdl_results Result records written.',
+        '# TYPE igdl_results counter',
+        'igdl_results_total{outcome="error"} 2',
+        'igdl_results_total{outcome="success"} 1',
+        '# HELP igdl_in_flight URLs in flight.',
+        '# TYPE igdl_in_flight gauge',
+        'igdl_in_flight 2',
+        '# HELP igdl_stage_seconds Stage durations.',
+        '# TYPE igdl_stage_seconds histogram',
+        'igdl_stage_seconds_bucket{stage="download",le="1"} 1',
+        'igdl_stage_seconds_bucket{stage="download",le="2.5"} 2',
+        'igdl_stage_seconds_bucket{stage="download",le="+Inf"} 3',
+        'igdl_stage_seconds_sum{stage="download"} 9.75',
+        'igdl_stage_seconds_count{stage="download"} 3',
+    ]) + '\n'
+
+
+def test_label_values_are_escaped():
+    registry = metrics.MetricsRegistry()
+    registry.counter('errors', 'Errors.', ('message',)).inc(message='say "hi"\\\n')
+
+    assert 'igdl_errors_total{message="say \\"hi\\"\\\\\\n"} 1' in registry.render()
+
+
+def test_collectors_run_before_rendering_and_failures_are_ignored():
+    registry = metrics.MetricsRegistry()
+    queued = registry.gauge('queued', 'Queued requests.')
+
+    @registry.collector
+    def broken():
+        raise RuntimeError('collector failed')
+
+    registry.collector(lambda: queued.set(7))
+
+    assert 'igdl_queued 7' in registry.render()
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import main
+
+REEL_URL = 'https://www.instagram.com/reel/ABC123/'
+
+
+class ListWriter:
+    def __init__(self):
+        self.records = []
+
+    async def push(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    writer = ListWriter()
+    monkeypatch.setattr(main, '_result_writer', writer)
+    monkeypatch.setattr(main, '_fetch_page_html', lambda url: None)
+    # Retry at once and skip the pacing delay between requests
+    monkeypatch.setattr(main, '_queue_retry_delay', lambda retry_count: 0.01)
+    monkeypatch.setattr(main.random, 'uniform', lambda low, high: 0)
+    return writer
+
+
+def _flaky_extraction(monkeypatch, *errors):
+    attempts = []
+
+    async def extract(run_extraction, opts, cookies, temp_dir):
+        attempts.append(opts)
+        if len(attempts) <= len(errors):
+            raise RuntimeError(errors[len(attempts) - 1])
+        return {'id': 'ABC123', 'title': 'Reel', 'webpage_url': REEL_URL}
+
+    monkeypatch.setattr(main._extraction_hedger, 'extract', extract)
+    return attempts
+
+
+def _run(*urls):
+    async def source():
+        for url in urls:
+            yield url
+
+    return asyncio.run(main.process_url_stream(source(), 'metadata_only', 'best', 0, max_concurrency=1))
+
+
+def test_rate_limited_url_is_retried_through_the_queue(monkeypatch, writer):
+    attempts = _flaky_extraction(monkeypatch, 'HTTP Error 429: Too Many Requests')
+
+    assert _run(REEL_URL) == (1, 1)
+
+    assert len(attempts) == 2
+    assert main._run_metrics['request_queue']['retried'] >= 1
+    assert len(writer.records) == 1
+    assert 'error' not in writer.records[0]
+
+
+def test_permanent_failure_is_recorded_without_retrying(monkeypatch, writer):
+    attempts = _flaky_extraction(monkeypatch, 'Video unavailable', 'Video unavailable')
+
+    assert _run(REEL_URL) == (1, 0)
+
+    assert len(attempts) == 1
+    assert main._run_metrics['request_queue']['retried'] == 0
+    assert [record['error'] for record in writer.records] == ['Video unavailable']
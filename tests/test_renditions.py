@@ -0,0 +1,22 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('quality, expected', [
+    (None, ['best']),
+    ('', ['best']),
+    ('720p', ['720p']),
+    (' 1080P, 720p ,1080p', ['1080p', '720p']),
+    (['best', 'AUDIO_ONLY', 'best'], ['best', 'audio_only']),
+    ([' ', ''], ['best']),
+])
+def test_normalize_qualities(quality, expected):
+    assert main._normalize_qualities(quality) == expected
+
+
+def test_audio_rendition_uses_the_audio_extraction_arguments(tmp_path):
+    source, target = tmp_path / 'v.mp4', tmp_path / 'v_audio_only.mp3'
+
+    assert main._rendition_ffmpeg_args(source, target, 'audio_only') == main._audio_extraction_args(source, target)
+    assert main.POSTPROCESS_AUDIO_BITRATE in main._audio_extraction_args(source, target)
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import threading
+import time
+import types
+
+import pytest
+
+import main
+import sharding
+import sinks
+import watermarks
+
+
+@pytest.mark.parametrize('count, shard_count, sizes', [
+    (10, 3, [4, 3, 3]),
+    (9, 3, [3, 3, 3]),
+    (2, 4, [1, 1]),
+    (5, 0, [5]),
+])
+def test_split_into_shards_sizes(count, shard_count, sizes):
+    shards = sharding._split_into_shards(list(range(count)), shard_count)
+
+    assert [len(shard) for shard in shards] == sizes
+
+
+def test_split_into_shards_keeps_contiguous_order():
+    urls = [f'https://www.instagram.com/p/{i}/' for i in range(7)]
+
+    shards = sharding._split_into_shards(urls, 3)
+
+    assert [url for shard in shards for url in shard] == urls
+
+
+def test_shared_breaker_flag_clears_after_the_cooldown(monkeypatch):
+    monkeypatch.setattr(main, '_failure_count', 0)
+    monkeypatch.setattr(main, '_success_count', 0)
+    monkeypatch.setattr(main, '_circuit_breaker_open', False)
+    flag = threading.Event()
+
+    for _ in range(5):
+        main._record_failure()
+    main._sync_shared_breaker(flag)
+    assert flag.is_set()
+
+    # Still open within the cooldown, even without new outcomes
+    main._sync_shared_breaker(flag)
+    assert flag.is_set()
+
+    monkeypatch.setattr(main, '_circuit_opened_at', time.monotonic() - main.CIRCUIT_BREAKER_COOLDOWN)
+    main._sync_shared_breaker(flag)
+    assert not flag.is_set()
+    assert (main._failure_count, main._success_count) == (0, 0)
+
+
+def test_local_workers_get_and_return_the_coordinator_features(tmp_path, monkeypatch):
+    store = watermarks.WatermarkStore()
+    store.configure({'natgeo': {'ids': ['A'], 'retry': []}})
+    monkeypatch.setattr(sharding, '_watermarks', store)
+    merged_profiles = []
+    profiler = types.SimpleNamespace(active=True, add_shard=lambda *shard: merged_profiles.append(shard))
+    monkeypatch.setattr(sharding, '_profiler', profiler)
+    fixture_settings = {'mode': 'replay', 'directory': 'fx', 'media_mode': 'placeholder', 'time_scale': 0.0}
+    monkeypatch.setattr(sharding, '_fixtures', types.SimpleNamespace(describe=lambda: fixture_settings))
+    runner = sharding.LocalShardRunner({}, sinks.LocalDirectorySink(str(tmp_path / 'media')), 'fifo')
+    shard_dir = tmp_path / 'shard'
+    shard_dir.mkdir()
+    try:
+        command = runner._command(shard_dir)
+
+        assert command[command.index('--incremental') + 1] == str(shard_dir / 'watermarks.json')
+        assert command[command.index('--profile') + 1] == str(shard_dir / 'profile')
+        assert command[command.index('--replay-fixtures') + 1] == 'fx'
+        assert command[command.index('--replay-speed') + 1] == '0.0'
+
+        # What the worker leaves behind when it finishes
+        (shard_dir / 'watermarks.json').write_text(json.dumps({'sources': {'natgeo': {'ids': ['B', 'A'], 'retry': []}}}))
+        (shard_dir / 'profile').mkdir()
+        (shard_dir / 'profile' / 'profile.json').write_text(json.dumps({'samples': 3}))
+        (shard_dir / 'profile' / 'profile.stacks.txt').write_text('main;work 250\n')
+        asyncio.run(runner.merge_state(1, {'dir': shard_dir}))
+    finally:
+        runner.cleanup()
+
+    assert store.sources()['natgeo']['ids'] == ['B', 'A']
+    assert merged_profiles == [(1, {'samples': 3}, {'main;work': 0.25})]